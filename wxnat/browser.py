@@ -16,23 +16,33 @@ and *Download* and *Cancel* buttons.
 
 
 import os.path         as op
-import                    re
-import                    fnmatch
 import                    logging
+import                    threading
 import                    collections
+import concurrent.futures as futures
 
 import                    wx
+import wx.dataview     as dv
 import wx.lib.newevent as wxevent
 
-import xnat
-
 import fsleyes_widgets.placeholder_textctrl as pt
 import fsleyes_widgets.autotextctrl         as at
 import fsleyes_widgets.utils.status         as status
 import fsleyes_widgets.utils.progress       as progress
 import fsleyes_widgets.widgetgrid           as wgrid
 
-import wxnat.icons as icons
+import wxnat.icons      as icons
+import wxnat.dataview   as dataview
+import wxnat.fetch      as fetch
+import wxnat.cache      as cache
+import wxnat.filtering  as filtering
+import wxnat.search     as search
+import wxnat.store      as store
+import wxnat.download   as download
+import wxnat.connection as connection
+import wxnat.projects   as projects
+import wxnat.sessions   as sessions
+import wxnat.interface  as interface
 
 
 log = logging.getLogger(__name__)
@@ -72,6 +82,13 @@ each level of the XNAT hierarchy.
 """
 
 
+SERVER_FILTER_LEVELS = ['subject', 'experiment']
+"""Levels of the XNAT hierarchy for which filters may be evaluated by the
+XNAT server, when server-side filtering is enabled (see the ``serverFilters``
+argument to :meth:`XNATBrowserPanel.__init__`).
+"""
+
+
 XNAT_INFO_ATTS = {
     'project'    : ['id', 'name'],
     'subject'    : ['id', 'label'],
@@ -94,6 +111,8 @@ LABELS = {
     'disconnect'   : 'Disconnect',
     'connecting'   : 'Connecting to {} ...',
     'refresh'      : 'Refresh',
+    'loading'      : 'Loading ...',
+    'more'         : 'Load next {} of {} remaining {} ...',
     'filter'       : 'Filter by',
     'connected'    : u'\u2022',
     'disconnected' : u'\u2022',
@@ -121,10 +140,34 @@ LABELS = {
     'download.error.message' :
     'An error occurred while trying to download {}',
 
+    'download.files.title'         : 'Downloading files',
+    'download.files.startMessage'  : 'Downloading {} files ...',
+    'download.files.updateMessage' :
+    'Downloaded {} of {} files ({:0.2f} MB, {:0.2f} MB/s)',
+    'download.files.eta'           : '{} - {:d}:{:02d} remaining',
+    'download.files.error.message' :
+    'An error occurred while trying to download {} of {} files: {}',
+
+    'download.archive.title'         : 'Downloading archive',
+    'download.archive.startMessage'  : 'Downloading {} {} ...',
+    'download.archive.updateMessage' : 'Downloading {} {} ({:0.2f} MB)',
+
+    'projects.error.title'   : 'Error listing projects',
+    'projects.error.message' :
+    'An error occurred while retrieving the list of projects',
+
     'expand.error.title'   : 'Error downloading XNAT data',
     'expand.error.message' :
     'An error occurred while communicating with the XNAT server',
 
+    'search'               : 'Search',
+
+    'filter.error.title'   : 'Invalid filter',
+    'filter.error.message' : 'The {} filter pattern is invalid: {}',
+
+    'info.files' : 'Loaded files',
+    'info.size'  : 'Loaded size',
+
 
     'projects'    : 'Projects',
     'project'     : 'Project',
@@ -169,20 +212,46 @@ TOOLTIPS = {
     'filter.regexp' :
     'Items with a label that does not match these regular expressions '
     'will be hidden in the browser.',
+    'search'        :
+    'Search the names and IDs of all items that have been loaded. Push '
+    'enter to move to the next match.',
+    'project'       :
+    'Type to filter the list of projects by ID or name. Push enter to '
+    'select the first match.',
 }
 """This dictionary contains tooltips for various things in the user interface.
 """
 
 
+DEFAULT_PAGE_SIZE = 100
+"""Default maximum number of children at each level of the XNAT hierarchy
+which are added to the tree browser at once. See the ``pageSizes`` argument
+to :meth:`XNATBrowserPanel.__init__`.
+"""
+
+
 XNAT_INFO_FORMATTERS = {
     'resource.file_size' : lambda s: '{:0.2f} MB'.format(float(s) / 1048576),
-    'file.size'          : lambda s: '{:0.2f} MB'.format(float(s) / 1048576)
+    'file.size'          : lambda s: '{:0.2f} MB'.format(float(s) / 1048576),
+    'info.size'          : lambda s: '{:0.2f} MB'.format(float(s) / 1048576)
 }
 """This dictionary contains string formatters for some attributes that are
 shown in the information panel.
 """
 
 
+XNAT_STORE_ATTS = {
+    'size'      : 'size',
+    'file_size' : 'size',
+    'type'      : 'type',
+}
+"""This dictionary contains mappings between attributes that are shown in the
+information panel, and fields of the :class:`.HierarchyStore`. When a value
+is in the store, it is used instead of the attribute, as accessing some
+attributes results in a request to the XNAT server.
+"""
+
+
 class XNATBrowserPanel(wx.Panel):
     """The ``XNATBrowserPanel`` allows the user to connect to and browse
     a XNAT repository. It contains:
@@ -211,10 +280,16 @@ class XNATBrowserPanel(wx.Panel):
        EndSession
        SessionActive
        GetSelectedFiles
+       GetSelectedItems
        ExpandTreeItem
        DownloadFile
+       DownloadFiles
+       DownloadArchive
        GetHosts
        GetAccounts
+       GetTokens
+       GetCacheStats
+       GetHierarchyStore
     """
 
 
@@ -223,7 +298,25 @@ class XNATBrowserPanel(wx.Panel):
                  knownHosts=None,
                  knownAccounts=None,
                  filterType=None,
-                 filters=None):
+                 filters=None,
+                 workers=None,
+                 listWorkers=None,
+                 expandWorkers=None,
+                 pageSizes=None,
+                 virtualTree=False,
+                 bulkListing=True,
+                 cacheFile=None,
+                 cacheTTL=None,
+                 cacheSize=None,
+                 serverFilters=False,
+                 flatLoading=False,
+                 downloadWorkers=None,
+                 connectTimeout=None,
+                 shareSessions=True,
+                 poolSize=None,
+                 keepAlive=True,
+                 knownTokens=None,
+                 persistTokens=False):
         """Create a ``XNATBrowserPanel``.
 
         :arg parent:        ``wx`` parent object.
@@ -244,13 +337,139 @@ class XNATBrowserPanel(wx.Panel):
         :arg filters:       Mapping containing initial filter values. Must
                             be of the form  ``{ level : pattern }``, where
                             ``level`` is the name of an XNAT hierarchy level
-                            (e.g. ``'subject'``, ``'file'``, etc.).
+                            (e.g. ``'subject'``, ``'file'``, etc.). An
+                            :exc:`.InvalidFilter` error is raised if any of
+                            the patterns are invalid.
+
+        :arg workers:       Maximum number of tree items which may be loaded
+                            from the XNAT server concurrently, in the
+                            background. Defaults to 4.
+
+        :arg listWorkers:   Maximum number of child collections (e.g. the
+                            scans and resources of an experiment) which may
+                            be listed from the XNAT server concurrently.
+                            Defaults to 4.
+
+        :arg expandWorkers: Maximum number of listings which may be
+                            requested concurrently when recursively
+                            expanding part of the XNAT hierarchy. Defaults
+                            to 8.
+
+        :arg pageSizes:     Mapping of the form ``{ level : size }``,
+                            specifying the maximum number of items at each
+                            level of the XNAT hierarchy (e.g. ``'subject'``)
+                            which are added to the tree browser at a time.
+                            When an item has more children than this, a
+                            *Load next* item is added, allowing the user to
+                            load the next page of children. Levels which are
+                            not specified default to
+                            :data:`DEFAULT_PAGE_SIZE`. A size of ``0``
+                            disables paging for a level.
+
+        :arg virtualTree:   If ``True``, a :class:`.XNATDataViewTree` is used
+                            for the tree browser instead of a
+                            ``wx.TreeCtrl``. This is a virtual control which
+                            scales better to very large numbers of items.
+                            Defaults to ``False``.
+
+        :arg bulkListing:   If ``True`` (the default), the resources and
+                            files of all scans in an experiment are
+                            retrieved with a single request when the first
+                            scan is expanded (see :class:`.BulkListing`).
+                            Servers which do not support this fall back to
+                            retrieving each level separately.
+
+        :arg cacheFile:     Path to a file in which listings retrieved from
+                            XNAT servers are cached between sessions (see
+                            :class:`.DiskCache`). Cached listings are
+                            displayed immediately, and re-validated in the
+                            background. If not provided, listings are not
+                            cached on disk.
+
+        :arg cacheTTL:      Time, in seconds, after which listings in the
+                            ``cacheFile`` expire. Defaults to
+                            :data:`.cache.DEFAULT_TTL`.
+
+        :arg cacheSize:     Maximum size, in bytes, of the listings which are
+                            cached in memory (see :class:`.MemoryCache`).
+                            Defaults to :data:`.cache.DEFAULT_SIZE`.
+
+        :arg serverFilters: If ``True``, simple subject and experiment
+                            filters (see :func:`.filtering.serverPattern`)
+                            are passed to the XNAT server, so that only
+                            matching items are retrieved. Other filters are
+                            always applied locally. Defaults to ``False``,
+                            as the XNAT server may match names
+                            case-sensitively, whereas local filters do not.
+
+        :arg flatLoading:   If ``True``, when a project is selected, the
+                            subjects, experiments and scans of the entire
+                            project are retrieved in the background, with a
+                            handful of requests (see
+                            :class:`.ProjectSkeleton`). Items are then added
+                            to the tree without any further requests. Only
+                            the scans of MR sessions are retrieved in this
+                            way - the scans of other experiments are listed
+                            when they are opened. Defaults to ``False``.
+
+        :arg downloadWorkers: Maximum number of files which may be
+                              downloaded concurrently by
+                              :meth:`DownloadFiles`. Defaults to
+                              :data:`.download.DEFAULT_WORKERS`.
+
+        :arg connectTimeout: Timeout, in seconds, for the requests which
+                             are made when connecting to a XNAT server, and
+                             for all later requests made through the
+                             ``xnat`` session (see
+                             :func:`.connection.connectArgs`). May be a
+                             single value, or a ``(connect, read)`` tuple.
+                             Defaults to the ``xnatpy`` default.
+
+        :arg shareSessions: If ``True`` (the default), connections are
+                            shared with all other ``XNATBrowserPanel``
+                            instances which connect to the same host with
+                            the same user, along with their listing caches
+                            (see :class:`.SessionRegistry`). A shared
+                            connection is closed when the last panel that
+                            is using it ends its session.
+
+        :arg poolSize:      Maximum number of HTTP connections that each
+                            worker thread may keep open. Every thread which
+                            communicates with the XNAT server is given its
+                            own HTTP session (see
+                            :class:`.ThreadLocalInterface`). Defaults to
+                            :data:`.interface.DEFAULT_POOL_SIZE`.
+
+        :arg keepAlive:     If ``True`` (the default), HTTP connections are
+                            kept open and re-used. Otherwise they are
+                            closed after every request.
+
+        :arg knownTokens:   A mapping of ``{ host : (username, url, token) }``
+                            containing XNAT session tokens (``JSESSIONID``)
+                            from previous sessions, e.g. as returned by
+                            :meth:`GetTokens`. Only used if
+                            ``persistTokens`` is ``True``.
+
+        :arg persistTokens: If ``True``, session tokens are re-used instead
+                            of logging in, when connecting to a host in
+                            ``knownTokens`` with the same username. A token
+                            is validated with a single request, and a full
+                            login is performed if it has expired. Sessions
+                            are not ended on the XNAT server when they are
+                            closed, so that their tokens remain valid, and
+                            may be retrieved via :meth:`GetTokens`.
+                            Defaults to ``False``.
         """
 
         if knownHosts    is None: knownHosts    = []
         if knownAccounts is None: knownAccounts = {}
         if filterType    is None: filterType    = 'regexp'
         if filters       is None: filters       = {}
+        if workers       is None: workers       = 4
+        if listWorkers   is None: listWorkers   = 4
+        if expandWorkers is None: expandWorkers = 8
+        if pageSizes     is None: pageSizes     = {}
+        if knownTokens   is None: knownTokens   = {}
 
         if filterType not in ('regexp', 'glob'):
             raise ValueError('Unrecognised value for filterType: '
@@ -259,25 +478,85 @@ class XNATBrowserPanel(wx.Panel):
 
         # store hosts without
         # the http[s]:// prefix
-        knownHosts    = [h.strip('https://')          for h in knownHosts]
-        knownAccounts = {h.strip('https://') : (u, p) for h, (u, p)
+        knownHosts    = [connection.hostKey(h)          for h in knownHosts]
+        knownAccounts = {connection.hostKey(h) : (u, p) for h, (u, p)
                          in knownAccounts.items()}
         knownHosts   += [h for h in knownAccounts.keys()
                          if h not in knownHosts]
+        knownTokens   = {connection.hostKey(h) : tuple(t) for h, t
+                         in knownTokens.items()}
 
         wx.Panel.__init__(self, parent)
 
         self.__knownHosts    = knownHosts
         self.__knownAccounts = knownAccounts
-        self.__filterType    = filterType
+        self.__knownTokens   = knownTokens
+        self.__pageSizes     = dict(pageSizes)
+        self.__expandWorkers = expandWorkers
+        self.__bulkListing   = fetch.BulkListing() if bulkListing else None
+        self.__skeleton      = fetch.ProjectSkeleton() if flatLoading else None
+        self.__listingCache  = None
+        self.__cacheFile     = cacheFile
+        self.__cacheTTL      = cacheTTL
+        self.__cacheSize     = cacheSize
+        self.__serverFilters = serverFilters
+        self.__downloadWorkers = downloadWorkers
+        self.__connectTimeout  = connectTimeout
+        self.__shareSessions   = shareSessions
+        self.__poolSize        = poolSize
+        self.__keepAlive       = keepAlive
+        self.__persistTokens   = persistTokens
+
+        # Unfiltered listings of the children of
+        # every XNAT object that has been listed,
+        # keyed by object URI, so that filters can
+        # be re-applied without re-listing anything.
+        # Each listing is stored along with the
+        # server-side filters that were applied
+        # to it (see __getServerFilters).
+        self.__listings      = {}
+
+        # Every item that has been listed is
+        # added to a search index, including
+        # items which are hidden by filters.
+        self.__searchIndex   = search.SearchIndex()
+        self.__searchResults = []
+        self.__searchPos     = 0
+
+        # ... and to a columnar store, which is
+        # used to answer aggregate queries (e.g.
+        # total size) without walking the tree.
+        self.__store         = store.HierarchyStore()
+
         self.__session       = None
-        self.__filters = collections.OrderedDict([
+        self.__shared        = None
+
+        # Tree items are loaded on a pool of
+        # worker threads. The generation is
+        # incremented whenever the tree is
+        # cleared, so that results for items
+        # which no longer exist are discarded.
+        # Child collections are listed on a
+        # separate pool, as listings are
+        # requested from the expansion pool.
+        self.__pool       = futures.ThreadPoolExecutor(max_workers=workers)
+        self.__listPool   = futures.ThreadPoolExecutor(
+            max_workers=listWorkers)
+        self.__generation = 0
+
+        # Set by __onConnect, so that the
+        # first project is selected once
+        # the project list has been loaded
+        self.__selectProject = False
+
+        self.__filters = filtering.Filters(filterType, [
             ('subject',    ''),
             ('experiment', ''),
             ('file',       ''),
         ])
 
-        self.__filters.update(**filters)
+        for level, pattern in filters.items():
+            self.__filters[level] = pattern
 
         self.__host       = at.AutoTextCtrl(self,
                                             style=at.ATC_NO_PROPAGATE_ENTER)
@@ -290,22 +569,34 @@ class XNATBrowserPanel(wx.Panel):
                                                           wx.TE_PROCESS_ENTER))
         self.__connect    = wx.Button(self)
         self.__status     = wx.StaticText(self)
-        self.__project    = wx.Choice(self)
+        self.__project    = projects.ProjectPicker(self)
         self.__refresh    = wx.Button(self)
         self.__filter     = wx.Choice(self)
 
         self.__filterText = pt.PlaceholderTextCtrl(self,
                                                    placeholder=filterType,
                                                    style=wx.TE_PROCESS_ENTER)
+        self.__search     = pt.PlaceholderTextCtrl(
+            self,
+            placeholder=LABELS['search'],
+            style=wx.TE_PROCESS_ENTER)
         self.__splitter   = wx.SplitterWindow(self,
                                               style=(wx.SP_LIVE_UPDATE |
                                                      wx.SP_BORDER))
         self.__info       = wgrid.WidgetGrid(self.__splitter)
-        self.__browser    = wx.TreeCtrl(self.__splitter,
-                                        style=(wx.TR_MULTIPLE    |
-                                               wx.TR_NO_LINES    |
-                                               wx.TR_HAS_BUTTONS |
-                                               wx.TR_TWIST_BUTTONS))
+
+        if virtualTree:
+            self.__browser = dataview.XNATDataViewTree(self.__splitter)
+            evtActivate    = dv.EVT_DATAVIEW_ITEM_ACTIVATED
+            evtHighlight   = dv.EVT_DATAVIEW_SELECTION_CHANGED
+        else:
+            self.__browser = wx.TreeCtrl(self.__splitter,
+                                         style=(wx.TR_MULTIPLE    |
+                                                wx.TR_NO_LINES    |
+                                                wx.TR_HAS_BUTTONS |
+                                                wx.TR_TWIST_BUTTONS))
+            evtActivate    = wx.EVT_TREE_ITEM_ACTIVATED
+            evtHighlight   = wx.EVT_TREE_SEL_CHANGED
 
         self.__splitter.SetMinimumPaneSize(50)
         self.__splitter.SplitHorizontally(self.__info, self.__browser)
@@ -350,6 +641,8 @@ class XNATBrowserPanel(wx.Panel):
         self.__filterLabel.SetToolTip(filterTooltip)
         self.__filter     .SetToolTip(filterTooltip)
         self.__filterText .SetToolTip(filterTooltip)
+        self.__search     .SetToolTip(TOOLTIPS['search'])
+        self.__project    .SetToolTip(TOOLTIPS['project'])
 
         self.__loginSizer  = wx.BoxSizer(wx.HORIZONTAL)
         self.__filterSizer = wx.BoxSizer(wx.HORIZONTAL)
@@ -386,6 +679,8 @@ class XNATBrowserPanel(wx.Panel):
         self.__filterSizer.Add((5, 1))
         self.__filterSizer.Add(self.__refresh)
         self.__filterSizer.Add((5, 1))
+        self.__filterSizer.Add(self.__search, proportion=1)
+        self.__filterSizer.Add((5, 1))
 
         self.__mainSizer.Add(self.__loginSizer, flag=wx.EXPAND)
         self.__mainSizer.Add((1, 10))
@@ -402,12 +697,14 @@ class XNATBrowserPanel(wx.Panel):
         self.__project   .Bind(wx.EVT_CHOICE,        self.__onProject)
         self.__refresh   .Bind(wx.EVT_BUTTON,        self.__onRefresh)
         self.__filter    .Bind(wx.EVT_CHOICE,        self.__onFilter)
-        self.__browser   .Bind(wx.EVT_TREE_ITEM_ACTIVATED,
-                               self.__onTreeSelect)
-        self.__browser   .Bind(wx.EVT_TREE_SEL_CHANGED,
-                               self.__onTreeHighlight)
+        self.__browser   .Bind(evtActivate,         self.__onTreeSelect)
+        self.__browser   .Bind(evtHighlight,        self.__onTreeHighlight)
         self.__filterText.Bind(wx.EVT_TEXT_ENTER,
                                self.__onFilterText)
+        self.__search    .Bind(wx.EVT_TEXT,          self.__onSearch)
+        self.__search    .Bind(wx.EVT_TEXT_ENTER,    self.__onSearchNext)
+        self             .Bind(wx.EVT_WINDOW_DESTROY,
+                               self.__onDestroy)
 
         self.__updateFilter()
         self.EndSession()
@@ -420,23 +717,42 @@ class XNATBrowserPanel(wx.Panel):
         items = self.__browser.GetSelections()
         files = []
 
-        for i in items:
-
-            obj, level = self.__browser.GetItemData(i)
-
+        for i, obj, level in self.__getItemData(items):
             if level == 'file':
                 files.append(obj)
 
         return files
 
 
-    def DownloadFile(self, fobj, dest, showProgress=True):
+    def GetSelectedItems(self):
+        """Returns a list of ``(obj, level)`` tuples for all of the items
+        that are currently selected in the tree browser, where ``obj`` is an
+        ``xnat`` object, and ``level`` is its level in the XNAT hierarchy
+        (e.g. ``'scan'``).
+        """
+        items = self.__browser.GetSelections()
+        return [(o, l) for i, o, l in self.__getItemData(items)]
+
+
+    def DownloadFile(self,
+                     fobj,
+                     dest,
+                     showProgress=True,
+                     segments=None,
+                     segmentSize=None,
+                     verify=False):
         """Download the given ``xnat.FileData`` file object to the path
         specified by ``dest``.
 
         See the :func:`generateFilePath` function for a quick way to
         generate a unique file path.
 
+        The file is downloaded to a temporary ``.part`` file alongside
+        ``dest``, which is renamed to ``dest`` when the download is
+        complete. Interrupted downloads are resumed from where they
+        stopped, if the XNAT server supports it (see
+        :func:`.download.downloadFile`).
+
         :arg fobj:         An XNAT file object, as returned by
                            :meth:`GetSelectedFiles`.
 
@@ -445,66 +761,39 @@ class XNATBrowserPanel(wx.Panel):
         :arg showProgress: If ``True``, a ``wx.ProgressDialog`` is shown,
                            displaying the download progress.
 
+        :arg segments:     If provided, the file is downloaded in segments,
+                           with up to this many segments downloaded
+                           concurrently over separate connections (see
+                           :func:`.download.downloadSegmented`). This can
+                           be much faster for large files. Segmented
+                           downloads are not resumed if interrupted.
+
+        :arg segmentSize:  Size of each segment, in bytes, when
+                           ``segments`` is provided. Defaults to
+                           :data:`.download.SEGMENT_SIZE`.
+
+        :arg verify:       If ``True``, the MD5 checksum of the file is
+                           calculated as it is downloaded, and compared
+                           against the checksum reported by the XNAT
+                           server. The file is downloaded again if they do
+                           not match (see :func:`.download.downloadFile`).
+
         :returns:          Path to the downloaded file, or ``None`` if the
                            download was cancelled.. Note that the path may
                            be different to ``dest``, as the user may be
                            prompted to select a different locaion.
         """
 
-        fname = fobj.id
-        fsize = fobj.size
-
-        # if destination already exists, ask
-        # the user if they want to skip,
-        # overwrite, or choose a new name
-        if op.exists(dest):
-
-            # We potentially show two dialogs -
-            # the first one asking the user what
-            # they want to do, and the second
-            # one prompting for a new file. If
-            # the user cancels the second dialog,
-            # he/she is re-shown the first.
-            while True:
-                dlg = wx.MessageDialog(
-                    self,
-                    message=LABELS['download.exists.message'].format(fname),
-                    caption=LABELS['download.exists.title'],
-                    style=(wx.YES_NO |
-                           wx.CANCEL |
-                           wx.CENTRE |
-                           wx.ICON_QUESTION))
-
-                dlg.SetYesNoCancelLabels(
-                    LABELS['download.exists.overwrite'],
-                    LABELS['download.exists.newdest'],
-                    LABELS['download.exists.skip'])
-
-                choice = dlg.ShowModal()
-
-                # overwrite
-                if choice == wx.ID_YES:
-                    break
-
-                # skip
-                if choice == wx.ID_CANCEL:
-                    return None
-
-                # choose a new destination
-                elif choice == wx.ID_NO:
-                    dlg = wx.FileDialog(
-                        self,
-                        message=LABELS['download.exists.choose'],
-                        defaultDir=op.dirname(dest),
-                        defaultFile=fname,
-                        style=wx.FD_SAVE | wx.FD_OVERWRITE_PROMPT)
-
-                    # If user cancelled this dialog,
-                    # show them the first dialog again.
-                    if dlg.ShowModal() == wx.ID_OK:
-                        dest  = dlg.GetPath()
-                        fname = op.basename(dest)
-                        break
+        fname   = fobj.id
+        fsize   = fobj.size
+        newdest = self.__checkDestination(fname, dest)
+
+        if newdest is None:
+            return None
+
+        if newdest != dest:
+            dest  = newdest
+            fname = op.basename(dest)
 
         if showProgress:
 
@@ -536,9 +825,11 @@ class XNATBrowserPanel(wx.Panel):
         errMsg   = LABELS['download.error.message'].format(fname)
 
         with status.reportIfError(errTitle, errMsg, raiseError=False):
-            log.debug('Downloading file %s to %s', fobj.uri, dest)
-            with open(dest, 'wb') as f:
-                fobj.download_stream(f, update_func=update)
+            if segments is None:
+                download.downloadFile(fobj, dest, update, verify=verify)
+            else:
+                download.downloadSegmented(fobj, dest, update,
+                                           segments, segmentSize, verify)
 
         if showProgress:
             dlg.Close()
@@ -546,6 +837,259 @@ class XNATBrowserPanel(wx.Panel):
         return dest
 
 
+    def DownloadFiles(self, fobjs, dests, showProgress=True, verify=False):
+        """Download the given ``xnat.FileData`` file objects to the paths
+        specified by ``dests``. Files are downloaded concurrently (see the
+        ``downloadWorkers`` argument to :meth:`__init__`), and a single
+        progress dialog is shown for all of them. This method does not
+        return until all of the downloads have finished, or have been
+        cancelled.
+
+        :arg fobjs:        Sequence of XNAT file objects, as returned by
+                           :meth:`GetSelectedFiles`.
+
+        :arg dests:        Sequence of paths to download each file to.
+
+        :arg showProgress: If ``True``, a ``wx.ProgressDialog`` is shown,
+                           displaying the download progress, and allowing
+                           the user to cancel the downloads.
+
+        :arg verify:       If ``True``, the checksum of each file is
+                           verified as it is downloaded (see
+                           :meth:`DownloadFile`). Files which do not match
+                           are retried, and reported as errors if they
+                           still do not match.
+
+        :returns:          A list containing the path to each downloaded
+                           file, or ``None`` for files which were skipped,
+                           cancelled, or which could not be downloaded.
+                           As with :meth:`DownloadFile`, the user may be
+                           prompted to select a different path for files
+                           which already exist.
+        """
+
+        # Ask the user what to do about existing
+        # files before starting any downloads
+        jobs = []
+        for i, (fobj, dest) in enumerate(zip(fobjs, dests)):
+            dest = self.__checkDestination(fobj.id, dest)
+            if dest is not None:
+                jobs.append((i, fobj, dest))
+
+        results = [None] * len(fobjs)
+
+        if len(jobs) == 0:
+            return results
+
+        manager = download.DownloadManager([(f, d) for _, f, d in jobs],
+                                           self.__downloadWorkers,
+                                           verify)
+
+        if showProgress:
+            dlg = wx.ProgressDialog(
+                LABELS['download.files.title'],
+                LABELS['download.files.startMessage'].format(len(jobs)),
+                maximum=1000,
+                parent=self,
+                style=(wx.PD_APP_MODAL    |
+                       wx.PD_AUTO_HIDE    |
+                       wx.PD_CAN_ABORT    |
+                       wx.PD_ELAPSED_TIME))
+            dlg.Show()
+
+        manager.start()
+
+        while not manager.wait(0.1):
+            if showProgress:
+                cont, _ = dlg.Update(*self.__downloadProgress(manager))
+                if not cont:
+                    manager.cancel()
+
+        if showProgress:
+            dlg.Destroy()
+
+        for (i, _, _), result in zip(jobs, manager.results):
+            results[i] = result
+
+        # Report all failures at once
+        errors = manager.errors
+        if len(errors) > 0:
+            names = ', '.join(op.basename(d) for _, d, _ in errors)
+            status.reportError(
+                LABELS['download.error.title'],
+                LABELS['download.files.error.message'].format(
+                    len(errors), len(jobs), names),
+                errors[0][2])
+
+        return results
+
+
+    def DownloadArchive(self, obj, level, destDir, showProgress=True):
+        """Download all of the files in the given ``xnat`` object (e.g. a
+        scan) as a single zip archive, which is extracted as it is
+        downloaded (see :func:`.download.downloadArchive`). Files are
+        extracted into a sub-directory of ``destDir``, given by
+        :func:`generateFilePath`.
+
+        :arg obj:          An ``xnat`` object, as returned by
+                           :meth:`GetSelectedItems`.
+
+        :arg level:        Level of ``obj`` in the XNAT hierarchy - must be
+                           one of ``'experiment'``, ``'scan'`` or
+                           ``'resource'``.
+
+        :arg destDir:      Directory to download the files to.
+
+        :arg showProgress: If ``True``, a ``wx.ProgressDialog`` is shown,
+                           displaying the download progress, and allowing
+                           the user to cancel the download.
+
+        :returns:          A list containing the paths of all downloaded
+                           files, or ``None`` if the download was cancelled,
+                           or could not be completed.
+        """
+
+        name      = getattr(obj, XNAT_NAME_ATT[level])
+        label     = LABELS[level].lower()
+        destDir   = op.join(destDir, download.generateFilePath(obj))
+        cancelled = threading.Event()
+        nbytes    = [0]
+
+        def update(n, total, finished):
+            if cancelled.is_set():
+                raise download.Cancelled()
+            nbytes[0] = n
+
+        pool   = futures.ThreadPoolExecutor(max_workers=1)
+        result = pool.submit(download.downloadArchive,
+                             obj, level, destDir, update)
+        pool.shutdown(wait=False)
+
+        if showProgress:
+            dlg = wx.ProgressDialog(
+                LABELS['download.archive.title'],
+                LABELS['download.archive.startMessage'].format(label, name),
+                parent=self,
+                style=(wx.PD_APP_MODAL    |
+                       wx.PD_AUTO_HIDE    |
+                       wx.PD_CAN_ABORT    |
+                       wx.PD_ELAPSED_TIME))
+            dlg.Show()
+
+        msg = LABELS['download.archive.updateMessage']
+
+        # The archive size is not
+        # known in advance, so
+        # we can only pulse
+        while len(futures.wait([result], 0.1)[0]) == 0:
+            if showProgress:
+                cont, _ = dlg.Pulse(msg.format(label, name,
+                                               nbytes[0] / 1048576.))
+                if not cont:
+                    cancelled.set()
+
+        if showProgress:
+            dlg.Destroy()
+
+        try:
+            return result.result()
+
+        except download.Cancelled:
+            log.debug('Download of %s cancelled', obj.uri)
+            return None
+
+        except Exception as e:
+            status.reportError(
+                LABELS['download.error.title'],
+                LABELS['download.error.message'].format(name),
+                e)
+            return None
+
+
+    def __checkDestination(self, fname, dest):
+        """Called by :meth:`DownloadFile` and :meth:`DownloadFiles`. If the
+        given destination already exists, the user is asked whether they want
+        to skip the file, overwrite it, or choose a new destination.
+
+        :returns: The path to download the file to, or ``None`` if the file
+                  should be skipped.
+        """
+
+        if not op.exists(dest):
+            return dest
+
+        # We potentially show two dialogs -
+        # the first one asking the user what
+        # they want to do, and the second
+        # one prompting for a new file. If
+        # the user cancels the second dialog,
+        # he/she is re-shown the first.
+        while True:
+            dlg = wx.MessageDialog(
+                self,
+                message=LABELS['download.exists.message'].format(fname),
+                caption=LABELS['download.exists.title'],
+                style=(wx.YES_NO |
+                       wx.CANCEL |
+                       wx.CENTRE |
+                       wx.ICON_QUESTION))
+
+            dlg.SetYesNoCancelLabels(
+                LABELS['download.exists.overwrite'],
+                LABELS['download.exists.newdest'],
+                LABELS['download.exists.skip'])
+
+            choice = dlg.ShowModal()
+
+            # overwrite
+            if choice == wx.ID_YES:
+                return dest
+
+            # skip
+            if choice == wx.ID_CANCEL:
+                return None
+
+            # choose a new destination
+            elif choice == wx.ID_NO:
+                dlg = wx.FileDialog(
+                    self,
+                    message=LABELS['download.exists.choose'],
+                    defaultDir=op.dirname(dest),
+                    defaultFile=fname,
+                    style=wx.FD_SAVE | wx.FD_OVERWRITE_PROMPT)
+
+                # If user cancelled this dialog,
+                # show them the first dialog again.
+                if dlg.ShowModal() == wx.ID_OK:
+                    return dlg.GetPath()
+
+
+    def __downloadProgress(self, manager):
+        """Called by :meth:`DownloadFiles`. Returns a value between 0 and
+        1000, and a message, describing the progress of the given
+        :class:`.DownloadManager`.
+        """
+
+        prog = manager.progress()
+        nmb  = prog.nbytes / 1048576.
+        rate = prog.rate   / 1048576.
+        msg  = LABELS['download.files.updateMessage'].format(
+            prog.done, prog.files, nmb, rate)
+
+        # Progress is measured by bytes if all
+        # file sizes are known, files otherwise
+        if prog.total:
+            value = prog.nbytes / prog.total
+        else:
+            value = prog.done / prog.files
+
+        if prog.eta is not None:
+            mins, secs = divmod(int(prog.eta), 60)
+            msg        = LABELS['download.files.eta'].format(msg, mins, secs)
+
+        return min(1000, int(value * 1000)), msg
+
+
     def SessionActive(self):
         """Returns ``True`` if a connection to a server is open, ``False``
         otherwise.
@@ -572,6 +1116,35 @@ class XNATBrowserPanel(wx.Panel):
         return self.__knownAccounts
 
 
+    def GetTokens(self):
+        """Returns a mapping of the form ``{ host : (username, url, token) }``
+        containing XNAT session tokens which may be passed back to
+        :meth:`__init__` via the ``knownTokens`` argument, so that logging
+        in can be skipped next time. This mapping is empty unless the
+        ``persistTokens`` argument was ``True``.
+        """
+        return self.__knownTokens
+
+
+    def GetCacheStats(self):
+        """Returns a dictionary containing statistics about the in-memory
+        cache of listings retrieved from the XNAT server - see
+        :meth:`.MemoryCache.stats`. If the current session is shared with
+        another panel, the statistics of the shared cache are returned. If
+        there is no active session, all statistics are zero.
+        """
+        if self.__listingCache is not None:
+            return self.__listingCache.memory.stats()
+        return cache.MemoryCache().stats()
+
+
+    def GetHierarchyStore(self):
+        """Returns a :class:`.HierarchyStore` containing all of the items in
+        the current project that have been retrieved from the XNAT server.
+        """
+        return self.__store
+
+
     def StartSession(self,
                      host,
                      username=None,
@@ -605,8 +1178,9 @@ class XNATBrowserPanel(wx.Panel):
         if self.SessionActive():
             self.EndSession()
 
-        # If protocol not specified,
-        # try both https and http
+        # If protocol not specified, try both
+        # https and http at the same time,
+        # preferring https (see connection.connect)
         if host.startswith('http://') or host.startswith('https://'):
             hosts = [host]
         else:
@@ -614,31 +1188,73 @@ class XNATBrowserPanel(wx.Panel):
 
         session   = [None]
         error     = [None]
-        cancelled = [False]
+        stale     = [False]
+        cancelled = threading.Event()
+
+        # Re-use a token from a previous
+        # session if we have one
+        tokenKey = connection.hostKey(host)
+        token    = None
+        if self.__persistTokens:
+            token = self.__knownTokens.get(tokenKey, None)
+            if token is not None and token[0] != username:
+                token = None
 
         # connect to the host - this
         # is performed on a separate
-        # thread
+        # thread. An existing connection
+        # is re-used if one is available.
+        def login():
+            if token is not None:
+                url  = token[1]
+                sess = connection.resume(url,
+                                         username,
+                                         token[2],
+                                         timeout=self.__connectTimeout)
+                if sess is not None:
+                    return url, sess
+                stale[0] = True
+
+            return connection.connect(hosts,
+                                      username,
+                                      password,
+                                      timeout=self.__connectTimeout,
+                                      cancel=cancelled)
+
         def connect():
-            for host in hosts:
-                try:
-                    session[0] = xnat.connect(host,
-                                              user=username,
-                                              password=password)
-                    hosts[:]   = [host]
-                    break
+            try:
+                shared = sessions.acquire(host,
+                                          username,
+                                          password,
+                                          login,
+                                          share=self.__shareSessions)
+            except Exception as e:
+                error[0] = e
+                return
+
+            if shared is None:
+                return
 
-                except Exception as e:
-                    error[0] = e
-                    if cancelled[0]:
-                        break
+            # The user may have cancelled
+            # the dialog at the last moment
+            if cancelled.is_set():
+                sessions.release(shared)
+                return
+
+            hosts[:], session[0] = [shared.host], shared
 
         # called by the progress dialog
         # when either the connect function
         # has finished, or the user has
         # cancelled the dialog.
         def finish(completed):
-            cancelled[0] = completed
+
+            if not completed:
+                cancelled.set()
+
+            # Forget expired tokens
+            if stale[0]:
+                self.__knownTokens.pop(tokenKey, None)
 
             if completed:
                 if session[0] is not None: success()
@@ -647,10 +1263,32 @@ class XNATBrowserPanel(wx.Panel):
             callback(completed and session[0] is not None)
 
         def success():
-            sess = session[0]
-            host = hosts[  0]
+            shared = session[0]
+            sess   = shared.session
+            host   = hosts[0]
 
             self.__session = sess
+            self.__shared  = shared
+
+            # Keep the session alive on the
+            # server, so its token can be re-used
+            if self.__persistTokens:
+                shared.keepToken = True
+                sessToken        = connection.sessionToken(sess)
+                if sessToken is not None:
+                    self.__knownTokens[tokenKey] = (username, host, sessToken)
+
+            # Give each thread its own HTTP
+            # connections, and cache listings.
+            # The cache is shared by all users
+            # of the session.
+            if shared.listingCache is None:
+                interface.install(sess, self.__poolSize, self.__keepAlive)
+                shared.listingCache = self.__newListingCache(host, username)
+                shared.listingCache.install(sess)
+
+            self.__listingCache = shared.listingCache
+
             self.__host.SetValue(host)
             self.__connect.SetLabel(LABELS['disconnect'])
             self.__status.SetLabel(LABELS['connected'])
@@ -660,13 +1298,11 @@ class XNATBrowserPanel(wx.Panel):
             self.__password.Disable()
 
             # populate the projects dropdown
-            projects = self.__session.projects
-            projects = [p.id for p in projects.listing]
-            self.__project.SetItems(projects)
+            self.__loadProjects()
 
             # Add every successful connection
             # to the known hosts/accounts store
-            host = host.strip('https://')
+            host = connection.hostKey(host)
             if host not in self.__knownHosts:
                 self.__knownHosts.append(host)
             if host not in self.__knownAccounts:
@@ -692,17 +1328,58 @@ class XNATBrowserPanel(wx.Panel):
                                callback=finish)
 
 
-    def EndSession(self):
-        """Disconnects any active session, and updates the interface."""
+    def __newListingCache(self, host, username):
+        """Called by :meth:`StartSession` when a new session is established.
+        Creates a :class:`.ListingCache` which caches listings in memory,
+        and on disk if a ``cacheFile`` was specified.
 
-        if self.__session is not None:
+        The cache, and the thread which it uses to re-validate responses,
+        belong to the session rather than to this panel, and are closed
+        when the session is disconnected (see :meth:`.SharedSession.close`).
+        """
+
+        memory = cache.MemoryCache(self.__cacheSize)
+        disk   = None
+
+        # Responses are re-validated one at a
+        # time, so that re-validation does not
+        # compete with requests for new listings
+        executor = futures.ThreadPoolExecutor(max_workers=1)
+
+        if self.__cacheFile is not None:
             try:
-                self.__session.disconnect()
+                disk = cache.DiskCache(self.__cacheFile, self.__cacheTTL)
             except Exception:
-                log.warning('Error occurred during session disconnection',
+                log.warning('Could not open cache file %s - listings will '
+                            'only be cached in memory', self.__cacheFile,
                             exc_info=True)
+
+        return cache.ListingCache(host, memory, disk, executor, username)
+
+
+    def EndSession(self):
+        """Disconnects any active session, and updates the interface."""
+
+        # The connection is only closed if no
+        # other panels are sharing it
+        if self.__session is not None:
+            sessions.release(self.__shared)
             self.__session = None
+            self.__shared  = None
+
+        self.__listingCache = None
+        self.__listings.clear()
+        self.__searchIndex.clear()
+        self.__store.clear()
+
+        if self.__skeleton is not None:
+            self.__skeleton.clear()
 
+        if self.__bulkListing is not None:
+            self.__bulkListing.clear()
+
+        self.__generation   += 1
+        self.__selectProject = False
         self.__connect.SetLabel(LABELS['connect'])
         self.__status.SetLabel(LABELS['disconnected'])
         self.__status.SetForegroundColour('#ff0000')
@@ -715,168 +1392,741 @@ class XNATBrowserPanel(wx.Panel):
         self.__password.Enable()
 
 
-    def ExpandTreeItem(self, treeItem, recursive=False):
+    def ExpandTreeItem(self,
+                       treeItem,
+                       recursive=False,
+                       background=False,
+                       callback=None,
+                       progress=None):
         """Expands the contents of the given ``treeItem`` in the tree browser.
         For each child level of the item's level in the XNAT hierarchy, any
         child objects are retrieved from the XNAT repository and added as items
         in the tree browser.
 
-        :arg treeItem:  ``wx.TreeItemId`` corresponding to ``obj``
-
-        :arg recursive: Recursively expand ``obj`` and all of its children.
-
-        :returns:       A mapping of the form: ``{ xnat_id : (xnat_obj,
-                        wx.TreeItemId) }``, containing the newly created
-                        ``wx.TreeItemId`` objects orresponding to the
-                        children of ``obj``.
+        Recursive expansions are performed breadth-first - all of the
+        listings at each depth of the sub-tree are requested concurrently
+        (see the ``expandWorkers`` argument to :meth:`__init__`).
+
+        :arg treeItem:   ``wx.TreeItemId`` corresponding to ``obj``
+
+        :arg recursive:  Recursively expand ``obj`` and all of its children.
+
+        :arg background: If ``True``, the children are retrieved on a separate
+                         thread, and this method returns immediately. A
+                         placeholder item is displayed while the children are
+                         being retrieved. For recursive expansions, the
+                         children at each depth are added to the tree as soon
+                         as they have been retrieved.
+
+        :arg callback:   Only used when ``background is True``. Function
+                         which is called on the ``wx`` main thread when
+                         the children have been added to the tree. It
+                         is passed the mapping described below, or ``None``
+                         if the children could not be retrieved, or the
+                         expansion was cancelled.
+
+        :arg progress:   Only used for recursive expansions. Function which
+                         is called as the sub-tree is retrieved, and which
+                         may be used to cancel the expansion - see the
+                         :class:`.SubtreeExpander`. For background
+                         expansions, it is called on the ``wx`` main thread.
+
+        :returns:        A mapping of the form: ``{ xnat_id : (xnat_obj,
+                         wx.TreeItemId) }``, containing the newly created
+                         ``wx.TreeItemId`` objects orresponding to the
+                         children of ``obj``. If ``background is True``,
+                         ``None`` is returned.
         """
 
         browser    = self.__browser
         obj, level = browser.GetItemData(treeItem)
 
-        childItems = {}
-
         if level == 'file':
+            if background and callback is not None:
+                callback({})
+            return None if background else {}
+
+        if not background:
+            children = self.__fetchChildren(obj, level, recursive, progress)
+            childItems = self.__insertChildren(treeItem, children, recursive)
+            if recursive:
+                browser.ExpandAllChildren(treeItem)
             return childItems
 
-        self.__browser.SetItemImage(treeItem, self.__loadedFolderImageId)
+        if callback is None: callback = lambda childItems: None
+        if progress is None: progress = lambda depth, done, total: True
+
+        generation  = self.__generation
+        placeholder = [browser.AppendItem(treeItem,
+                                          LABELS['loading'],
+                                          data=[None, 'loading'])]
+        expander    = self.__newExpander(
+            lambda *a: wx.CallAfter(onProgress, *a))
+        childItems  = {}
+        browser.Expand(treeItem)
+
+        # Items which have been added to the tree
+        # during a recursive expansion, keyed by
+        # the id of the corresponding XNAT object.
+        treeItems   = {id(obj) : treeItem}
+
+        def stale():
+            if not self or generation != self.__generation:
+                expander.cancel()
+                return True
+            return False
+
+        def removePlaceholder():
+            if placeholder[0] is not None:
+                browser.Delete(placeholder[0])
+                placeholder[0] = None
+
+        def onProgress(depth, done, total):
+            if not stale() and progress(depth, done, total) is False:
+                expander.cancel()
+
+        # Called on the main thread when the
+        # children at each depth have been
+        # retrieved. If the tree has been
+        # cleared in the meantime, the results
+        # are discarded.
+        def insert(batch):
 
-        for catt in XNAT_HIERARCHY[level]:
+            if stale():
+                return
+
+            removePlaceholder()
+            browser.Freeze()
+
+            try:
+                for parent, children in batch:
+
+                    if parent is None:
+                        pobj = obj
+                    else:
+                        pobj         = parent[0]
+                        parent[3][:] = children
+
+                    # The parent may not be in the tree, e.g.
+                    # if it is on a page which has not been
+                    # loaded. Its children have been stored
+                    # on the parent, so will be added if the
+                    # parent is added to the tree later on.
+                    pitem = treeItems.pop(id(pobj), None)
+
+                    if pitem is None:
+                        continue
+
+                    items = self.__insertChildren(pitem, children, recursive)
+
+                    if parent is None:
+                        childItems.update(items)
+
+                    if recursive:
+                        for cobj, citem in items.values():
+                            treeItems[id(cobj)] = citem
+            finally:
+                browser.Thaw()
+
+        # Called on the main thread when the
+        # expansion has finished, failed, or
+        # been cancelled.
+        def finish(error, cancelled):
+
+            if stale():
+                return
+
+            removePlaceholder()
+
+            if error is not None:
+                status.reportError(LABELS['expand.error.title'],
+                                   LABELS['expand.error.message'],
+                                   error)
+                callback(None)
+                return
+
+            if recursive: browser.ExpandAllChildren(treeItem)
+            else:         browser.Expand(treeItem)
+
+            if cancelled: callback(None)
+            else:         callback(childItems)
+
+        # Called on a worker thread - must
+        # not interact with any wx objects
+        def run():
+            error     = None
+            cancelled = False
+            try:
+                if recursive:
+                    for batch in expander.expand(obj, level):
+                        wx.CallAfter(insert, batch)
+                else:
+                    children = self.__fetchChildren(obj, level)
+                    wx.CallAfter(insert, [(None, children)])
+
+            except fetch.ExpansionCancelled:
+                log.debug('Expansion of %s %s cancelled', level, obj)
+                cancelled = True
+
+            except Exception as e:
+                log.warning('Error retrieving children of %s %s',
+                            level, obj, exc_info=True)
+                error = e
+
+            wx.CallAfter(finish, error, cancelled)
 
+        self.__pool.submit(run)
+        return None
+
+
+    def __newExpander(self, progress=None):
+        """Creates and returns a :class:`.SubtreeExpander` which may be used
+        to recursively retrieve part of the XNAT hierarchy. Filtered items
+        are omitted.
+        """
+
+        def include(child):
+            obj, level, name = child
+            return not self.__filters.filterItem(level, name)
+
+        return fetch.SubtreeExpander(self.__listChildren,
+                                     include=include,
+                                     maxWorkers=self.__expandWorkers,
+                                     progress=progress)
+
+
+    def __fetchChildren(self, obj, level, recursive=False, progress=None):
+        """Retrieves the children of the given XNAT object from the server.
+        This method does not interact with the tree browser, so may be
+        called from any thread.
+
+        :arg obj:       XNAT object
+        :arg level:     Level of ``obj`` in the XNAT hierarchy.
+        :arg recursive: If ``True``, the children of all children which are
+                        not filtered are retrieved too.
+        :arg progress:  Passed to the :class:`.SubtreeExpander` for
+                        recursive expansions.
+        :returns:       A list containing a ``(child, level, name,
+                        [grandchildren])`` tuple for each child. The
+                        grandchildren list will be empty if ``recursive is
+                        False``.
+        """
+
+        if recursive:
+            expander = self.__newExpander(progress)
+            children = None
+
+            for batch in expander.expand(obj, level):
+                for parent, grandchildren in batch:
+                    if parent is None: children     = grandchildren
+                    else:              parent[3][:] = grandchildren
+
+            return children
+
+        children = self.__filters.apply(self.__listChildren(obj, level))
+
+        return [(child, catt, name, []) for child, catt, name in children]
+
+
+    def __listChildren(self, obj, level):
+        """Retrieves listings of all child collections of the given XNAT
+        object from the server. The listing for each collection (e.g. the
+        assessors, scans and resources of an experiment) is requested
+        concurrently. The children of scans and scan resources are taken from
+        a :class:`.BulkListing` where possible. This method does not interact
+        with the tree browser, so may be called from any thread.
+
+        :arg obj:   XNAT object
+        :arg level: Level of ``obj`` in the XNAT hierarchy.
+        :returns:   A list containing a ``(child, level, name)`` tuple for
+                    each child, in the order defined by
+                    :data:`XNAT_HIERARCHY`. The list is also stored, so
+                    that filters can be re-applied later on without
+                    re-listing the children (see :meth:`__refreshTree`).
+                    If server-side filtering is enabled, the list may
+                    only contain children which pass the current filters.
+        """
+
+        if level == 'file':
+            return []
+
+        constraints = self.__getServerFilters(level)
+
+        if self.__bulkListing is not None:
+            children = self.__bulkListing.listChildren(obj, level)
+            if children is not None:
+                self.__listings[obj.uri] = (constraints, children)
+                self.__indexChildren(obj, children)
+                return children
+
+        def listing(catt):
             children = getattr(obj, catt, None)
             catt     = catt[:-1]
-
             if children is None:
-                continue
+                return []
 
-            for child in children.listing:
+            if self.__skeleton is not None:
+                skeleton = self.__skeleton.listCollection(obj, catt)
+                if skeleton is not None:
+                    return skeleton
 
-                name  = getattr(child, XNAT_NAME_ATT[catt])
-                label = LABELS[catt]
+            # Ask the server to filter the listing
+            # - the filter is also applied locally,
+            # so the server may ignore it.
+            if catt in constraints:
+                children = children.filter(
+                    {XNAT_NAME_ATT[catt] : constraints[catt]})
 
-                if self.__filterItem(catt, name):
-                    continue
+            return [(child, catt, getattr(child, XNAT_NAME_ATT[catt]))
+                    for child in children.listing]
 
-                if catt == 'file': image = self.__fileImageId
-                else:              image = self.__unloadedFolderImageId
+        # Results are gathered in hierarchy order,
+        # regardless of the order in which the
+        # requests complete.
+        catts   = XNAT_HIERARCHY[level]
+        results = [self.__listPool.submit(listing, c) for c in catts]
+        results = [r.result() for r in results]
+        results = [child for result in results for child in result]
 
-                data = [child, catt]
+        self.__listings[obj.uri] = (constraints, results)
+        self.__indexChildren(obj, results)
 
-                childItem = browser.AppendItem(
-                    treeItem,
-                    '{} {}'.format(label, name),
-                    image=image,
-                    data=data)
+        return results
 
-                childItems[child.id] = (child, childItem)
 
-                if recursive:
-                    self.ExpandTreeItem(childItem, True)
-                    browser.ExpandAllChildren(childItem)
+    def __indexChildren(self, obj, children):
+        """Adds the given children of ``obj``, as returned by
+        :meth:`__listChildren`, to the search index and hierarchy store.
+        """
+        self.__searchIndex.add(obj.uri, [(c.uri, l, n, c.id)
+                                         for c, l, n in children])
+        self.__store.add(obj.uri, [(c.uri, l, c.id, n) + store.knownFields(c)
+                                   for c, l, n in children])
+
+
+    def __getServerFilters(self, level):
+        """Returns a dictionary of ``{ level : constraint }`` mappings,
+        containing the filters which are to be evaluated by the XNAT server
+        when listing the children of an item at the given ``level``. The
+        dictionary will be empty if server-side filtering is disabled.
+        """
+
+        if not self.__serverFilters:
+            return {}
+
+        constraints = {}
+
+        for catt in XNAT_HIERARCHY.get(level, []):
+            catt       = catt[:-1]
+            constraint = self.__filters.serverPattern(catt)
+            if catt in SERVER_FILTER_LEVELS and constraint is not None:
+                constraints[catt] = constraint
+
+        return constraints
+
+
+    def __insertChildren(self, treeItem, children, recursive=False):
+        """Adds items to the tree browser for the given children, as
+        returned by :meth:`__fetchChildren`. Must be called on the ``wx``
+        main thread.
+
+        Children at each level are added a page at a time - see the
+        ``pageSizes`` argument to :meth:`__init__`.
+
+        :returns: A mapping of the form: ``{ xnat_id : (xnat_obj,
+                  wx.TreeItemId) }``, containing the newly created
+                  ``wx.TreeItemId`` objects.
+        """
+
+        childItems = {}
+        groups     = collections.OrderedDict()
+
+        self.__browser.SetItemImage(treeItem, self.__loadedFolderImageId)
+
+        for child in children:
+            groups.setdefault(child[1], []).append(child)
+
+        for catt, group in groups.items():
+            childItems.update(self.__insertPage(
+                treeItem, None, catt, group, recursive))
 
         return childItems
 
 
-    def __getTreeContents(self):
-        """Builds a representation of the current state of the XNAT hierarchy
-        as displayed in the tree browser.
+    def __insertPage(self, treeItem, moreItem, level, children, recursive):
+        """Used by :meth:`__insertChildren`. Adds the next page of
+        ``children`` to the tree browser.
 
-        :returns: The state of the tree, where each node is represented by a
-                  tuple of the form ``(level, id, [children], expanded)``,
-                  where:
+        :arg treeItem:  Parent ``wx.TreeItemId``.
 
-                   - ``level`` is the item level in the XNAT hierarchy, e.g.
-                     ``'project'``, ``'subject'``, etc.
+        :arg moreItem:  The *Load next* item for this page, or ``None`` if
+                        this is the first page. Items are inserted before
+                        this item.
 
-                   - ``id`` is the XNAT id of the item
+        :arg level:     Level of all ``children`` in the XNAT hierarchy.
 
-                   - ``[children]`` is a list of child items, or an empty list
-                     if the item has no children
+        :arg children:  Children which have not yet been added, as returned
+                        by :meth:`__fetchChildren`.
 
-                   - ``expanded`` is ``True`` if the item is expanded in the
-                     tree browser, ``False`` otherwise.
+        :arg recursive: Passed through to :meth:`__insertChildren`.
 
-                  A reference to the root node is returned.
+        :returns:       A mapping of the form: ``{ xnat_id : (xnat_obj,
+                        wx.TreeItemId) }``, containing the newly created
+                        ``wx.TreeItemId`` objects.
         """
 
-        browser = self.__browser
+        browser    = self.__browser
+        childItems = {}
+        pageSize   = self.__pageSizes.get(level, DEFAULT_PAGE_SIZE)
+
+        if pageSize > 0: page, remaining = children[:pageSize], \
+                                           children[pageSize:]
+        else:            page, remaining = children, []
 
-        # Recursively build a copy of the tree
-        # starting from the given treeItem.
-        # Returns a representation of the item
-        # as a tuple containing:
-        #    ('level', 'id', [children], expanded)
-        def buildTree(treeItem):
+        # New items are inserted after
+        # the last item of the previous page
+        if moreItem is None: previous = None
+        else:                previous = browser.GetPrevSibling(moreItem)
 
-            obj, level = browser.GetItemData(treeItem)
-            children   = []
+        if level == 'file': image = self.__fileImageId
+        else:               image = self.__unloadedFolderImageId
 
-            node = (obj.id, level, children, browser.IsExpanded(treeItem))
+        for child, catt, name, grandchildren in page:
 
-            if browser.GetChildrenCount(treeItem) == 0:
-                return node
+            text = '{} {}'.format(LABELS[catt], name)
+            data = [child, catt]
 
-            (childItem, cookie) = browser.GetFirstChild(treeItem)
-            while childItem.IsOk():
-                children.append(buildTree(childItem))
-                childItem, cookie = browser.GetNextChild(treeItem, cookie)
+            if previous is None or not previous.IsOk():
+                childItem = browser.AppendItem(
+                    treeItem, text, image=image, data=data)
+            else:
+                childItem = browser.InsertItem(
+                    treeItem, previous, text, image=image, data=data)
 
-            return node
+            previous             = childItem
+            childItems[child.id] = (child, childItem)
 
-        return buildTree(browser.GetRootItem())
+            if recursive:
+                self.__insertChildren(childItem, grandchildren, True)
 
+        # Add/update/remove the "Load next" item
+        if len(remaining) > 0:
+            text = LABELS['more'].format(min(pageSize, len(remaining)),
+                                         len(remaining),
+                                         LABELS[level + 's'].lower())
+            data = [(level, remaining, recursive), 'more']
 
-    def __refreshTree(self):
-        """Called by various things. Re-generates the current state of the
-        tree browser.
+            if moreItem is None:
+                moreItem = browser.AppendItem(treeItem, text, data=data)
+            else:
+                browser.SetItemText(moreItem, text)
+                browser.SetItemData(moreItem, data)
+
+        elif moreItem is not None:
+            browser.Delete(moreItem)
+
+        return childItems
+
+
+    def __loadMore(self, moreItem):
+        """Called when a *Load next* item is selected. Adds the next page of
+        children to the tree browser.
+        """
+        browser                     = self.__browser
+        state, _                    = browser.GetItemData(moreItem)
+        level, remaining, recursive = state
+        treeItem                    = browser.GetItemParent(moreItem)
+
+        log.debug('Loading next %s of %i %s items',
+                  self.__pageSizes.get(level, DEFAULT_PAGE_SIZE),
+                  len(remaining), level)
+
+        browser.Freeze()
+        try:
+            childItems = self.__insertPage(
+                treeItem, moreItem, level, remaining, recursive)
+        finally:
+            browser.Thaw()
+
+        if recursive:
+            for _, childItem in childItems.values():
+                browser.ExpandAllChildren(childItem)
+
+
+    def __getItemData(self, items):
+        """Returns a list of ``(item, obj, level)`` tuples for each of the
+        given tree items, omitting any placeholder items (e.g. the item which
+        is shown while the children of an item are being loaded).
+        """
+        data = [[i] + self.__browser.GetItemData(i) for i in items]
+        return [d for d in data if d[2] in XNAT_NAME_ATT]
+
+
+    def __getChildItems(self, treeItem):
+        """Returns a list containing all of the child items of the given tree
+        item, including placeholder items.
+        """
+
+        browser    = self.__browser
+        childItems = []
+
+        if browser.GetChildrenCount(treeItem) == 0:
+            return childItems
+
+        (childItem, cookie) = browser.GetFirstChild(treeItem)
+        while childItem.IsOk():
+            childItems.append(childItem)
+            childItem, cookie = browser.GetNextChild(treeItem, cookie)
+
+        return childItems
+
+
+    def __getLoadedItems(self):
+        """Returns a list of ``(treeItem, obj, level)`` tuples for every item
+        in the tree browser whose children have been loaded, in breadth-first
+        order, starting with the root item. An item has been loaded if the
+        listing of its children has been retrieved, even if all of those
+        children are currently filtered out. *Loading* placeholder items,
+        which are left behind by background expansions that have been
+        discarded, are removed.
         """
 
-        # Make a copy of the tree state - the tree is stored
-        # as a list of ('level', 'id', [children]) nodes
         browser  = self.__browser
-        rootNode = self.__getTreeContents()
         rootItem = browser.GetRootItem()
-        selItem  = browser.GetFocusedItem()
-        rootObj  = browser.GetItemData(rootItem)[0]
+        loaded   = []
+        queue    = [rootItem]
+
+        while len(queue) > 0:
 
-        if selItem.IsOk(): selObj = browser.GetItemData(selItem)[0]
-        else:              selObj = None
+            treeItem   = queue.pop(0)
+            obj, level = browser.GetItemData(treeItem)
+            children   = []
 
-        # Now clear the tree, and regenerate
-        # it according to its previous state
-        browser.DeleteChildren(rootItem)
+            for childItem in self.__getChildItems(treeItem):
+                clevel = browser.GetItemData(childItem)[1]
+                if   clevel == 'loading':     browser.Delete(childItem)
+                elif clevel in XNAT_NAME_ATT: children.append(childItem)
 
-        # Recursively add the children of
-        # the given tree item to the tree
-        def refresh(treeItem, treeNode, obj):
+            # The root item is always re-listed
+            if treeItem == rootItem or obj.uri in self.__listings:
+                loaded.append((treeItem, obj, level))
+                queue.extend(children)
 
-            objid, level, childNodes, expanded = treeNode
+        return loaded
 
-            if obj is selObj:
-                browser.SetFocusedItem(treeItem)
 
-            if len(childNodes) == 0:
-                return
+    def __refreshTree(self, relist=True):
+        """Called by various things. Brings the tree browser up to date with
+        the XNAT server, and with the current filters.
+
+        The children of every item which has been loaded are re-listed
+        concurrently on a separate thread, and compared against the existing
+        items by XNAT id. Items which no longer exist, or which are now
+        filtered out, are removed, and new items are inserted in place. All
+        other items are left in the tree, so their expansion and selection
+        state is preserved.
+
+        :arg relist: If ``False``, the children of each item are not
+                     re-listed from the XNAT server - the listings that
+                     were previously retrieved are re-filtered instead.
+                     This is used when only the filters have changed. If
+                     none of the listings need to be retrieved, the tree
+                     is updated immediately.
+        """
 
-            childItems = self.ExpandTreeItem(treeItem)
+        browser  = self.__browser
+        rootItem = browser.GetRootItem()
+
+        if not rootItem.IsOk():
+            return
+
+        # Any items which are currently being
+        # loaded in the background, and any
+        # refreshes which are in progress,
+        # are discarded.
+        self.__generation += 1
+
+        generation = self.__generation
+        loaded     = self.__getLoadedItems()
+
+        # Listings which were filtered by the
+        # server must be re-listed if the
+        # server-side filters have changed
+        def stale(obj, level):
+            listing = self.__listings.get(obj.uri, None)
+            return listing is None or \
+                listing[0] != self.__getServerFilters(level)
+
+        if relist: pending = loaded
+        else:      pending = [(i, o, l) for i, o, l in loaded
+                              if stale(o, l)]
+
+        log.debug('Refreshing %i tree items (re-listing %i)',
+                  len(loaded), len(pending))
+
+        # Called on the main thread when all
+        # listings have been retrieved. The
+        # tree is left unchanged if any of
+        # them failed, or if the tree has
+        # been changed in the meantime.
+        def finish(jobs):
+
+            if not self or generation != self.__generation:
+                return
 
-            # Loop through the nodes of the previous tree
-            # state, and expand any that have been newly
-            # added during this refresh. Some nodes
-            # which were in the tree may not be anymore,
-            # as they may have been filtered out.
-            for cnode in childNodes:
+            with status.reportIfError(LABELS['expand.error.title'],
+                                      LABELS['expand.error.message'],
+                                      raiseError=False):
+                for job in jobs:
+                    job.result()
 
-                cid         = cnode[0]
-                cobj, citem = childItems.get(cid, (None, None))
+                results = {}
+                for _, obj, _ in loaded:
+                    children         = self.__listings[obj.uri][1]
+                    children         = self.__filters.apply(children)
+                    results[id(obj)] = [(c, l, n, []) for c, l, n in children]
 
-                if citem is not None:
-                    refresh(citem, cnode, cobj)
+                browser.Freeze()
+                try:
+                    self.__reconcile(
+                        rootItem, results[id(loaded[0][1])], results)
+                finally:
+                    browser.Thaw()
 
-            if expanded: browser.Expand(  treeItem)
-            else:        browser.Collapse(treeItem)
+        # Called on a worker thread - must
+        # not interact with any wx objects
+        def run():
+            pool = futures.ThreadPoolExecutor(
+                max_workers=self.__expandWorkers)
+            try:
+                jobs = [pool.submit(self.__listChildren, obj, level)
+                        for _, obj, level in pending]
+                futures.wait(jobs)
+            finally:
+                pool.shutdown(wait=False)
+            wx.CallAfter(finish, jobs)
+
+        if len(pending) == 0: finish([])
+        else:                 self.__pool.submit(run)
+
+
+    def __reconcile(self, treeItem, children, results):
+        """Used by :meth:`__refreshTree`. Updates the children of the given
+        tree item so that they match ``children``, and then recursively
+        updates the children of all child items which have been loaded.
+
+        :arg treeItem: Parent ``wx.TreeItemId``.
+        :arg children: The current children of ``treeItem``, as returned by
+                       :meth:`__fetchChildren`.
+        :arg results:  Mapping of ``{ id(obj) : children }``, containing
+                       the current children of every loaded item, keyed
+                       by the ``id`` of the XNAT object that is currently
+                       associated with the item.
+        """
 
-        refresh(rootItem, rootNode, rootObj)
+        browser   = self.__browser
+        existing  = {}
+        moreItems = {}
+        groups    = collections.OrderedDict()
+        loaded    = []
+
+        browser.SetItemImage(treeItem, self.__loadedFolderImageId)
+
+        # Placeholders for background expansions
+        # which were started after this refresh
+        # are left for the expansion to remove
+        for childItem in self.__getChildItems(treeItem):
+            cobj, clevel = browser.GetItemData(childItem)
+            if   clevel == 'loading': continue
+            elif clevel == 'more':    moreItems[cobj[0]]         = childItem
+            else:                     existing[clevel, cobj.id] = childItem
+
+        for child in children:
+            groups.setdefault(child[1], []).append(child)
+
+        # Remove items which no longer exist
+        current = set((c[1], c[0].id) for c in children)
+        for key, childItem in list(existing.items()):
+            if key not in current:
+                browser.Delete(existing.pop(key))
+        for level, moreItem in list(moreItems.items()):
+            if level not in groups:
+                browser.Delete(moreItems.pop(level))
+
+        # Children are kept in hierarchy order - new
+        # items are inserted after the preceding item,
+        # or at the beginning if there isn't one.
+        previous = None
+
+        for level, group in groups.items():
+
+            pageSize = self.__pageSizes.get(level, DEFAULT_PAGE_SIZE)
+            shown    = [i for i, c in enumerate(group)
+                        if (level, c[0].id) in existing]
+
+            # Keep all of the items that are currently
+            # shown - children after the last of them
+            # remain on subsequent pages
+            if pageSize > 0: limit = min(pageSize, len(group))
+            else:            limit = len(group)
+            if len(shown) > 0:
+                limit = max(limit, shown[-1] + 1)
+
+            if level == 'file': image = self.__fileImageId
+            else:               image = self.__unloadedFolderImageId
+
+            for child, catt, name, _ in group[:limit]:
+
+                text      = '{} {}'.format(LABELS[catt], name)
+                data      = [child, catt]
+                childItem = existing.get((catt, child.id), None)
+
+                if childItem is None:
+                    if previous is None:
+                        childItem = browser.PrependItem(
+                            treeItem, text, image=image, data=data)
+                    else:
+                        childItem = browser.InsertItem(
+                            treeItem, previous, text, image=image, data=data)
+
+                else:
+                    oldobj = browser.GetItemData(childItem)[0]
+                    if id(oldobj) in results:
+                        loaded.append((childItem, results[id(oldobj)]))
+                    if browser.GetItemText(childItem) != text:
+                        browser.SetItemText(childItem, text)
+                    browser.SetItemData(childItem, data)
+
+                previous = childItem
+
+            # Add/update/remove the "Load next" item
+            remaining = group[limit:]
+            moreItem  = moreItems.get(level, None)
+
+            if len(remaining) > 0:
+
+                if moreItem is None: recursive = False
+                else:                recursive = browser.GetItemData(
+                                         moreItem)[0][2]
+
+                text = LABELS['more'].format(min(pageSize, len(remaining)),
+                                             len(remaining),
+                                             LABELS[level + 's'].lower())
+                data = [(level, remaining, recursive), 'more']
+
+                if moreItem is None:
+                    moreItem = browser.InsertItem(
+                        treeItem, previous, text, data=data)
+                else:
+                    browser.SetItemText(moreItem, text)
+                    browser.SetItemData(moreItem, data)
+                previous = moreItem
+
+            elif moreItem is not None:
+                browser.Delete(moreItem)
+
+        for childItem, grandchildren in loaded:
+            self.__reconcile(childItem, grandchildren, results)
 
 
     def __getSelectedFilter(self):
@@ -909,52 +2159,13 @@ class XNATBrowserPanel(wx.Panel):
             self.__filter.SetString(idx, label)
 
 
-    def __filterItem(self, level, name):
-        """Tests the given ``name`` to see if it should be filtered from the
-        tree browser.
-
-        :arg level: XNAT hierarchy level, e.g. ``'subject'``, ``'experiment'``,
-                    etc.
-
-        :arg name:  Name of item to test.
-
-        :returns:   ``True`` if the given item should be filtered, ``False``
-                    otherwise.
-        """
-
-        pattern = self.__filters.get(level, '')
-
-        if pattern.strip() == '':
-            return False
-
-        pattern = pattern.lower()
-        name    = name.lower()
-
-        if self.__filterType == 'regexp':
-            try:
-                return re.search(pattern, name, flags=re.IGNORECASE) is None
-            except Exception:
-                return False
-        elif self.__filterType == 'glob':
-
-            # The user can specify multiple glob
-            # patterns with the pipe operator -
-            # this acts as a logical OR: the
-            # item will only be filtered if it
-            # doesn't match any of the patterns.
-            matches = [fnmatch.fnmatch(name, p) for p in pattern.split('|')]
-            return not any(matches)
-        else:
-            return False
-
-
     def __onHost(self, ev):
         """Called when the user enters a host name. If the host is
         in the ``knownAccounts`` dictionary that was passed to
         :meth:`__init__`, the username/password fields are populated.
         """
 
-        host               = self.__host.GetValue()
+        host               = connection.hostKey(self.__host.GetValue())
         username, password = self.__knownAccounts.get(host, (None, None))
 
         if username is not None: self.__username.SetValue(username)
@@ -994,10 +2205,10 @@ class XNATBrowserPanel(wx.Panel):
 
         def onConnect(success):
 
-            if not success:
-                return
-            self.__project.SetSelection(0)
-            self.__onProject()
+            # The first project is selected
+            # when the project list arrives
+            if success:
+                self.__selectProject = True
 
         self.StartSession(host, username, password, callback=onConnect)
 
@@ -1016,31 +2227,163 @@ class XNATBrowserPanel(wx.Panel):
         project = self.__project.GetString(project).strip()
         label   = LABELS['project']
 
+        self.__generation += 1
+        self.__listings.clear()
+        self.__searchIndex.clear()
+        self.__store.clear()
         self.__browser.DeleteAllItems()
 
         # For each element in the tree, the xnat
         # object, and the name of its level in
         # the XNAT hierarchy (e.g 'project',
         # 'experiment') is stored by the tree
-        # browser.
-        data = [self.__session.projects[project], 'project']
+        # browser. The project object is created
+        # directly, as accessing session.projects
+        # would retrieve the full project listing.
+        name = self.__project.GetName(self.__project.GetSelection())
+        uri  = '/data/projects/{}'.format(project)
+        args = {} if name is None else {'name' : name}
+        obj  = self.__session.create_object(uri,
+                                            type_='xnat:projectData',
+                                            id_=project,
+                                            **args)
+        data = [obj, 'project']
 
         root = self.__browser.AddRoot(
             '{} {}'.format(label, project),
             data=data,
             image=self.__unloadedFolderImageId)
 
+        self.__searchIndex.add(None, [(data[0].uri, 'project',
+                                       project, data[0].id)])
+        self.__store.add(None, [(data[0].uri, 'project', data[0].id,
+                                 project, None, None)])
         self.__onTreeHighlight(item=root)
+        self.__loadSkeleton()
+
+
+    def __loadProjects(self):
+        """Called by :meth:`StartSession`. Retrieves the list of project
+        IDs and names on a background thread, and passes it to the project
+        drop down box. If a connection was made via the *Connect* button,
+        the first project is then selected.
+        """
+
+        session = self.__session
+
+        def load():
+            try:
+                ids, names = fetch.listProjects(session)
+                wx.CallAfter(loaded, ids, names)
+            except Exception as e:
+                log.warning('Error retrieving project list', exc_info=True)
+                wx.CallAfter(failed, e)
+
+        def loaded(ids, names):
+            if self.__session is not session:
+                return
+
+            self.__project.SetItems(ids)
+            self.__project.SetNames(names)
+
+            if self.__selectProject and len(ids) > 0:
+                self.__selectProject = False
+                self.__project.SetSelection(0)
+                self.__onProject()
+
+        def failed(error):
+            if self.__session is not session:
+                return
+            status.reportError(LABELS['projects.error.title'],
+                               LABELS['projects.error.message'],
+                               error)
+
+        self.__pool.submit(load)
+
+
+    def __loadSkeleton(self):
+        """Called by :meth:`__onProject` and :meth:`__onRefresh`. If flat
+        loading is enabled, (re-)retrieves the skeleton of the current
+        project in the background (see :class:`.ProjectSkeleton`).
+        """
+
+        if self.__skeleton is None:
+            return
+
+        skeleton = self.__skeleton
+        project  = self.__browser.GetItemData(self.__browser.GetRootItem())[0]
+
+        skeleton.clear()
+
+        def load():
+            try:
+                skeleton.load(project)
+            except Exception:
+                log.warning('Error retrieving skeleton of project %s',
+                            project.id, exc_info=True)
+
+        self.__pool.submit(load)
 
 
     def __onRefresh(self, ev):
-        """Called when the *Refresh* button is pushed. Clears the cache of all
-        items that have been downloaded from the XNAT server, and refreshes
-        the tree browser.
+        """Called when the *Refresh* button is pushed. If any items are
+        selected in the tree browser, the cached listings for those items,
+        and all of their descendants, are cleared. Otherwise the cache of all
+        items that have been downloaded from the XNAT server is cleared. The
+        tree browser is then refreshed.
         """
-        if self.SessionActive():
+
+        if not self.SessionActive():
+            return
+
+        items = self.__getItemData(self.__browser.GetSelections())
+
+        if len(items) > 0:
+            for item, _, _ in items:
+                self.__invalidateTreeItem(item)
+
+        else:
+            # The previous listings are retained, as
+            # they are used to identify the items that
+            # need to be re-listed - they are replaced
+            # by the refresh.
             self.__session.clearcache()
-            self.__refreshTree()
+            if self.__bulkListing is not None:
+                self.__bulkListing.clear()
+            if self.__listingCache is not None:
+                self.__listingCache.invalidate()
+            self.__loadSkeleton()
+
+        self.__refreshTree()
+
+
+    def __invalidateTreeItem(self, treeItem):
+        """Clears all cached listings for the given tree item, and for all
+        of its descendants.
+        """
+
+        browser    = self.__browser
+        obj, level = browser.GetItemData(treeItem)
+
+        if level not in XNAT_NAME_ATT:
+            return
+
+        obj.clearcache()
+
+        if self.__listingCache is not None:
+            self.__listingCache.invalidate(obj.uri)
+        if self.__bulkListing is not None:
+            self.__bulkListing.invalidate(obj.uri)
+        if self.__skeleton is not None:
+            self.__skeleton.invalidate(obj.uri)
+
+        if browser.GetChildrenCount(treeItem) == 0:
+            return
+
+        (childItem, cookie) = browser.GetFirstChild(treeItem)
+        while childItem.IsOk():
+            self.__invalidateTreeItem(childItem)
+            childItem, cookie = browser.GetNextChild(treeItem, cookie)
 
 
     def __onFilter(self, ev):
@@ -1056,16 +2399,153 @@ class XNATBrowserPanel(wx.Panel):
 
     def __onFilterText(self, ev):
         """Called when the user pushes the enter key in the filter
-        field. Refreshes the tree browser with the new filter value.
+        field. Refreshes the tree browser with the new filter value. Nothing
+        is re-listed from the XNAT server.
         """
         selected  = self.__getSelectedFilter()
         filterVal = self.__filterText.GetValue().strip()
 
-        self.__filters[selected] = filterVal
+        # Invalid patterns are reported, and
+        # the previous pattern is retained
+        try:
+            self.__filters[selected] = filterVal
+        except filtering.InvalidFilter as e:
+            status.reportError(
+                LABELS['filter.error.title'],
+                LABELS['filter.error.message'].format(
+                    LABELS[selected].lower(), filterVal),
+                e.error)
+            return
+
         self.__updateFilter(selected)
 
+        # Only the filters have changed, so the
+        # existing listings are re-filtered
         if self.SessionActive():
-            self.__refreshTree()
+            self.__refreshTree(relist=False)
+
+
+    def __onSearch(self, ev=None):
+        """Called when the user types into the search field. Searches all of
+        the items that have been loaded, and shows the best match in the
+        tree browser.
+        """
+
+        text                 = self.__search.GetValue()
+        self.__searchResults = self.__searchIndex.search(text)
+        self.__searchPos     = 0
+
+        if text.strip() == '' or len(self.__searchResults) > 0:
+            self.__search.SetForegroundColour(wx.NullColour)
+        else:
+            self.__search.SetForegroundColour('#ff0000')
+
+        self.__search.Refresh()
+        self.__showSearchResult()
+
+
+    def __onSearchNext(self, ev=None):
+        """Called when the user pushes enter in the search field. Shows the
+        next search match in the tree browser.
+        """
+        if len(self.__searchResults) > 0:
+            self.__searchPos = ((self.__searchPos + 1) %
+                                len(self.__searchResults))
+            self.__showSearchResult()
+
+
+    def __showSearchResult(self):
+        """Shows the current search match in the tree browser. Matches
+        which are not currently in the tree (e.g. because they are hidden by
+        a filter) are skipped.
+        """
+
+        results = self.__searchResults
+        npos    = len(results)
+
+        for i in range(npos):
+            pos = (self.__searchPos + i) % npos
+            if self.__showItem(results[pos]):
+                self.__searchPos = pos
+                break
+
+
+    def __showItem(self, uri):
+        """Selects the item with the given URI in the tree browser, adding
+        its ancestors to the tree if necessary.
+
+        :returns: ``True`` if the item was selected, ``False`` if it could
+                  not be found in the tree browser.
+        """
+
+        browser  = self.__browser
+        path     = self.__searchIndex.path(uri)
+        treeItem = browser.GetRootItem()
+
+        if path is None or not treeItem.IsOk():
+            return False
+
+        if browser.GetItemData(treeItem)[0].uri != path[0]:
+            return False
+
+        for childUri in path[1:]:
+            treeItem = self.__findChildItem(treeItem, childUri)
+            if treeItem is None:
+                return False
+
+        browser.UnselectAll()
+        browser.SelectItem(treeItem)
+        browser.EnsureVisible(treeItem)
+        return True
+
+
+    def __findChildItem(self, treeItem, uri):
+        """Used by :meth:`__showItem`. Returns the child of ``treeItem``
+        which corresponds to the XNAT object with the given URI. Nothing is
+        retrieved from the XNAT server - if the children of ``treeItem`` are
+        not in the tree, but have already been listed, they are added from
+        the retained listing. Returns ``None`` if there is no such child -
+        e.g. it has been filtered out, or the children of ``treeItem`` are
+        currently being loaded in the background.
+        """
+
+        browser    = self.__browser
+        obj, level = browser.GetItemData(treeItem)
+        children   = self.__getChildItems(treeItem)
+        levels     = [browser.GetItemData(c)[1] for c in children]
+
+        if 'loading' in levels:
+            return None
+
+        if len(children) == 0:
+            listing = self.__listings.get(obj.uri, None)
+            if listing is None:
+                return None
+            listing = self.__filters.apply(listing[1])
+            self.__insertChildren(treeItem,
+                                  [(c, l, n, []) for c, l, n in listing])
+            children = self.__getChildItems(treeItem)
+
+        # The child may be on a page which
+        # has not been added to the tree
+        while True:
+
+            more = None
+
+            for childItem in children:
+                obj, level = browser.GetItemData(childItem)
+
+                if level == 'more':
+                    if uri in [c[0].uri for c in obj[1]]:
+                        more = childItem
+                elif level in XNAT_NAME_ATT and obj.uri == uri:
+                    return childItem
+
+            if more is None:
+                return None
+
+            self.__loadMore(more)
+            children = self.__getChildItems(treeItem)
 
 
     def __onTreeSelect(self, ev=None, item=None):
@@ -1087,7 +2567,14 @@ class XNATBrowserPanel(wx.Panel):
 
         # Retrieve the XNAT object and its level
         # in the hierarchy from the tree browser.
-        items = [[i] + self.__browser.GetItemData(i) for i in items]
+        more  = [i for i in items
+                 if self.__browser.GetItemData(i)[1] == 'more']
+        items = self.__getItemData(items)
+
+        # Load the next page of children
+        # for any "Load next" items
+        for i in more:
+            self.__loadMore(i)
 
         # When any files get selected
         # post a file select event
@@ -1101,32 +2588,16 @@ class XNATBrowserPanel(wx.Panel):
                 filePaths.append(obj.uri)
 
             # Download the children for this
-            # non-file item if not already done
-            #
-            # TODO For objects with a larger number of children:
-            #
-            #       - show a dialog, allow the user to cancel the
-            #         request
-            #         OR
-            #       - Only load up to e.g. 100 items, and have a
-            #         button allowing the user to load more
-            #         OR
-            #       - Prompt the user to select a range of items
-            #         to load
+            # non-file item if not already done.
+            # This is performed in the background,
+            # so the user can continue browsing
+            # while the children are loaded.
             elif self.__browser.GetChildrenCount(item) == 0:
                 log.debug('Expanding %s item %s', level,
                           getattr(obj, XNAT_NAME_ATT[level]))
 
                 # scan level is always recursively expanded
-                self.Disable()
-                wx.SafeYield()
-                try:
-                    errTitle = LABELS['expand.error.title']
-                    errMsg   = LABELS['expand.error.message']
-                    with status.reportIfError(errTitle, errMsg, False):
-                        self.ExpandTreeItem(item, level == 'scan')
-                finally:
-                    self.Enable()
+                self.ExpandTreeItem(item, level == 'scan', background=True)
 
         # Emit a file select event
         # if any files were selected
@@ -1137,6 +2608,21 @@ class XNATBrowserPanel(wx.Panel):
             wx.PostEvent(self, ev)
 
 
+    def __onDestroy(self, ev):
+        """Called when this ``XNATBrowserPanel`` is destroyed. Releases
+        the current session, and shuts down the thread pools used to load
+        tree items.
+        """
+        ev.Skip()
+        if ev.GetEventObject() is self:
+            if self.__shared is not None:
+                sessions.release(self.__shared)
+                self.__session = None
+                self.__shared  = None
+            self.__pool    .shutdown(wait=False)
+            self.__listPool.shutdown(wait=False)
+
+
     def __onTreeHighlight(self, ev=None, item=None):
         """Called when one or more items is highlighted in the tree browser.
         Displays some metadata about the first highlighted item in the
@@ -1152,6 +2638,8 @@ class XNATBrowserPanel(wx.Panel):
 
         self.__info.ClearGrid()
 
+        items = [i for i, o, l in self.__getItemData(items)]
+
         if len(items) > 0:
             objs, levels = zip(*[self.__browser.GetItemData(i) for i in items])
         else:
@@ -1174,6 +2662,7 @@ class XNATBrowserPanel(wx.Panel):
         # show info about the first highlighted item
         item       = items[0]
         obj, level = objs[0], levels[0]
+        entry      = self.__store.get(obj.uri) or {}
         rows       = [
             ('Type', LABELS[level]),
         ]
@@ -1181,7 +2670,10 @@ class XNATBrowserPanel(wx.Panel):
         for att in XNAT_INFO_ATTS[level]:
             key = '{}.{}'.format(level, att)
             fmt = XNAT_INFO_FORMATTERS.get(key, str)
-            val = getattr(obj, att, None)
+            val = entry.get(XNAT_STORE_ATTS.get(att, None), None)
+
+            if val is None:
+                val = getattr(obj, att, None)
 
             if val is not None:
                 rows.append((LABELS[key], fmt(val)))
@@ -1189,6 +2681,16 @@ class XNATBrowserPanel(wx.Panel):
                 log.warning('%s.%s attribute is missing '
                             'on %s', level, att, obj)
 
+        # Summarise all of the files beneath
+        # this item that have been loaded
+        if level != 'file':
+            nfiles = self.__store.count('file', under=obj.uri)
+            if nfiles > 0:
+                size = self.__store.totalSize('file', under=obj.uri)
+                fmt  = XNAT_INFO_FORMATTERS['info.size']
+                rows.append((LABELS['info.files'], str(nfiles)))
+                rows.append((LABELS['info.size'],  fmt(size)))
+
         self.__info.SetGridSize(len(rows), 2, growCols=(1, ))
         for i, (header, value) in enumerate(rows):
             self.__info.SetText(i, 0, header)
@@ -1278,7 +2780,7 @@ class XNATBrowserDialog(wx.Dialog):
         self.__sizer.Fit(self)
 
         self.__panel   .Bind(EVT_XNAT_ITEM_HIGHLIGHT_EVENT, self.__onHighlight)
-        self.__panel   .Bind(EVT_XNAT_FILE_SELECT_EVENT,    self.__onDownload)
+        self.__panel   .Bind(EVT_XNAT_FILE_SELECT_EVENT,    self.__onSelect)
         self.__download.Bind(wx.EVT_BUTTON,                 self.__onDownload)
         self.__close   .Bind(wx.EVT_BUTTON,                 self.__onClose)
 
@@ -1296,20 +2798,49 @@ class XNATBrowserDialog(wx.Dialog):
     def __onHighlight(self, ev):
         """Called when the item selection in the tree browser is changed.
         Enables/disables the download button depending on whether any
-        files are highlighted.
+        files, or any items which can be downloaded as an archive, are
+        highlighted.
+        """
+        items = self.__panel.GetSelectedItems()
+        self.__download.Enable(any(l == 'file' or l in download.ARCHIVE_URIS
+                                   for _, l in items))
+
+
+    def __onSelect(self, ev):
+        """Called when files are double-clicked in the tree browser.
+        Downloads the selected files, but not any other selected items -
+        experiments, scans and resources are only downloaded via the
+        *Download* button.
         """
-        self.__download.Enable(len(self.__panel.GetSelectedFiles()) > 0)
+        self.__downloadSelected(archives=False)
 
 
     def __onDownload(self, ev):
-        """Called when the *Download* button is pushed. Prompts the user to
-        select a local directory to download the files to, then downloads
-        all of the selected files.
+        """Called when the *Download* button is pushed. Downloads all of the
+        selected files. Selected experiments, scans and resources are
+        downloaded as archives (see :meth:`XNATBrowserPanel.DownloadArchive`).
         """
+        self.__downloadSelected(archives=True)
+
 
-        files = self.__panel.GetSelectedFiles()
+    def __downloadSelected(self, archives):
+        """Prompts the user to select a local directory to download to, then
+        downloads all of the selected files.
 
-        if len(files) == 0:
+        :arg archives: If ``True``, selected experiments, scans and resources
+                       are downloaded as archives.
+        """
+
+        items = self.__panel.GetSelectedItems()
+        files = [o for o, l in items if l == 'file']
+
+        if archives:
+            archives = [(o, l) for o, l in items
+                        if l in download.ARCHIVE_URIS]
+        else:
+            archives = []
+
+        if len(files) == 0 and len(archives) == 0:
             return
 
         dlg = wx.DirDialog(self, 'Select a download location')
@@ -1318,11 +2849,13 @@ class XNATBrowserDialog(wx.Dialog):
             return
 
         destDir = dlg.GetPath()
+        dests   = [op.join(destDir, op.basename(f.id)) for f in files]
+
+        if len(files) > 0:
+            self.__panel.DownloadFiles(files, dests)
 
-        for fobj in files:
-            name = op.basename(fobj.id)
-            dest = op.join(destDir, name)
-            self.__panel.DownloadFile(fobj, dest)
+        for obj, level in archives:
+            self.__panel.DownloadArchive(obj, level, destDir)
 
 
     def __onClose(self, ev):
@@ -0,0 +1,469 @@
+#!/usr/bin/env python
+#
+# cache.py - Caching of responses from the XNAT server.
+#
+# Author: Paul McCarthy <pauldmccarthy@gmail.com>
+#
+"""This module contains logic used by the :class:`.XNATBrowserPanel` for
+caching responses from the XNAT server.
+
+All of the listings that are displayed by the ``XNATBrowserPanel`` are
+retrieved by ``xnatpy`` via the ``get_json`` method of the ``xnat`` session
+object. The :class:`ListingCache` replaces this method on a session object
+with one which caches the responses to collection listings (see
+:func:`isListing`), in memory (a :class:`MemoryCache`) and, optionally, on
+disk (a :class:`DiskCache`). Responses are cached separately for each host
+and user.
+
+.. autosummary::
+   :nosignatures:
+
+   MemoryCache
+   DiskCache
+   ListingCache
+   isListing
+"""
+
+
+import os.path as op
+import            os
+import            json
+import            time
+import            logging
+import            sqlite3
+import            threading
+import            collections
+
+from urllib.parse import urlencode
+
+
+log = logging.getLogger(__name__)
+
+
+DEFAULT_TTL = 7 * 24 * 60 * 60
+"""Default time, in seconds, for which cached responses are considered
+valid.
+"""
+
+
+DEFAULT_SIZE = 64 * 1048576
+"""Default maximum size, in bytes, of a :class:`MemoryCache`. """
+
+
+LISTING_COLLECTIONS = ('projects',
+                       'subjects',
+                       'experiments',
+                       'assessors',
+                       'scans',
+                       'resources',
+                       'files')
+"""Names of the XNAT collections whose listings are cached by the
+:class:`ListingCache`.
+"""
+
+
+def isListing(uri):
+    """Returns ``True`` if the given URI refers to a listing of a XNAT
+    collection (e.g. ``'/data/projects/P/subjects'``), or ``False`` if it
+    refers to anything else, such as a single XNAT object (e.g.
+    ``'/data/projects/P/subjects/S'``).
+    """
+
+    segments = [s for s in uri.split('?')[0].split('/') if s != '']
+
+    if len(segments) > 0 and segments[0] in ('data', 'REST'):
+        segments = segments[1:]
+    if len(segments) > 0 and segments[0] == 'archive':
+        segments = segments[1:]
+
+    # Collection listings are of the
+    # form [collection/id/]*collection
+    return len(segments) % 2 == 1 and segments[-1] in LISTING_COLLECTIONS
+
+
+def matches(key, uri):
+    """Returns ``True`` if the given cache ``key`` refers to ``uri``, or to
+    a URI beneath ``uri`` - e.g. ``'/data/projects/P/subjects?columns=ID'``
+    matches ``'/data/projects/P'``, but ``'/data/projects/P2'`` does not.
+    """
+    return key == uri or key.startswith((uri + '?', uri + '/'))
+
+
+class MemoryCache(object):
+    """The ``MemoryCache`` is a least-recently-used cache of JSON responses,
+    stored in memory. Responses are stored in serialised form, and the total
+    size of all stored responses is bounded - when the cache is full, the
+    least recently used responses are evicted.
+
+    The number of cache hits, misses and evictions is recorded - see
+    :meth:`stats`. A ``MemoryCache`` may be used from multiple threads.
+    """
+
+
+    def __init__(self, maxSize=None):
+        """Create a ``MemoryCache``.
+
+        :arg maxSize: Maximum total size, in bytes, of all stored responses.
+                      Defaults to :data:`DEFAULT_SIZE`.
+        """
+
+        if maxSize is None:
+            maxSize = DEFAULT_SIZE
+
+        self.__maxSize   = maxSize
+        self.__size      = 0
+        self.__entries   = collections.OrderedDict()
+        self.__lock      = threading.Lock()
+        self.__hits      = 0
+        self.__misses    = 0
+        self.__evictions = 0
+
+
+    def stats(self):
+        """Returns a dictionary containing statistics about this
+        ``MemoryCache``, with keys ``'hits'``, ``'misses'``, ``'evictions'``,
+        ``'entries'`` and ``'size'`` (in bytes).
+        """
+        with self.__lock:
+            return {'hits'      : self.__hits,
+                    'misses'    : self.__misses,
+                    'evictions' : self.__evictions,
+                    'entries'   : len(self.__entries),
+                    'size'      : self.__size}
+
+
+    def get(self, host, user, key):
+        """Returns the cached response for the given ``host``, ``user`` and
+        ``key``, or ``None`` if there is no cached response.
+        """
+
+        with self.__lock:
+            value = self.__entries.get((host, user, key), None)
+
+            if value is None:
+                self.__misses += 1
+                return None
+
+            self.__hits += 1
+            self.__entries.move_to_end((host, user, key))
+
+        return json.loads(value)
+
+
+    def put(self, host, user, key, value):
+        """Store a response in the cache, evicting the least recently used
+        responses if necessary. Responses which are larger than the cache
+        are not stored.
+        """
+
+        value = json.dumps(value)
+
+        with self.__lock:
+
+            old = self.__entries.pop((host, user, key), None)
+            if old is not None:
+                self.__size -= len(old)
+
+            if len(value) > self.__maxSize:
+                return
+
+            self.__entries[host, user, key] = value
+            self.__size                    += len(value)
+
+            while self.__size > self.__maxSize:
+                _, evicted        = self.__entries.popitem(last=False)
+                self.__size      -= len(evicted)
+                self.__evictions += 1
+
+
+    def invalidate(self, host, user, uri=None):
+        """Remove cached responses for the given ``host`` and ``user``. If
+        ``uri`` is provided, only responses for ``uri``, and for URIs beneath
+        it, are removed.
+        """
+        with self.__lock:
+            for h, u, key in list(self.__entries.keys()):
+                if h == host and u == user and \
+                   (uri is None or matches(key, uri)):
+                    self.__size -= len(self.__entries.pop((h, u, key)))
+
+
+class DiskCache(object):
+    """The ``DiskCache`` is a persistent cache of JSON responses, stored in a
+    SQLite database. Responses are keyed by host, user and URI, and expire
+    after a fixed amount of time.
+
+    A ``DiskCache`` may be used from multiple threads.
+    """
+
+
+    def __init__(self, path, ttl=None):
+        """Create a ``DiskCache``.
+
+        :arg path: Path to the SQLite database file. It is created if it
+                   does not exist.
+        :arg ttl:  Time, in seconds, after which cached responses expire.
+                   Defaults to :data:`DEFAULT_TTL`.
+        """
+
+        if ttl is None:
+            ttl = DEFAULT_TTL
+
+        dirname = op.dirname(op.abspath(path))
+        if not op.exists(dirname):
+            os.makedirs(dirname)
+
+        self.__ttl  = ttl
+        self.__lock = threading.Lock()
+        self.__conn = sqlite3.connect(path, check_same_thread=False)
+
+        with self.__lock, self.__conn:
+
+            # Caches created by older versions
+            # are not keyed by user, so are
+            # discarded
+            columns = self.__conn.execute(
+                'PRAGMA table_info(responses)').fetchall()
+            columns = [c[1] for c in columns]
+            if len(columns) > 0 and 'user' not in columns:
+                self.__conn.execute('DROP TABLE responses')
+
+            self.__conn.execute('CREATE TABLE IF NOT EXISTS responses ('
+                                'host  TEXT NOT NULL, '
+                                'user  TEXT NOT NULL, '
+                                'uri   TEXT NOT NULL, '
+                                'stamp REAL NOT NULL, '
+                                'value TEXT NOT NULL, '
+                                'PRIMARY KEY (host, user, uri))')
+
+
+    @property
+    def ttl(self):
+        """Returns the time, in seconds, after which responses expire. """
+        return self.__ttl
+
+
+    def close(self):
+        """Close the connection to the database. """
+        with self.__lock:
+            self.__conn.close()
+
+
+    def get(self, host, user, uri):
+        """Returns the cached response for the given ``host``, ``user`` and
+        ``uri``, or ``None`` if there is no cached response, or it has
+        expired.
+        """
+
+        with self.__lock:
+            row = self.__conn.execute(
+                'SELECT stamp, value FROM responses '
+                'WHERE host = ? AND user = ? AND uri = ?',
+                (host, user, uri)).fetchone()
+
+        if row is None:
+            return None
+
+        stamp, value = row
+
+        if time.time() - stamp > self.__ttl:
+            return None
+
+        return json.loads(value)
+
+
+    def put(self, host, user, uri, value):
+        """Store a response in the cache. """
+
+        value = json.dumps(value)
+
+        with self.__lock, self.__conn:
+            self.__conn.execute(
+                'INSERT OR REPLACE INTO responses '
+                '(host, user, uri, stamp, value) VALUES (?, ?, ?, ?, ?)',
+                (host, user, uri, time.time(), value))
+
+
+    def invalidate(self, host, user, uri=None):
+        """Remove cached responses for the given ``host`` and ``user``. If
+        ``uri`` is provided, only responses for ``uri``, and for URIs beneath
+        it (see :func:`matches`), are removed.
+        """
+
+        if uri is None:
+            sql  = 'DELETE FROM responses WHERE host = ? AND user = ?'
+            args = (host, user)
+        else:
+            sql  = 'DELETE FROM responses WHERE host = ? AND user = ? AND ' \
+                   '(uri = ? OR '                                        \
+                   ' substr(uri, 1, ?) = ? OR '                          \
+                   ' substr(uri, 1, ?) = ?)'
+            args = (host, user, uri,
+                    len(uri) + 1, uri + '?',
+                    len(uri) + 1, uri + '/')
+
+        with self.__lock, self.__conn:
+            self.__conn.execute(sql, args)
+
+        # Also remove expired responses
+        # for all hosts, while we're at it
+        with self.__lock, self.__conn:
+            self.__conn.execute('DELETE FROM responses WHERE stamp < ?',
+                                (time.time() - self.__ttl,))
+
+
+class ListingCache(object):
+    """The ``ListingCache`` caches collection listings from a XNAT server,
+    by replacing the ``get_json`` method of an ``xnat`` session object. All
+    other requests (e.g. for the details of a single object) are passed
+    straight through to the server.
+
+    Responses are cached in a :class:`MemoryCache` and, optionally, in a
+    :class:`DiskCache`. When a response is available in the ``DiskCache``,
+    it is returned immediately. The first time that each response from the
+    ``DiskCache`` is used, the request is re-issued in the background, and
+    the cache is updated with the response. Therefore, cached listings are
+    displayed immediately, and will be up to date the next time that they
+    are requested (or after the tree browser is refreshed).
+    """
+
+
+    def __init__(self, host, memory=None, disk=None, executor=None,
+                 user=None):
+        """Create a ``ListingCache``.
+
+        :arg host:     Host name, used to identify responses in the
+                       ``memory`` and ``disk`` caches.
+        :arg memory:   A :class:`MemoryCache`. If not provided, a new
+                       ``MemoryCache`` is created.
+        :arg disk:     A :class:`DiskCache`. If not provided, responses are
+                       not cached on disk.
+        :arg executor: A ``concurrent.futures.Executor`` used to re-validate
+                       cached responses in the background. If not provided,
+                       cached responses are not re-validated.
+        :arg user:     User name, used along with ``host`` to identify
+                       responses, so that listings retrieved by one user
+                       are never returned to another.
+        """
+
+        if memory is None: memory = MemoryCache()
+        if user   is None: user   = ''
+
+        self.__host        = host
+        self.__user        = user
+        self.__memory      = memory
+        self.__disk        = disk
+        self.__executor    = executor
+        self.__revalidated = set()
+        self.__lock        = threading.Lock()
+
+
+    @property
+    def memory(self):
+        """Returns the :class:`MemoryCache` used by this ``ListingCache``. """
+        return self.__memory
+
+
+    @property
+    def disk(self):
+        """Returns the :class:`DiskCache` used by this ``ListingCache``, or
+        ``None``.
+        """
+        return self.__disk
+
+
+    @property
+    def executor(self):
+        """Returns the executor used by this ``ListingCache`` to re-validate
+        responses, or ``None``.
+        """
+        return self.__executor
+
+
+    @staticmethod
+    def key(uri, query=None):
+        """Generates a key for the given URI and query parameters, which is
+        used to identify a response in the cache.
+        """
+        if not query:
+            return uri
+        return '{}?{}'.format(uri, urlencode(sorted(query.items())))
+
+
+    def install(self, session):
+        """Replaces the ``get_json`` method of the given ``xnat`` session
+        object with one which uses this ``ListingCache``.
+        """
+
+        getJSON = session.get_json
+
+        def get_json(uri, query=None, accepted_status=None):
+            return self.__get(getJSON, uri, query, accepted_status)
+
+        session.get_json = get_json
+
+
+    def invalidate(self, uri=None):
+        """Removes cached responses for ``uri``, and for all URIs beneath it,
+        or all cached responses if ``uri is None``.
+        """
+        self.__memory.invalidate(self.__host, self.__user, uri)
+        if self.__disk is not None:
+            self.__disk.invalidate(self.__host, self.__user, uri)
+
+
+    def __get(self, getJSON, uri, query, accepted_status):
+        """Called via the patched ``get_json`` session method. Returns a
+        cached response if possible, otherwise passes the request through
+        to the original ``get_json`` method. Only collection listings are
+        cached.
+        """
+
+        if not isListing(uri):
+            return getJSON(uri, query=query, accepted_status=accepted_status)
+
+        host  = self.__host
+        user  = self.__user
+        key   = ListingCache.key(uri, query)
+        value = self.__memory.get(host, user, key)
+
+        def request():
+            value = getJSON(uri, query=query, accepted_status=accepted_status)
+            self.__memory.put(host, user, key, value)
+            if self.__disk is not None:
+                self.__disk.put(host, user, key, value)
+            return value
+
+        if value is not None:
+            return value
+
+        if self.__disk is not None: value = self.__disk.get(host, user, key)
+        else:                       value = None
+
+        if value is None:
+            return request()
+
+        log.debug('Disk cache hit: %s', key)
+
+        self.__memory.put(host, user, key, value)
+
+        with self.__lock:
+            revalidate = key not in self.__revalidated
+            self.__revalidated.add(key)
+
+        if revalidate and self.__executor is not None:
+
+            def revalidateRequest():
+                try:
+                    request()
+                except Exception as e:
+                    log.debug('Error re-validating %s: %s', key, e)
+
+            # The executor is shut down
+            # when the session is closed
+            try:
+                self.__executor.submit(revalidateRequest)
+            except RuntimeError:
+                log.debug('Not re-validating %s - cache is closed', key)
+
+        return value
@@ -0,0 +1,307 @@
+#!/usr/bin/env python
+#
+# connection.py - Establishing connections to XNAT servers.
+#
+# Author: Paul McCarthy <pauldmccarthy@gmail.com>
+#
+"""This module contains logic used by the :class:`.XNATBrowserPanel` for
+establishing connections to XNAT servers. Nothing in this module interacts
+with ``wx``, so it may be used from any thread.
+
+.. autosummary::
+   :nosignatures:
+
+   connect
+   disconnect
+   hostKey
+   resume
+   sessionToken
+"""
+
+
+import            time
+import            logging
+import            inspect
+import            threading
+
+import xnat
+import xnat.session
+
+
+log = logging.getLogger(__name__)
+
+
+GRACE = 2
+"""Time, in seconds, that :func:`connect` will wait for a connection to a
+preferred host (e.g. ``https://``) to be established, after a connection to
+a less preferred host (e.g. ``http://``) has been established.
+"""
+
+
+def hostKey(host):
+    """Returns a key which identifies the given ``host`` (as entered by the
+    user, or as returned by :func:`connect`), with any ``http://`` or
+    ``https://`` prefix, and any trailing slashes, removed. For example,
+    ``'https://xnat.org/'`` becomes ``'xnat.org'``.
+    """
+    host = host.strip()
+    for scheme in ('https://', 'http://'):
+        if host.lower().startswith(scheme):
+            host = host[len(scheme):]
+            break
+    return host.rstrip('/')
+
+
+def disconnect(session, keepToken=False):
+    """Disconnects the given ``xnat`` session, logging any errors.
+
+    :arg session:   The ``xnat`` session.
+    :arg keepToken: If ``True``, the session is not ended on the XNAT
+                    server, so that its token (see :func:`sessionToken`)
+                    may be re-used with :func:`resume`.
+    """
+
+    # xnatpy ends the session on the
+    # server before closing it - the
+    # base class skips that request
+    base = getattr(xnat.session, 'BaseXNATSession', None)
+
+    try:
+        if keepToken and base is not None and isinstance(session, base):
+            base.disconnect(session)
+        else:
+            session.disconnect()
+    except Exception:
+        log.warning('Error occurred during session disconnection',
+                    exc_info=True)
+
+
+def connectArgs(timeout):
+    """Returns a dictionary of keyword arguments to pass to ``xnat.connect``,
+    to apply the given ``timeout`` to all requests made by the session.
+
+    ``xnatpy`` uses its ``pilot_timeout`` for the requests which check and
+    log in to the server, and its ``default_timeout`` for all other
+    requests - both the requests made while connecting (e.g. to retrieve
+    the data model), and all requests made through the session afterwards.
+    The timeout is given to both, so that no request can wait on an
+    unresponsive server indefinitely. Older versions of ``xnatpy`` may not
+    support either of them, in which case the ``xnatpy`` default is used.
+    """
+
+    if timeout is None:
+        return {}
+
+    params = inspect.signature(xnat.connect).parameters
+    kwargs = {}
+
+    for param in ('pilot_timeout', 'default_timeout'):
+        if param in params:
+            kwargs[param] = timeout
+        else:
+            log.debug('Installed version of xnatpy does not '
+                      'support %s', param)
+
+    return kwargs
+
+
+def connect(hosts,
+            username=None,
+            password=None,
+            timeout=None,
+            grace=None,
+            cancel=None):
+    """Connects to one of the given ``hosts``. Connections to all hosts are
+    attempted concurrently, and the most preferred host to which a
+    connection can be established is used.
+
+    A less preferred connection is used without waiting for the more
+    preferred connections to succeed or fail, once ``grace`` seconds have
+    passed. Connections which are not used are disconnected when they are
+    established.
+
+    :arg hosts:    Sequence of host URLs, in order of preference, e.g.
+                   ``['https://xnat.org', 'http://xnat.org']``.
+    :arg username: Username
+    :arg password: Password
+    :arg timeout:  Timeout, in seconds, for requests made while connecting,
+                   and by the session afterwards (see :func:`connectArgs`).
+                   May be a single number, or a ``(connect, read)`` tuple.
+                   If not provided, the ``xnatpy`` default is used.
+    :arg grace:    Time, in seconds, to wait for a more preferred host after
+                   a connection to a less preferred host has been
+                   established. Defaults to :data:`GRACE`.
+    :arg cancel:   A ``threading.Event`` which may be set to abandon all
+                   connection attempts.
+    :returns:      A tuple containing the host URL and the ``xnat`` session,
+                   or ``None`` if ``cancel`` was set.
+    :raises:       The error raised when connecting to the most preferred
+                   host, if no connection could be established.
+    """
+
+    if grace  is None: grace  = GRACE
+    if cancel is None: cancel = threading.Event()
+
+    hosts   = list(hosts)
+    kwargs  = connectArgs(timeout)
+    cond    = threading.Condition()
+    results = {}
+    decided = [False]
+
+    def attempt(host):
+        try:
+            sess  = xnat.connect(host, user=username, password=password,
+                                 **kwargs)
+            error = None
+        except Exception as e:
+            log.debug('Could not connect to %s: %s', host, e)
+            sess  = None
+            error = e
+
+        with cond:
+            results[host] = (sess, error)
+            discard       = decided[0]
+            cond.notify_all()
+
+        # A connection has already been
+        # chosen, so this one is not needed
+        if discard and sess is not None:
+            disconnect(sess)
+
+    for host in hosts:
+        threading.Thread(target=attempt, args=(host,), daemon=True).start()
+
+    with cond:
+        deadline = None
+        while True:
+
+            if cancel.is_set():
+                winner = None
+                break
+
+            winner, pending = choose(hosts, results)
+
+            if winner is not None and not pending:
+                break
+
+            if len(results) == len(hosts):
+                break
+
+            # A less preferred connection is available -
+            # give the preferred ones a little longer
+            if winner is not None:
+                if deadline is None:
+                    deadline = time.time() + grace
+                elif time.time() >= deadline:
+                    break
+
+            cond.wait(0.1)
+
+        decided[0] = True
+        unused     = [s for h, (s, _) in results.items()
+                      if h != winner and s is not None]
+
+    for sess in unused:
+        disconnect(sess)
+
+    if cancel.is_set():
+        if winner is not None:
+            disconnect(results[winner][0])
+        return None
+
+    if winner is None:
+        raise results[hosts[0]][1]
+
+    log.debug('Connected to %s', winner)
+
+    return winner, results[winner][0]
+
+
+def choose(hosts, results):
+    """Used by :func:`connect`. Chooses the most preferred host which has
+    been successfully connected to.
+
+    :arg hosts:   Sequence of hosts in order of preference.
+    :arg results: Dictionary of ``{host : (session, error)}`` for all
+                  connection attempts that have finished.
+    :returns:     A tuple containing the most preferred connected host
+                  (or ``None``), and a boolean indicating whether there
+                  are any more preferred hosts which have not yet finished.
+    """
+
+    pending = False
+
+    for host in hosts:
+        if host not in results:
+            pending = True
+        elif results[host][0] is not None:
+            return host, pending
+
+    return None, pending
+
+
+def sessionToken(session):
+    """Returns the ``JSESSIONID`` token of the given ``xnat`` session, or
+    ``None`` if it is not known.
+    """
+
+    token = getattr(session, 'jsession', None)
+
+    if token is not None:
+        return token
+
+    try:
+        return session.interface.cookies.get('JSESSIONID', None)
+    except Exception as e:
+        log.debug('Could not retrieve session token: %s', e)
+        return None
+
+
+def resume(host, username, token, timeout=None):
+    """Attempts to connect to the given host by re-using a session token,
+    instead of logging in. ``xnatpy`` checks that the token is still valid
+    while connecting, so no separate check is made.
+
+    :arg host:     Host URL, e.g. ``'https://xnat.org'``.
+    :arg username: Username that the token was created for, or ``None`` to
+                   accept any (non-guest) user.
+    :arg token:    ``JSESSIONID`` token, e.g. as returned by
+                   :func:`sessionToken`.
+    :arg timeout:  Timeout, in seconds, for requests made by the session
+                   (see :func:`connectArgs`).
+    :returns:      A ``xnat`` session, or ``None`` if the token is no
+                   longer valid, or could not be used.
+    """
+
+    params = inspect.signature(xnat.connect).parameters
+
+    if 'jsession' not in params:
+        log.debug('Installed version of xnatpy does not '
+                  'support re-using session tokens')
+        return None
+
+    try:
+        session = xnat.connect(host,
+                               user=username,
+                               jsession=token,
+                               **connectArgs(timeout))
+    except Exception as e:
+        log.debug('Could not re-use session token for %s (it has '
+                  'probably expired): %s', host, e)
+        return None
+
+    # xnatpy only warns if the token
+    # belongs to a different user, or
+    # to the guest user
+    user = getattr(session, 'logged_in_user', None)
+
+    if user == 'guest' or \
+       (None not in (user, username) and user != username):
+        log.debug('Session token for %s belongs to %s, not %s',
+                  host, user, username)
+        disconnect(session, keepToken=True)
+        return None
+
+    log.debug('Re-used session token for %s', host)
+
+    return session
@@ -0,0 +1,503 @@
+#!/usr/bin/env python
+#
+# dataview.py - The XNATDataViewTree class.
+#
+# Author: Paul McCarthy <pauldmccarthy@gmail.com>
+#
+"""This module provides the :class:`XNATDataViewTree`, a virtual tree control
+which may be used by the :class:`.XNATBrowserPanel` in place of a
+``wx.TreeCtrl``.
+
+The ``XNATDataViewTree`` is a ``wx.dataview.DataViewCtrl`` which is backed
+by a :class:`XNATTreeModel`. Tree items are stored as lightweight
+:class:`TreeNode` objects - ``wx`` only creates items for nodes which are
+actually visible, so very large hierarchies can be browsed without
+materialising a ``wx`` item for every node. Filters are applied by the
+``XNATBrowserPanel`` to the listings that it retrieves, before items are
+added to the tree, so the same filtering logic is used for both tree
+implementations.
+
+The ``XNATDataViewTree`` provides the subset of the ``wx.TreeCtrl``
+interface which is used by the ``XNATBrowserPanel``, so the two can be used
+interchangeably. Tree items are represented by ``wx.dataview.DataViewItem``
+objects instead of ``wx.TreeItemId`` objects.
+"""
+
+
+import logging
+
+import wx
+import wx.dataview as dv
+
+
+log = logging.getLogger(__name__)
+
+
+class TreeNode(object):
+    """A ``TreeNode`` represents one item in a :class:`XNATDataViewTree`. """
+
+    __slots__ = ('text', 'image', 'data', 'parent', 'children', '__weakref__')
+
+
+    def __init__(self, parent, text, image, data):
+        """Create a ``TreeNode``.
+
+        :arg parent: Parent ``TreeNode``, or ``None`` for the root node.
+        :arg text:   Item label.
+        :arg image:  Index of the item image in the tree image list, or
+                     ``-1`` for no image.
+        :arg data:   Data associated with the item.
+        """
+        self.parent   = parent
+        self.text     = text
+        self.image    = image
+        self.data     = data
+        self.children = []
+
+
+class XNATTreeModel(dv.PyDataViewModel):
+    """The ``XNATTreeModel`` is a ``wx.dataview.PyDataViewModel`` which
+    stores a tree of :class:`TreeNode` objects. It is used by the
+    :class:`XNATDataViewTree`. The children of a node are only passed to
+    ``wx`` when they need to be displayed.
+    """
+
+
+    def __init__(self):
+        """Create a ``XNATTreeModel``. """
+        dv.PyDataViewModel.__init__(self)
+        self.UseWeakRefs(True)
+
+        self.__root      = None
+        self.__imageList = None
+
+
+    @property
+    def root(self):
+        """Returns the root :class:`TreeNode`, or ``None`` if there is no
+        root.
+        """
+        return self.__root
+
+
+    @root.setter
+    def root(self, node):
+        """Set the root :class:`TreeNode`. """
+        self.__root = node
+
+
+    def SetImageList(self, imageList):
+        """Set the ``wx.ImageList`` containing the icons to display alongside
+        each item.
+        """
+        self.__imageList = imageList
+
+
+    def ToItem(self, node):
+        """Returns a ``wx.dataview.DataViewItem`` for the given
+        :class:`TreeNode`.
+        """
+        if node is None: return dv.NullDataViewItem
+        else:            return self.ObjectToItem(node)
+
+
+    def ToNode(self, item):
+        """Returns the :class:`TreeNode` for the given
+        ``wx.dataview.DataViewItem``.
+        """
+        if not item.IsOk(): return None
+        else:               return self.ItemToObject(item)
+
+
+    def GetColumnCount(self):
+        """Overrides ``PyDataViewModel.GetColumnCount``. """
+        return 1
+
+
+    def GetColumnType(self, col):
+        """Overrides ``PyDataViewModel.GetColumnType``. """
+        return 'wxDataViewIconText'
+
+
+    def GetChildren(self, parent, children):
+        """Overrides ``PyDataViewModel.GetChildren``. Only called by ``wx``
+        when the children of ``parent`` need to be displayed.
+        """
+
+        if not parent.IsOk():
+            if self.__root is None: nodes = []
+            else:                   nodes = [self.__root]
+        else:
+            nodes = self.ItemToObject(parent).children
+
+        for node in nodes:
+            children.append(self.ObjectToItem(node))
+
+        return len(nodes)
+
+
+    def IsContainer(self, item):
+        """Overrides ``PyDataViewModel.IsContainer``. """
+        if not item.IsOk():
+            return True
+        return len(self.ItemToObject(item).children) > 0
+
+
+    def HasContainerColumns(self, item):
+        """Overrides ``PyDataViewModel.HasContainerColumns``. """
+        return True
+
+
+    def GetParent(self, item):
+        """Overrides ``PyDataViewModel.GetParent``. """
+        if not item.IsOk():
+            return dv.NullDataViewItem
+        return self.ToItem(self.ItemToObject(item).parent)
+
+
+    def GetValue(self, item, col):
+        """Overrides ``PyDataViewModel.GetValue``. """
+
+        node = self.ItemToObject(item)
+
+        if node.image >= 0 and self.__imageList is not None:
+            icon = self.__imageList.GetIcon(node.image)
+        else:
+            icon = wx.NullIcon
+
+        return dv.DataViewIconText(node.text, icon)
+
+
+    def SetValue(self, value, item, col):
+        """Overrides ``PyDataViewModel.SetValue``. Items cannot be edited,
+        so this method does nothing.
+        """
+        return False
+
+
+class XNATDataViewTree(dv.DataViewCtrl):
+    """The ``XNATDataViewTree`` is a ``wx.dataview.DataViewCtrl`` which
+    implements the parts of the ``wx.TreeCtrl`` interface that are used by
+    the :class:`.XNATBrowserPanel`. It is backed by a :class:`XNATTreeModel`.
+
+    Changes to the tree are propagated to the ``wx.dataview.DataViewCtrl``
+    immediately, unless the tree is frozen (via ``Freeze``), in which case
+    all changes are propagated in bulk when the tree is thawed.
+
+    The ``wx.TreeCtrl`` events emitted by a ``wx.TreeCtrl`` are not emitted
+    by the ``XNATDataViewTree`` - use
+    ``wx.dataview.EVT_DATAVIEW_ITEM_ACTIVATED`` and
+    ``wx.dataview.EVT_DATAVIEW_SELECTION_CHANGED`` instead.
+    """
+
+
+    def __init__(self, parent, multiple=True):
+        """Create a ``XNATDataViewTree``.
+
+        :arg parent:   ``wx`` parent object.
+        :arg multiple: If ``True`` (the default), multiple items may be
+                       selected.
+        """
+
+        style = dv.DV_NO_HEADER
+        if multiple:
+            style |= dv.DV_MULTIPLE
+
+        dv.DataViewCtrl.__init__(self, parent, style=style)
+
+        self.__model     = XNATTreeModel()
+        self.__imageList = None
+        self.__frozen    = 0
+
+        # Nodes which have been added while the
+        # tree is frozen, keyed by their parents.
+        # The dataview ctrl is notified of these
+        # nodes when the tree is thawed.
+        self.__pending   = {}
+
+        self.AssociateModel(self.__model)
+        self.__model.DecRef()
+        self.AppendIconTextColumn('', 0)
+
+
+    @property
+    def model(self):
+        """Returns the :class:`XNATTreeModel` which stores the tree. """
+        return self.__model
+
+
+    def Freeze(self):
+        """Overrides ``wx.Window.Freeze``. Changes to the tree are not
+        propagated until the tree is thawed.
+        """
+        self.__frozen += 1
+        dv.DataViewCtrl.Freeze(self)
+
+
+    def Thaw(self):
+        """Overrides ``wx.Window.Thaw``. Propagates any changes that were
+        made while the tree was frozen.
+        """
+        self.__frozen = max(0, self.__frozen - 1)
+        if self.__frozen == 0:
+            self.__flush()
+        dv.DataViewCtrl.Thaw(self)
+
+
+    def AssignImageList(self, imageList):
+        """Set the ``wx.ImageList`` containing item icons. """
+        self.__imageList = imageList
+        self.__model.SetImageList(imageList)
+
+
+    def AddRoot(self, text, image=-1, selImage=-1, data=None):
+        """Add a root item to the tree. Any existing items are removed. """
+        self.DeleteAllItems()
+        node             = TreeNode(None, text, image, data)
+        self.__model.root = node
+        self.__model.Cleared()
+        return self.__model.ToItem(node)
+
+
+    def AppendItem(self, parent, text, image=-1, selImage=-1, data=None):
+        """Add a new item as the last child of ``parent``. """
+        pnode = self.__model.ToNode(parent)
+        node  = TreeNode(pnode, text, image, data)
+        pnode.children.append(node)
+        self.__added(pnode, node)
+        return self.__model.ToItem(node)
+
+
+    def PrependItem(self, parent, text, image=-1, selImage=-1, data=None):
+        """Add a new item as the first child of ``parent``. """
+        pnode = self.__model.ToNode(parent)
+        node  = TreeNode(pnode, text, image, data)
+        pnode.children.insert(0, node)
+        self.__added(pnode, node)
+        return self.__model.ToItem(node)
+
+
+    def InsertItem(self, parent, previous, text, image=-1, selImage=-1,
+                   data=None):
+        """Add a new item as a child of ``parent``, directly after the
+        ``previous`` item.
+        """
+        pnode = self.__model.ToNode(parent)
+        prev  = self.__model.ToNode(previous)
+        node  = TreeNode(pnode, text, image, data)
+        idx   = pnode.children.index(prev) + 1
+        pnode.children.insert(idx, node)
+        self.__added(pnode, node)
+        return self.__model.ToItem(node)
+
+
+    def Delete(self, item):
+        """Remove the given item, and all of its children, from the tree. """
+
+        node = self.__model.ToNode(item)
+
+        if node is self.__model.root:
+            self.DeleteAllItems()
+            return
+
+        self.__flush()
+        pnode = node.parent
+        pnode.children.remove(node)
+        self.__model.ItemDeleted(self.__model.ToItem(pnode), item)
+
+
+    def DeleteChildren(self, item):
+        """Remove all children of the given item from the tree. """
+
+        node = self.__model.ToNode(item)
+
+        if len(node.children) == 0:
+            return
+
+        self.__flush()
+        items = dv.DataViewItemArray()
+        for c in node.children:
+            items.append(self.__model.ToItem(c))
+
+        node.children = []
+        self.__model.ItemsDeleted(item, items)
+
+
+    def DeleteAllItems(self):
+        """Remove all items from the tree. """
+        self.__pending    = {}
+        self.__model.root = None
+        self.__model.Cleared()
+
+
+    def GetRootItem(self):
+        """Returns the root item, or an invalid item if there is no root. """
+        return self.__model.ToItem(self.__model.root)
+
+
+    def GetItemParent(self, item):
+        """Returns the parent of the given item. """
+        return self.__model.ToItem(self.__model.ToNode(item).parent)
+
+
+    def GetItemData(self, item):
+        """Returns the data associated with the given item. """
+        return self.__model.ToNode(item).data
+
+
+    def SetItemData(self, item, data):
+        """Set the data associated with the given item. """
+        self.__model.ToNode(item).data = data
+
+
+    def GetItemText(self, item):
+        """Returns the label of the given item. """
+        return self.__model.ToNode(item).text
+
+
+    def SetItemText(self, item, text):
+        """Set the label of the given item. """
+        self.__model.ToNode(item).text = text
+        self.__changed(item)
+
+
+    def SetItemImage(self, item, image, which=wx.TreeItemIcon_Normal):
+        """Set the icon of the given item. """
+        self.__model.ToNode(item).image = image
+        self.__changed(item)
+
+
+    def GetChildrenCount(self, item, recursively=True):
+        """Returns the number of children of the given item. """
+
+        node = self.__model.ToNode(item)
+
+        if not recursively:
+            return len(node.children)
+
+        count = 0
+        stack = list(node.children)
+        while len(stack) > 0:
+            node   = stack.pop()
+            count += 1
+            stack.extend(node.children)
+        return count
+
+
+    def GetFirstChild(self, item):
+        """Returns a tuple containing the first child of the given item, and
+        a cookie which can be passed to :meth:`GetNextChild`.
+        """
+        return self.GetNextChild(item, 0)
+
+
+    def GetNextChild(self, item, cookie):
+        """Returns a tuple containing the next child of the given item, and
+        a cookie which can be passed to the next call to
+        :meth:`GetNextChild`.
+        """
+        children = self.__model.ToNode(item).children
+        if cookie >= len(children):
+            return dv.NullDataViewItem, cookie
+        return self.__model.ToItem(children[cookie]), cookie + 1
+
+
+    def GetPrevSibling(self, item):
+        """Returns the sibling which precedes the given item, or an invalid
+        item if it is the first child of its parent.
+        """
+        node = self.__model.ToNode(item)
+        if node.parent is None:
+            return dv.NullDataViewItem
+        siblings = node.parent.children
+        idx      = siblings.index(node)
+        if idx == 0:
+            return dv.NullDataViewItem
+        return self.__model.ToItem(siblings[idx - 1])
+
+
+    def GetFocusedItem(self):
+        """Returns the item which currently has focus. """
+        return self.GetCurrentItem()
+
+
+    def SetFocusedItem(self, item):
+        """Set the item which currently has focus. """
+        self.__flush()
+        self.SetCurrentItem(item)
+
+
+    def SelectItem(self, item, select=True):
+        """Select or de-select the given item. """
+        if select: self.Select(  item)
+        else:      self.Unselect(item)
+
+
+    def Expand(self, item):
+        """Expand the given item. """
+        self.__flush()
+        if self.__model.ToNode(item).children:
+            dv.DataViewCtrl.Expand(self, item)
+
+
+    def ExpandAllChildren(self, item):
+        """Expand the given item, and all of its descendants. """
+
+        self.__flush()
+
+        stack = [self.__model.ToNode(item)]
+
+        while len(stack) > 0:
+            node = stack.pop()
+            if node.children:
+                dv.DataViewCtrl.Expand(self, self.__model.ToItem(node))
+                stack.extend(node.children)
+
+
+    def __added(self, pnode, node):
+        """Called when ``node`` is added to ``pnode``. Notifies the dataview
+        ctrl, or schedules a notification if the tree is frozen.
+        """
+
+        if self.__frozen > 0:
+            self.__pending.setdefault(id(pnode), (pnode, []))[1].append(node)
+            return
+
+        # The parent may have just become
+        # a container, so its expander
+        # button needs to be displayed
+        pitem = self.__model.ToItem(pnode)
+        if len(pnode.children) == 1 and pnode.parent is not None:
+            self.__model.ItemChanged(pitem)
+        self.__model.ItemAdded(pitem, self.__model.ToItem(node))
+
+
+    def __changed(self, item):
+        """Called when the label or icon of an item is changed. """
+        if self.__frozen == 0:
+            self.__model.ItemChanged(item)
+
+
+    def __flush(self):
+        """Notifies the dataview ctrl of all nodes which have been added
+        while the tree was frozen. Nodes are notified in bulk, one call
+        per parent.
+        """
+
+        pending        = self.__pending
+        self.__pending = {}
+
+        # Nodes are always flushed before any
+        # nodes are removed, so all pending
+        # nodes are still in the tree.
+        for pnode, nodes in pending.values():
+
+            pitem = self.__model.ToItem(pnode)
+            items = dv.DataViewItemArray()
+            for n in nodes:
+                items.append(self.__model.ToItem(n))
+
+            if pnode.parent is not None:
+                self.__model.ItemChanged(pitem)
+            self.__model.ItemsAdded(pitem, items)
+
@@ -0,0 +1,1103 @@
+#!/usr/bin/env python
+#
+# download.py - Downloading files from a XNAT server.
+#
+# Author: Paul McCarthy <pauldmccarthy@gmail.com>
+#
+"""This module contains logic used by the :class:`.XNATBrowserPanel` for
+downloading files from a XNAT server. Nothing in this module interacts with
+``wx``, so it may be used from any thread.
+
+.. autosummary::
+   :nosignatures:
+
+   Cancelled
+   ChecksumError
+   generateFilePath
+   expectedDigest
+   formatURI
+   openStream
+   downloadFile
+   downloadSegmented
+   DownloadManager
+   archivePath
+   extractArchive
+   downloadArchive
+"""
+
+
+import os.path            as op
+import                       os
+import                       re
+import                       time
+import                       zlib
+import                       struct
+import                       hashlib
+import                       logging
+import                       threading
+import                       collections
+import concurrent.futures as futures
+
+from urllib.parse import urlencode
+
+import wxnat.store as store
+
+
+log = logging.getLogger(__name__)
+
+
+DEFAULT_WORKERS = 4
+"""Default number of files which are downloaded concurrently by a
+:class:`DownloadManager`.
+"""
+
+
+PART_SUFFIX = '.part'
+"""Suffix given to files while they are being downloaded. Files are only
+renamed to their final destination once they have been completely
+downloaded.
+"""
+
+
+CHUNK_SIZE = 524288
+"""Number of bytes which are read from the XNAT server at a time. """
+
+
+RETRIES = 2
+"""Default number of times that a download is retried when its checksum
+does not match the checksum reported by the XNAT server.
+"""
+
+
+TIMEOUT = (30, 300)
+"""``(connect, read)`` timeout, in seconds, for all download requests. The
+read timeout is the maximum time to wait for each chunk of data (not for
+the whole download) - XNAT servers may take some time to start sending a
+zip archive.
+"""
+
+
+SEGMENTS = 4
+"""Default number of segments of a file which are downloaded concurrently
+by :func:`downloadSegmented`.
+"""
+
+
+SEGMENT_SIZE = 64 * 1048576
+"""Default size, in bytes, of each segment downloaded by
+:func:`downloadSegmented`.
+"""
+
+
+ARCHIVE_URIS = {
+    'experiment' : '/scans/ALL/files',
+    'scan'       : '/files',
+    'resource'   : '/files',
+}
+"""Items at these levels of the XNAT hierarchy may be downloaded as a single
+zip archive, by appending the URI suffix to the item URI - see
+:func:`downloadArchive`.
+"""
+
+
+class Cancelled(Exception):
+    """Raised by :func:`downloadFile` when a download is cancelled. """
+
+
+class ChecksumError(IOError):
+    """Raised by :func:`downloadFile` when the checksum of a downloaded file
+    does not match the checksum reported by the XNAT server.
+    """
+
+
+class RangeNotSupported(Exception):
+    """Raised by :func:`downloadSegmented` when the XNAT server does not
+    honour a range request.
+    """
+
+
+def generateFilePath(fobj):
+    """Generate a file/directory path for the given ``xnat.FileData``
+    object. The generated path can be used as a unique destination when
+    downloading a file.
+
+    The generated path has the form::
+
+        <project>/<subject>/<experiment>/<scan>/<resource>/<filename>
+    """
+
+    # We generate the path by taking the file object URI (it's
+    # unique identifier on the XNAT server), and stripping of
+    # the XNAT hierarchy level identifiers. This feels a bit
+    # hacky, but there is no other way to identify where a
+    # given FileData object resides in the hierarchy (as they
+    # don't seem to preserve a reference to their parent node).
+    remove = ['/data',
+              '/projects',
+              '/subjects',
+              '/experiments',
+              '/assessors',
+              '/scans',
+              '/resources',
+              '/files']
+
+    path = fobj.uri
+
+    for rem in remove:
+        path = path.replace(rem, '')
+
+    path = path.lstrip('/').split('/')
+
+    return op.join(*path)
+
+
+Progress = collections.namedtuple(
+    'Progress',
+    ('files', 'done', 'failed', 'nbytes', 'total', 'rate', 'eta'))
+"""Progress of a :class:`DownloadManager`, as returned by
+:meth:`DownloadManager.progress`:
+
+ - ``files``:  Total number of files
+ - ``done``:   Number of files that have finished (including failures)
+ - ``failed``: Number of files that failed
+ - ``nbytes``: Number of bytes downloaded
+ - ``total``:  Total number of bytes, or ``None`` if not known
+ - ``rate``:   Download rate in bytes per second
+ - ``eta``:    Estimated time remaining, in seconds, or ``None``
+"""
+
+
+def expectedDigest(fobj):
+    """Returns the MD5 digest of the given ``xnat.FileData`` object, as
+    reported by the XNAT server, or ``None`` if it is not available.
+    """
+
+    # The digest is usually included in the
+    # listing that the file came from - if
+    # not, xnatpy may retrieve it for us
+    digest = store.cachedFields(fobj).get('digest', None)
+
+    if digest is None:
+        try:
+            digest = getattr(fobj, 'digest', None)
+        except Exception as e:
+            log.debug('Could not retrieve digest for %s: %s', fobj.uri, e)
+
+    if not digest:
+        return None
+
+    return str(digest).lower()
+
+
+def formatURI(session, uri, format=None):
+    """Returns the full URL of the given XNAT URI (e.g.
+    ``'/data/experiments/E/files'``), on the server that ``session`` is
+    connected to.
+
+    ``xnatpy`` has no public method for this, so its private ``_format_uri``
+    method is used when it exists. Otherwise the URL is built from the
+    public ``server`` property of the session.
+
+    :arg session: ``xnat`` session
+    :arg uri:     XNAT URI
+    :arg format:  Value for a ``format`` query parameter, e.g. ``'zip'``.
+    """
+
+    formatURI = getattr(session, '_format_uri', None)
+
+    if formatURI is not None:
+        return formatURI(uri, format=format)
+
+    if format is None: query = ''
+    else:              query = '?' + urlencode({'format' : format})
+
+    return session.server.rstrip('/') + uri + query
+
+
+def parseContentRange(header):
+    """Parses the value of a HTTP ``Content-Range`` header, e.g.
+    ``'bytes 100-999/1000'``.
+
+    :returns: A tuple containing the offset of the first byte, and the total
+              size (or ``None`` if the size is not known), or
+              ``(None, None)`` if the header could not be parsed.
+    """
+
+    match = re.fullmatch(r'bytes\s+(\d+)-\d+/(\d+|\*)', header.strip())
+
+    if match is None:
+        return None, None
+
+    start, total = match.groups()
+
+    if total == '*': total = None
+    else:            total = int(total)
+
+    return int(start), total
+
+
+def openStream(fobj, offset=0):
+    """Opens a streaming request for the contents of a XNAT file, starting
+    from ``offset`` bytes into the file. If the XNAT server does not honour
+    the requested range, the returned stream starts from the beginning of
+    the file.
+
+    :arg fobj:   An ``xnat.FileData`` object.
+    :arg offset: Offset, in bytes, to start from.
+    :returns:    A tuple containing:
+                  - The ``requests.Response`` object
+                  - The offset that the response starts from
+                  - The total size of the file, or ``None`` if not known.
+    """
+
+    session = fobj.xnat_session
+    uri     = formatURI(session, fobj.uri)
+    headers = {}
+
+    if offset > 0:
+        headers['Range'] = 'bytes={}-'.format(offset)
+
+    response = session.interface.get(uri,
+                                     stream=True,
+                                     headers=headers,
+                                     timeout=TIMEOUT)
+
+    # Range not satisfiable - the requested
+    # offset is beyond the end of the file
+    if offset > 0 and response.status_code == 416:
+        response.close()
+        return openStream(fobj)
+
+    response.raise_for_status()
+
+    length = response.headers.get('Content-Length', None)
+    if length is not None:
+        length = int(length)
+
+    if response.status_code != 206:
+        return response, 0, length
+
+    start, total = parseContentRange(response.headers.get('Content-Range', ''))
+
+    # The server returned a
+    # different range to the
+    # one that we asked for
+    if start != offset:
+        response.close()
+        return openStream(fobj)
+
+    if total is None and length is not None:
+        total = offset + length
+
+    return response, offset, total
+
+
+def downloadFile(fobj,
+                 dest,
+                 update=None,
+                 resume=True,
+                 verify=False,
+                 retries=None):
+    """Download a XNAT file to ``dest``.
+
+    The file is downloaded to ``dest + PART_SUFFIX``, and is renamed to
+    ``dest`` once it is complete. If the download fails, or is cancelled,
+    the partial file is left in place and, if ``resume`` is ``True``, the
+    next download of the same file continues from where it stopped (see
+    :func:`openStream`).
+
+    If ``verify`` is ``True``, the MD5 digest of the file is calculated as
+    it is downloaded, and compared against the digest reported by the XNAT
+    server (see :func:`expectedDigest`). If they do not match, the file is
+    downloaded again from the start, up to ``retries`` times, after which
+    a :exc:`ChecksumError` is raised.
+
+    :arg fobj:    An ``xnat.FileData`` object.
+    :arg dest:    Path to download the file to.
+    :arg update:  Function which is called periodically during the
+                  download, with arguments ``(nbytes, total, finished)``.
+                  It may raise :exc:`Cancelled` to cancel the download.
+    :arg resume:  If ``True`` (the default), and a partial download of the
+                  file exists, only the remainder of the file is requested.
+    :arg verify:  If ``True``, the file checksum is verified. Defaults to
+                  ``False``.
+    :arg retries: Number of times to retry the download if the checksum
+                  does not match. Defaults to :data:`RETRIES`.
+    :returns:     ``dest``
+    """
+
+    if retries is None:
+        retries = RETRIES
+
+    if verify: digest = expectedDigest(fobj)
+    else:      digest = None
+
+    if verify and digest is None:
+        log.debug('No digest available for %s - it will '
+                  'not be verified', fobj.uri)
+
+    for attempt in range(retries + 1):
+        try:
+            return streamFile(fobj, dest, update, resume, digest)
+
+        except ChecksumError as e:
+            if attempt == retries:
+                raise
+            log.warning('%s - retrying (%i of %i)', e, attempt + 1, retries)
+            resume = False
+
+
+def streamFile(fobj, dest, update, resume, digest):
+    """Used by :func:`downloadFile`. Downloads a XNAT file to ``dest``,
+    optionally verifying its checksum.
+
+    :arg digest: Expected MD5 digest of the file, or ``None`` if the
+                 checksum should not be verified. The partial file is
+                 removed, and a :exc:`ChecksumError` raised, if the
+                 checksum does not match.
+    """
+
+    part = dest + PART_SUFFIX
+
+    if resume and op.exists(part): offset = op.getsize(part)
+    else:                          offset = 0
+
+    log.debug('Downloading file %s to %s (from byte %i)',
+              fobj.uri, dest, offset)
+
+    response, offset, total = openStream(fobj, offset)
+
+    if digest is not None: hasher = hashlib.md5()
+    else:                  hasher = None
+
+    if offset > 0: mode = 'ab'
+    else:          mode = 'wb'
+
+    # The part of the file that was
+    # downloaded previously has to be
+    # included in the checksum
+    if hasher is not None and offset > 0:
+        with open(part, 'rb') as f:
+            remaining = offset
+            while remaining > 0:
+                block      = f.read(min(remaining, CHUNK_SIZE))
+                remaining -= len(block)
+                hasher.update(block)
+                if len(block) == 0:
+                    break
+
+    with response, open(part, mode) as f:
+
+        f.truncate(offset)
+        nbytes = offset
+
+        if update is not None:
+            update(nbytes, total, False)
+
+        for chunk in response.iter_content(CHUNK_SIZE):
+            f.write(chunk)
+            nbytes += len(chunk)
+            if hasher is not None:
+                hasher.update(chunk)
+            if update is not None:
+                update(nbytes, total, False)
+
+    if total is not None and nbytes != total:
+        raise IOError('Download of {} is incomplete ({} of {} '
+                      'bytes)'.format(fobj.uri, nbytes, total))
+
+    if hasher is not None and hasher.hexdigest() != digest:
+        os.remove(part)
+        raise ChecksumError('Checksum of {} does not match ({} != '
+                            '{})'.format(fobj.uri, hasher.hexdigest(),
+                                         digest))
+
+    if update is not None:
+        update(nbytes, total, True)
+
+    os.replace(part, dest)
+
+    return dest
+
+
+def downloadSegmented(fobj,
+                      dest,
+                      update=None,
+                      segments=None,
+                      segmentSize=None,
+                      verify=False,
+                      retries=None):
+    """Download a XNAT file to ``dest``, in segments which are downloaded
+    concurrently over separate connections. This can be much faster than
+    :func:`downloadFile` for large files on high-latency connections.
+
+    The file is pre-allocated at ``dest + PART_SUFFIX``, and each segment is
+    written directly to its position within the file. The file is renamed
+    to ``dest`` once all segments have been downloaded. Partial segmented
+    downloads cannot be resumed, so the file is removed if the download
+    fails or is cancelled.
+
+    Files which are no larger than a single segment, or which are on a
+    server which does not support range requests, are downloaded with
+    :func:`downloadFile`.
+
+    If ``verify`` is ``True``, the checksum is calculated while the file is
+    being downloaded - each segment is added to the checksum as soon as it,
+    and all segments before it, have been downloaded, while the remaining
+    segments are still being downloaded. The file is not read back once
+    the download has finished.
+
+    :arg fobj:        An ``xnat.FileData`` object.
+    :arg dest:        Path to download the file to.
+    :arg update:      Function which is called periodically during the
+                      download, with arguments ``(nbytes, total,
+                      finished)``. It is always called from the calling
+                      thread, and may raise :exc:`Cancelled` to cancel the
+                      download.
+    :arg segments:    Maximum number of segments to download concurrently.
+                      Defaults to :data:`SEGMENTS`.
+    :arg segmentSize: Size of each segment in bytes. Defaults to
+                      :data:`SEGMENT_SIZE`.
+    :arg verify:      If ``True``, the file checksum is verified - see
+                      :func:`downloadFile`.
+    :arg retries:     Number of times to retry the download if the checksum
+                      does not match. Defaults to :data:`RETRIES`.
+    :returns:         ``dest``
+    """
+
+    if segments    is None: segments    = SEGMENTS
+    if segmentSize is None: segmentSize = SEGMENT_SIZE
+    if retries     is None: retries     = RETRIES
+
+    session  = fobj.xnat_session
+    uri      = formatURI(session, fobj.uri)
+    response = session.interface.head(uri,
+                                      allow_redirects=True,
+                                      timeout=TIMEOUT)
+
+    response.raise_for_status()
+
+    total  = response.headers.get('Content-Length', None)
+    ranges = response.headers.get('Accept-Ranges', 'bytes')
+
+    if total is None or ranges.lower() == 'none' or \
+       int(total) <= segmentSize:
+        return downloadFile(fobj, dest, update,
+                            verify=verify, retries=retries)
+
+    if verify: digest = expectedDigest(fobj)
+    else:      digest = None
+
+    if digest is not None: hasher = hashlib.md5()
+    else:                  hasher = None
+
+    total     = int(total)
+    part      = dest + PART_SUFFIX
+    offsets   = list(range(0, total, segmentSize))
+    nbytes    = [0] * len(offsets)
+    hashed    = [0]
+    cancelled = threading.Event()
+
+    log.debug('Downloading file %s to %s (%i segments)',
+              fobj.uri, dest, len(offsets))
+
+    with open(part, 'wb') as f:
+        f.truncate(total)
+
+    def segment(idx):
+        start   = offsets[idx]
+        end     = min(total, start + segmentSize) - 1
+        headers = {'Range' : 'bytes={}-{}'.format(start, end)}
+
+        with session.interface.get(uri,
+                                   stream=True,
+                                   headers=headers,
+                                   timeout=TIMEOUT) as r, \
+             open(part, 'r+b') as f:
+
+            r.raise_for_status()
+
+            crange = parseContentRange(r.headers.get('Content-Range', ''))
+            if r.status_code != 206 or crange[0] != start:
+                raise RangeNotSupported()
+
+            f.seek(start)
+            for chunk in r.iter_content(CHUNK_SIZE):
+                if cancelled.is_set():
+                    raise Cancelled()
+                f.write(chunk)
+                nbytes[idx] += len(chunk)
+
+        if nbytes[idx] != end - start + 1:
+            raise IOError('Download of {} is incomplete (segment {} '
+                          'of {})'.format(fobj.uri, idx + 1, len(offsets)))
+
+    # Adds all segments which have been
+    # downloaded, and which follow on from
+    # the segments that have already been
+    # added, to the checksum
+    def hashSegments(f):
+        while hashed[0] < len(offsets) and results[hashed[0]].done():
+            start     = offsets[hashed[0]]
+            remaining = min(total, start + segmentSize) - start
+            f.seek(start)
+            while remaining > 0:
+                block      = f.read(min(remaining, CHUNK_SIZE))
+                remaining -= len(block)
+                hasher.update(block)
+                if len(block) == 0:
+                    break
+            hashed[0] += 1
+
+    pool    = futures.ThreadPoolExecutor(max_workers=segments)
+    results = [pool.submit(segment, i) for i in range(len(offsets))]
+
+    if hasher is not None: hashf = open(part, 'rb')
+    else:                  hashf = None
+
+    # Progress is reported on
+    # this thread, so that the
+    # update function can e.g.
+    # update a GUI
+    try:
+        pending = results
+        while len(pending) > 0:
+            done, pending = futures.wait(
+                pending, 0.1, return_when=futures.FIRST_EXCEPTION)
+            for result in done:
+                result.result()
+            if hashf is not None:
+                hashSegments(hashf)
+            if update is not None:
+                update(sum(nbytes), total, False)
+
+    except BaseException as e:
+        cancelled.set()
+        for result in results:
+            result.cancel()
+        pool.shutdown()
+        if hashf is not None:
+            hashf.close()
+        os.remove(part)
+
+        if isinstance(e, RangeNotSupported):
+            log.debug('Server does not support range requests - '
+                      'downloading %s in one segment', fobj.uri)
+            return downloadFile(fobj, dest, update, resume=False,
+                                verify=verify, retries=retries)
+        raise
+
+    pool.shutdown()
+
+    if hashf is not None:
+        hashf.close()
+
+    if hasher is not None and hasher.hexdigest() != digest:
+        os.remove(part)
+        if retries == 0:
+            raise ChecksumError('Checksum of {} does not '
+                                'match'.format(fobj.uri))
+        log.warning('Checksum of %s does not match - retrying',
+                    fobj.uri)
+        return downloadSegmented(fobj, dest, update, segments,
+                                 segmentSize, verify, retries - 1)
+
+    if update is not None:
+        update(total, total, True)
+
+    os.replace(part, dest)
+
+    return dest
+
+
+class DownloadManager(object):
+    """The ``DownloadManager`` downloads a collection of files concurrently,
+    on a pool of worker threads. Progress across all files is aggregated,
+    and is available via :meth:`progress`. Errors are collected for each
+    file, rather than aborting the remaining downloads. All downloads can be
+    cancelled via :meth:`cancel`.
+
+    Example::
+
+        manager = DownloadManager([(fobj1, dest1), (fobj2, dest2)])
+        manager.start()
+
+        while not manager.wait(0.1):
+            print(manager.progress())
+
+        for fobj, dest, error in manager.errors:
+            print('Failed: {} ({})'.format(fobj.id, error))
+    """
+
+
+    def __init__(self, jobs, workers=None, verify=False):
+        """Create a ``DownloadManager``.
+
+        :arg jobs:    Sequence of ``(fobj, dest)`` tuples, containing the
+                      ``xnat.FileData`` objects to download, and the paths
+                      to download them to.
+        :arg workers: Maximum number of files to download concurrently.
+                      Defaults to :data:`DEFAULT_WORKERS`.
+        :arg verify:  If ``True``, the checksum of each file is verified as
+                      it is downloaded - see :func:`downloadFile`.
+        """
+
+        if workers is None:
+            workers = DEFAULT_WORKERS
+
+        self.__jobs      = list(jobs)
+        self.__workers   = workers
+        self.__verify    = verify
+        self.__lock      = threading.Lock()
+        self.__cancelled = threading.Event()
+        self.__futures   = []
+        self.__start     = None
+        self.__done      = 0
+        self.__errors    = []
+        self.__results   = [None] * len(self.__jobs)
+        self.__nbytes    = [0]    * len(self.__jobs)
+
+        # Bytes of each file which were
+        # downloaded previously (see
+        # downloadFile), and which are
+        # not included in the rate
+        self.__resumed   = [None] * len(self.__jobs)
+
+        # Sizes of files which were included in
+        # their listing are known in advance -
+        # others are reported when the file
+        # download starts. We avoid the size
+        # attribute, as it makes a request.
+        self.__totals = [store.knownFields(f)[0] for f, _ in self.__jobs]
+
+
+    @property
+    def results(self):
+        """Returns a list containing the path to each downloaded file, or
+        ``None`` for files which failed, or were cancelled.
+        """
+        with self.__lock:
+            return list(self.__results)
+
+
+    @property
+    def errors(self):
+        """Returns a list of ``(fobj, dest, error)`` tuples for each file
+        which failed to download.
+        """
+        with self.__lock:
+            return list(self.__errors)
+
+
+    @property
+    def cancelled(self):
+        """Returns ``True`` if :meth:`cancel` has been called. """
+        return self.__cancelled.is_set()
+
+
+    def start(self):
+        """Start downloading the files. This method returns immediately. """
+
+        self.__start = time.time()
+
+        pool           = futures.ThreadPoolExecutor(max_workers=self.__workers)
+        self.__futures = [pool.submit(self.__download, i)
+                          for i in range(len(self.__jobs))]
+        pool.shutdown(wait=False)
+
+
+    def cancel(self):
+        """Cancel all downloads. Files which have not been started are
+        skipped, and in-progress downloads are stopped at their next chunk.
+        """
+        self.__cancelled.set()
+        for f in self.__futures:
+            f.cancel()
+
+
+    def wait(self, timeout=None):
+        """Wait for all downloads to finish.
+
+        :arg timeout: Maximum time, in seconds, to wait.
+        :returns:     ``True`` if all downloads have finished, ``False``
+                      otherwise.
+        """
+        _, pending = futures.wait(self.__futures, timeout)
+        return len(pending) == 0
+
+
+    def progress(self):
+        """Returns a :data:`Progress` tuple describing the progress of all
+        downloads.
+        """
+
+        with self.__lock:
+            nbytes = sum(self.__nbytes)
+            fresh  = nbytes - sum(r for r in self.__resumed if r is not None)
+            done   = self.__done
+            failed = len(self.__errors)
+            totals = list(self.__totals)
+
+        if self.__start is None: elapsed = 0
+        else:                    elapsed = time.time() - self.__start
+
+        if any(t is None for t in totals): total = None
+        else:                              total = sum(totals)
+
+        if elapsed > 0: rate = fresh / elapsed
+        else:           rate = 0
+
+        if total is not None and rate > 0:
+            eta = max(0, total - nbytes) / rate
+        else:
+            eta = None
+
+        return Progress(len(self.__jobs), done, failed,
+                        nbytes, total, rate, eta)
+
+
+    def __download(self, idx):
+        """Run on a worker thread. Downloads the file at index ``idx``. """
+
+        fobj, dest = self.__jobs[idx]
+
+        def update(nbytes, total, finished):
+            if self.__cancelled.is_set():
+                raise Cancelled()
+            with self.__lock:
+                self.__nbytes[idx] = nbytes
+                if self.__resumed[idx] is None:
+                    self.__resumed[idx] = nbytes
+                if total is not None:
+                    self.__totals[idx] = total
+
+        try:
+            if self.__cancelled.is_set():
+                raise Cancelled()
+
+            downloadFile(fobj, dest, update, verify=self.__verify)
+
+            with self.__lock:
+                self.__results[idx] = dest
+
+        except Cancelled:
+            log.debug('Download of %s cancelled', fobj.uri)
+
+        except Exception as e:
+            log.warning('Error downloading %s: %s', fobj.uri, e,
+                        exc_info=True)
+            with self.__lock:
+                self.__errors.append((fobj, dest, e))
+
+        finally:
+            with self.__lock:
+                self.__done += 1
+
+
+def archivePath(name, level):
+    """Maps the path of a file within a zip archive downloaded from XNAT
+    (see :func:`downloadArchive`) to a path relative to the downloaded item,
+    which follows the same layout as :func:`generateFilePath`.
+
+    XNAT archives are laid out like
+    ``<experiment>/scans/<scan>-<type>/resources/<resource>/files/<file>``.
+    Downloading a scan results in ``<resource>/<file>``, and downloading an
+    experiment results in ``<scan>/<resource>/<file>``. Paths which are not
+    laid out as expected are returned as-is.
+
+    :arg name:  Path of the file within the archive.
+    :arg level: Level of the downloaded item in the XNAT hierarchy, or
+                ``None`` to return the path as-is.
+    :returns:   A relative path, or ``None`` for directories.
+    """
+
+    # Ignore any components which
+    # could escape the destination
+    parts  = name.replace('\\', '/').split('/')
+    parts  = [p for p in parts if p not in ('', '.', '..')]
+    lparts = [p.lower() for p in parts]
+
+    if name.endswith('/') or len(parts) == 0:
+        return None
+
+    if level is None or 'resources' not in lparts:
+        return op.join(*parts)
+
+    ridx = lparts.index('resources')
+
+    if len(parts) < ridx + 4 or lparts[ridx + 2] != 'files':
+        return op.join(*parts)
+
+    path = parts[ridx + 3:]
+
+    if level in ('scan', 'experiment'):
+        path = [parts[ridx + 1]] + path
+
+    if level == 'experiment' and 'scans' in lparts[:ridx - 1]:
+        scan = parts[lparts.index('scans') + 1]
+        path = [scan.split('-', 1)[0]] + path
+
+    return op.join(*path)
+
+
+class ChunkReader(object):
+    """Used by :func:`extractArchive`. Provides ``read``-like access to a
+    sequence of byte chunks.
+    """
+
+
+    def __init__(self, chunks):
+        """Create a ``ChunkReader``.
+
+        :arg chunks: Iterable of ``bytes`` objects.
+        """
+        self.__chunks = iter(chunks)
+        self.__buffer = b''
+
+
+    def unread(self, data):
+        """Pushes ``data`` back onto the front of the stream. """
+        self.__buffer = data + self.__buffer
+
+
+    def readsome(self):
+        """Returns the next available data, or ``b''`` at the end of the
+        stream.
+        """
+        if len(self.__buffer) > 0:
+            data, self.__buffer = self.__buffer, b''
+            return data
+        for chunk in self.__chunks:
+            if len(chunk) > 0:
+                return chunk
+        return b''
+
+
+    def read(self, n):
+        """Returns exactly ``n`` bytes. Raises an ``EOFError`` if the stream
+        ends before ``n`` bytes are available.
+        """
+
+        while len(self.__buffer) < n:
+            chunk = next(self.__chunks, None)
+            if chunk is None:
+                raise EOFError('Unexpected end of archive')
+            self.__buffer += chunk
+
+        data, self.__buffer = self.__buffer[:n], self.__buffer[n:]
+        return data
+
+
+    def drain(self):
+        """Reads and discards the remainder of the stream. """
+        self.__buffer = b''
+        for _ in self.__chunks:
+            pass
+
+
+def extractArchive(chunks, destDir, mapPath=None):
+    """Extracts a zip archive as it is downloaded, without storing the
+    archive itself. Only the local file headers of the archive are used, so
+    the archive can be extracted in a single pass. Files which are stored,
+    or compressed with deflate are supported, including those whose sizes
+    are given in a trailing data descriptor (which is how zip archives
+    generated on-the-fly, e.g. by XNAT, are usually written).
+
+    Each file is written to a ``PART_SUFFIX`` file, which is renamed once
+    the file has been extracted, and its checksum verified.
+
+    :arg chunks:  Iterable of ``bytes`` objects containing the archive.
+    :arg destDir: Directory to extract files into.
+    :arg mapPath: Function which accepts the path of a file in the archive,
+                  and returns a path relative to ``destDir``, or ``None``
+                  if the file should be skipped. Defaults to using the
+                  archive path as-is (see :func:`archivePath`).
+    :returns:     A list containing the paths of all extracted files.
+    """
+
+    if mapPath is None:
+        mapPath = lambda n: archivePath(n, None)
+
+    reader    = ChunkReader(chunks)
+    extracted = []
+
+    while True:
+
+        # Stop at the central directory, which
+        # repeats the contents of the local
+        # headers that we have already read
+        sig = reader.read(4)
+        if sig in (b'PK\x01\x02', b'PK\x05\x06', b'PK\x06\x06'):
+            reader.drain()
+            break
+        if sig != b'PK\x03\x04':
+            raise ValueError('Invalid zip archive (unexpected '
+                             'signature {!r})'.format(sig))
+
+        (flags, method, crc, csize, usize, nlen, xlen) = \
+            struct.unpack('<2xHH4xIIIHH', reader.read(26))
+        name  = reader.read(nlen)
+        extra = reader.read(xlen)
+
+        if flags & 0x800: name = name.decode('utf-8')
+        else:             name = name.decode('cp437')
+
+        if flags & 0x1:
+            raise ValueError('Encrypted zip archives are not supported')
+        if method not in (0, 8):
+            raise ValueError('Unsupported zip compression '
+                             'method ({}) for {}'.format(method, name))
+
+        # ZIP64 sizes are in an extra field
+        zip64 = False
+        while len(extra) >= 4:
+            hid, hlen = struct.unpack('<HH', extra[:4])
+            if hid == 0x0001:
+                zip64  = True
+                fields = extra[4:4 + hlen]
+                if usize == 0xFFFFFFFF:
+                    usize,  = struct.unpack('<Q', fields[:8])
+                    fields  = fields[8:]
+                if csize == 0xFFFFFFFF:
+                    csize,  = struct.unpack('<Q', fields[:8])
+            extra = extra[4 + hlen:]
+
+        descriptor = bool(flags & 0x8)
+
+        if descriptor and method == 0:
+            raise ValueError('Stored files with a data descriptor '
+                             'are not supported ({})'.format(name))
+
+        path = mapPath(name)
+
+        if path is not None:
+            path = op.join(destDir, path)
+            part = path + PART_SUFFIX
+            os.makedirs(op.dirname(path), exist_ok=True)
+            outf = open(part, 'wb')
+        else:
+            outf = None
+
+        try:
+            checksum = extractEntry(reader, outf, method, csize, descriptor)
+        finally:
+            if outf is not None:
+                outf.close()
+
+        if descriptor:
+            sig = reader.read(4)
+            if sig != b'PK\x07\x08':
+                reader.unread(sig)
+            if zip64: crc, = struct.unpack('<I8x8x', reader.read(20))
+            else:     crc, = struct.unpack('<I4x4x', reader.read(12))
+
+        if outf is None:
+            continue
+
+        if checksum != crc:
+            raise ValueError('Checksum of {} does not match'.format(name))
+
+        os.replace(part, path)
+        extracted.append(path)
+
+    return extracted
+
+
+def extractEntry(reader, outf, method, csize, descriptor):
+    """Used by :func:`extractArchive`. Reads one file from the archive,
+    decompressing it if necessary.
+
+    :arg reader:     :class:`ChunkReader` positioned at the file data.
+    :arg outf:       File to write the data to, or ``None`` to discard it.
+    :arg method:     Compression method - ``0`` (stored) or ``8`` (deflate).
+    :arg csize:      Compressed size, ignored if ``descriptor`` is ``True``.
+    :arg descriptor: If ``True``, the file size is not known in advance -
+                     the file data is read until the end of the compressed
+                     stream.
+    :returns:        The CRC32 checksum of the uncompressed data.
+    """
+
+    if method == 8: decomp = zlib.decompressobj(-zlib.MAX_WBITS)
+    else:           decomp = None
+
+    checksum  = 0
+    remaining = csize
+
+    while True:
+
+        if descriptor:
+            if decomp.eof:
+                reader.unread(decomp.unused_data)
+                break
+            data = reader.readsome()
+            if len(data) == 0:
+                raise EOFError('Unexpected end of archive')
+
+        else:
+            if remaining == 0:
+                break
+            data = reader.readsome()
+            if len(data) == 0:
+                raise EOFError('Unexpected end of archive')
+            if len(data) > remaining:
+                reader.unread(data[remaining:])
+                data = data[:remaining]
+            remaining -= len(data)
+
+        if decomp is not None:
+            data = decomp.decompress(data)
+
+        checksum = zlib.crc32(data, checksum)
+        if outf is not None:
+            outf.write(data)
+
+    if decomp is not None and not descriptor:
+        data     = decomp.flush()
+        checksum = zlib.crc32(data, checksum)
+        if outf is not None:
+            outf.write(data)
+
+    return checksum
+
+
+def downloadArchive(obj, level, destDir, update=None):
+    """Downloads a XNAT item (e.g. a scan) as a single zip archive, and
+    extracts it into ``destDir`` as it is downloaded. Files are laid out as
+    described in :func:`archivePath`.
+
+    :arg obj:     ``xnat`` object to download.
+    :arg level:   Level of ``obj`` in the XNAT hierarchy - must be one of
+                  the keys in :data:`ARCHIVE_URIS`.
+    :arg destDir: Directory to extract files into.
+    :arg update:  Function which is called periodically during the
+                  download, with arguments ``(nbytes, total, finished)``.
+                  It may raise :exc:`Cancelled` to cancel the download.
+    :returns:     A list containing the paths of all extracted files.
+    """
+
+    session = obj.xnat_session
+    uri     = obj.uri + ARCHIVE_URIS[level]
+    uri     = formatURI(session, uri, format='zip')
+
+    log.debug('Downloading %s archive %s to %s', level, uri, destDir)
+
+    with session.interface.get(uri, stream=True, timeout=TIMEOUT) as response:
+
+        response.raise_for_status()
+
+        total = response.headers.get('Content-Length', None)
+        if total is not None:
+            total = int(total)
+
+        def chunks():
+            nbytes = 0
+            for chunk in response.iter_content(CHUNK_SIZE):
+                nbytes += len(chunk)
+                if update is not None:
+                    update(nbytes, total, False)
+                yield chunk
+            if update is not None:
+                update(nbytes, total, True)
+
+        return extractArchive(chunks(), destDir,
+                              lambda n: archivePath(n, level))
@@ -0,0 +1,623 @@
+#!/usr/bin/env python
+#
+# fetch.py - Retrieving parts of the XNAT hierarchy.
+#
+# Author: Paul McCarthy <pauldmccarthy@gmail.com>
+#
+"""This module contains logic used by the :class:`.XNATBrowserPanel` for
+retrieving parts of the XNAT hierarchy from a XNAT server. Nothing in this
+module interacts with ``wx``, so it may be used from any thread.
+
+.. autosummary::
+   :nosignatures:
+
+   SubtreeExpander
+   BulkListing
+   ProjectSkeleton
+   listProjects
+"""
+
+
+import                    re
+import                    logging
+import                    threading
+import                    collections
+import concurrent.futures as futures
+import xml.etree.ElementTree as et
+
+
+log = logging.getLogger(__name__)
+
+
+class ExpansionCancelled(Exception):
+    """Exception raised by :meth:`SubtreeExpander.expand` when an expansion
+    is cancelled.
+    """
+    pass
+
+
+class SubtreeExpander(object):
+    """The ``SubtreeExpander`` retrieves an entire sub-tree of the XNAT
+    hierarchy, breadth-first. All of the listings at each depth of the
+    sub-tree are requested in parallel, using a pool of up to ``maxWorkers``
+    threads.
+
+    Children are represented by ``(obj, level, name, children)`` tuples,
+    where ``children`` is a list which may be populated with the
+    grand-children once they have been retrieved.
+
+    An expansion may be cancelled at any time (from any thread) via the
+    :meth:`cancel` method.
+    """
+
+
+    def __init__(self,
+                 listChildren,
+                 include=None,
+                 maxWorkers=8,
+                 progress=None):
+        """Create a ``SubtreeExpander``.
+
+        :arg listChildren: Function which retrieves the children of an XNAT
+                           object. Must accept an XNAT object and its level
+                           in the hierarchy, and return a list of
+                           ``(obj, level, name)`` tuples.
+
+        :arg include:      Function which is passed the ``(obj, level,
+                           name)`` tuple for each child, and which returns
+                           ``False`` if the child should be omitted from the
+                           sub-tree. Children which are omitted are not
+                           expanded.
+
+        :arg maxWorkers:   Maximum number of listings to request concurrently.
+
+        :arg progress:     Function which is called after each listing has
+                           been retrieved. It is passed the current depth
+                           (starting from 1), the number of listings that
+                           have been retrieved at that depth, and the total
+                           number of listings at that depth. It may return
+                           ``False`` to cancel the expansion.
+        """
+
+        if include  is None: include  = lambda child: True
+        if progress is None: progress = lambda depth, done, total: True
+
+        self.__listChildren = listChildren
+        self.__include      = include
+        self.__maxWorkers   = maxWorkers
+        self.__progress     = progress
+        self.__cancelled    = threading.Event()
+
+
+    def cancel(self):
+        """Cancel the expansion. Listings which have already been requested
+        are allowed to complete, but no more listings are requested.
+        """
+        self.__cancelled.set()
+
+
+    @property
+    def cancelled(self):
+        """Returns ``True`` if this expansion has been cancelled, ``False``
+        otherwise.
+        """
+        return self.__cancelled.is_set()
+
+
+    def expand(self, obj, level):
+        """Retrieves the sub-tree rooted at ``obj``. This is a generator
+        function which yields once for each depth of the sub-tree.
+
+        Each yielded value is a list of ``(parent, children)`` tuples, where
+        ``parent`` is the ``(obj, level, name, children)`` tuple for an
+        object at the previous depth (or ``None`` for ``obj`` itself), and
+        ``children`` is a list of ``(obj, level, name, children)`` tuples.
+
+        The ``children`` list of each parent tuple is left empty - it is up
+        to the caller to populate it (e.g. ``parent[3][:] = children``), so
+        that the caller can control when, and on which thread, the sub-tree
+        is assembled.
+
+        :raises ExpansionCancelled: If the expansion is cancelled.
+        """
+
+        frontier = [(None, obj, level)]
+        results  = []
+        depth    = 0
+
+        pool = futures.ThreadPoolExecutor(max_workers=self.__maxWorkers)
+
+        try:
+            while len(frontier) > 0:
+
+                depth  += 1
+                batch   = []
+                results = [pool.submit(self.__listChildren, o, l)
+                           for _, o, l in frontier]
+
+                for i, ((parent, _, _), result) in enumerate(zip(frontier,
+                                                                 results)):
+
+                    if self.cancelled:
+                        raise ExpansionCancelled()
+
+                    children = [(o, l, n, [])
+                                for o, l, n in result.result()
+                                if self.__include((o, l, n))]
+
+                    batch.append((parent, children))
+
+                    if self.__progress(depth,
+                                       i + 1,
+                                       len(frontier)) is False:
+                        self.cancel()
+
+                if self.cancelled:
+                    raise ExpansionCancelled()
+
+                log.debug('Expanded depth %i (%i listings)',
+                          depth, len(frontier))
+
+                yield batch
+
+                frontier = [(c, c[0], c[1])
+                            for _, children in batch
+                            for c in children
+                            if c[1] != 'file']
+        finally:
+            for r in results:
+                r.cancel()
+            pool.shutdown(wait=False)
+
+
+class BulkListing(object):
+    """The ``BulkListing`` retrieves the resources and files of every scan in
+    an experiment with a single request to the XNAT server, instead of one
+    request per scan and per resource.
+
+    The :meth:`listChildren` method may be used in place of a per-level
+    listing for scans and scan resources. It returns ``None`` when a bulk
+    listing is not available, in which case the caller should fall back to
+    listing the children one level at a time. Bulk listings are
+    retrieved on demand, and are cached until :meth:`clear` is called.
+    """
+
+
+    FILE_URI_PATTERN = re.compile(r'^(?P<experiment>.*/experiments/[^/]+)'
+                                  r'/scans/(?P<scan>[^/]+)'
+                                  r'/resources/(?P<resource>[^/]+)'
+                                  r'/files/(?P<path>.+)$')
+    """Pattern used to identify the scan and resource of each file in a
+    bulk listing, from the file URI.
+    """
+
+
+    SCAN_URI_PATTERN = re.compile(r'^(?P<experiment>.*/experiments/[^/]+)'
+                                  r'/scans/[^/]+$')
+    """Pattern used to identify the experiment of a scan. Scans which are
+    not directly within an experiment (e.g. scans of an assessor) are not
+    bulk listed.
+    """
+
+
+    def __init__(self):
+        """Create a ``BulkListing``. """
+        self.__lock        = threading.Lock()
+        self.__expLocks    = {}
+        self.__listings    = {}
+        self.__loaded      = set()
+        self.__unsupported = set()
+
+
+    def clear(self):
+        """Clears all cached listings. """
+        with self.__lock:
+            self.__expLocks    = {}
+            self.__listings    = {}
+            self.__loaded      = set()
+            self.__unsupported = set()
+
+
+    def invalidate(self, uri):
+        """Clears cached listings for the experiment containing, or
+        contained within, the given URI.
+        """
+
+        def related(expUri):
+            return any(a == b or a.startswith(b + '/')
+                       for a, b in ((expUri, uri), (uri, expUri)))
+
+        with self.__lock:
+            for expUri in list(self.__expLocks.keys()):
+                if not related(expUri):
+                    continue
+                self.__expLocks   .pop(expUri, None)
+                self.__loaded     .discard(expUri)
+                self.__unsupported.discard(expUri)
+                for key in list(self.__listings.keys()):
+                    if key.startswith(expUri + '/'):
+                        self.__listings.pop(key)
+
+
+    def listChildren(self, obj, level):
+        """Returns the children of the given XNAT object from a bulk listing
+        of its experiment, or ``None`` if a bulk listing is not available.
+
+        :arg obj:   A scan, or scan resource.
+        :arg level: Level of ``obj`` in the XNAT hierarchy.
+        :returns:   A list of ``(child, level, name)`` tuples, or ``None``.
+                    ``None`` is also returned for scans which have no files
+                    in the bulk listing, as they may still have (empty)
+                    resources.
+        """
+
+        if level == 'scan':
+            match = BulkListing.SCAN_URI_PATTERN.match(obj.uri)
+            if match is None:
+                return None
+            if not self.__load(obj.xnat_session, match.group('experiment')):
+                return None
+            return self.__listings.get(obj.uri, None)
+
+        if level == 'resource':
+            return self.__listings.get(obj.uri, None)
+
+        return None
+
+
+    def __load(self, session, expUri):
+        """Retrieves a bulk listing of all scan files in the experiment with
+        the given URI, if it has not already been retrieved. Returns ``True``
+        if a bulk listing is available, ``False`` otherwise.
+        """
+
+        with self.__lock:
+            lock = self.__expLocks.setdefault(expUri, threading.Lock())
+
+        # Only one thread retrieves the listing for
+        # each experiment - other threads block
+        # until the listing has been retrieved
+        with lock:
+
+            if expUri in self.__loaded:      return True
+            if expUri in self.__unsupported: return False
+
+            try:
+                log.debug('Retrieving bulk file listing for %s', expUri)
+                rows     = session.get_json(expUri + '/files')
+                rows     = rows['ResultSet']['Result']
+                listings = self.__parse(session, expUri, rows)
+
+            except Exception as e:
+                log.debug('Bulk file listing not available for %s (%s) - '
+                          'falling back to per-level listing', expUri, e)
+                with self.__lock:
+                    self.__unsupported.add(expUri)
+                return False
+
+            with self.__lock:
+                self.__listings.update(listings)
+                self.__loaded.add(expUri)
+
+            return True
+
+
+    def __parse(self, session, expUri, rows):
+        """Builds listings of scan resources and files from the given rows of
+        a bulk file listing.
+
+        :returns: A dictionary of ``{ uri : [(child, level, name)] }``
+                  mappings, containing listings for each scan and
+                  scan resource.
+        """
+
+        resources = collections.OrderedDict()
+        files     = collections.OrderedDict()
+
+        for row in rows:
+
+            match = BulkListing.FILE_URI_PATTERN.match(row['URI'])
+
+            # Files which are not in a scan
+            # (e.g. session resources)
+            if match is None:
+                continue
+
+            scanUri = '{}/scans/{}'.format(expUri, match.group('scan'))
+            resId   = row.get('cat_ID', match.group('resource'))
+            resUri  = '{}/resources/{}'.format(scanUri, resId)
+            label   = row.get('collection', resId)
+            path    = match.group('path')
+            fileUri = '{}/files/{}'.format(resUri, path)
+
+            if resUri not in resources:
+                resources[resUri] = (scanUri, resId, label, [0])
+                files[    resUri] = []
+
+            size = row.get('Size', '') or '0'
+            resources[resUri][3][0] += int(size)
+
+            fobj = session.create_object(fileUri,
+                                         type_='xnat:fileData',
+                                         id_=path,
+                                         datafields=row)
+            files[resUri].append((fobj, 'file', fobj.id))
+
+        listings = collections.defaultdict(list)
+
+        for resUri, (scanUri, resId, label, size) in resources.items():
+
+            datafields = {'label'                   : label,
+                          'xnat_abstractresource_id': resId,
+                          'file_count'              : len(files[resUri]),
+                          'file_size'               : str(size[0])}
+            robj = session.create_object(resUri,
+                                         type_='xnat:resourceCatalog',
+                                         id_=resId,
+                                         label=label,
+                                         datafields=datafields)
+
+            listings[scanUri]  .append((robj, 'resource', label))
+            listings[robj.uri] = files[resUri]
+
+        return dict(listings)
+
+
+XDAT_NS = 'http://nrg.wustl.edu/security'
+"""XML namespace used in XNAT search documents. """
+
+
+SKELETON_SCAN_TYPES = {
+    'xnat:mrSessionData' : 'xnat:imageScanData',
+}
+"""Experiment types for which the scans are retrieved by a
+:class:`ProjectSkeleton`, and the data type which is searched for their
+scans. ``xnat:imageScanData`` is the base type of all image scans, so that
+scans of every type are retrieved - an MR session may also contain e.g.
+secondary capture (``xnat:scScanData``) scans, which would otherwise be
+missing from the tree.
+"""
+
+
+def searchDocument(rootElement, fields, constraints):
+    """Generates a XNAT search document, which may be posted to the
+    ``/data/search`` endpoint.
+
+    :arg rootElement: Data type to search, e.g. ``'xnat:mrScanData'``.
+    :arg fields:      Sequence of ``(element, field)`` tuples specifying the
+                      columns to retrieve, e.g. ``('xnat:mrScanData',
+                      'TYPE')``.
+    :arg constraints: Sequence of ``(field, comparison, value)`` tuples,
+                      e.g. ``('xnat:mrSessionData/PROJECT', '=', 'P1')``.
+    :returns:         The search document, as a ``bytes`` string.
+    """
+
+    def sub(parent, tag, text=None):
+        elem = et.SubElement(parent, et.QName(XDAT_NS, tag))
+        if text is not None:
+            elem.text = text
+        return elem
+
+    search = et.Element(et.QName(XDAT_NS, 'search'))
+    search.set('allow-diff-columns', '0')
+    search.set('secure',             'false')
+
+    sub(search, 'root_element_name', rootElement)
+
+    for i, (element, field) in enumerate(fields):
+        elem = sub(search, 'search_field')
+        sub(elem, 'element_name', element)
+        sub(elem, 'field_ID',     field)
+        sub(elem, 'sequence',     str(i))
+        sub(elem, 'type',         'string')
+        sub(elem, 'header',       field)
+
+    where = sub(search, 'search_where')
+    where.set('method', 'AND')
+
+    for field, comparison, value in constraints:
+        crit = sub(where, 'criteria')
+        crit.set('override_value_formatting', '0')
+        sub(crit, 'schema_field',    field)
+        sub(crit, 'comparison_type', comparison)
+        sub(crit, 'value',           value)
+
+    return et.tostring(search)
+
+
+class ProjectSkeleton(object):
+    """The ``ProjectSkeleton`` retrieves the subjects, experiments and scans
+    of an entire project with a handful of requests, instead of one request
+    per subject and per experiment. Subjects and experiments are retrieved
+    with one listing each, and the scans of all experiments with one query
+    to the XNAT search service (see :data:`SKELETON_SCAN_TYPES`).
+
+    The :meth:`listCollection` method may be used in place of listing a
+    single collection (e.g. the experiments of a subject). It returns
+    ``None`` when the skeleton cannot provide a listing, in which case the
+    caller should fall back to listing the collection directly.
+    """
+
+
+    def __init__(self):
+        """Create a ``ProjectSkeleton``. """
+        self.__lock     = threading.Lock()
+        self.__listings = {}
+
+
+    def clear(self):
+        """Clears all listings. """
+        with self.__lock:
+            self.__listings = {}
+
+
+    def invalidate(self, uri):
+        """Clears the listings of the item with the given URI, and of all
+        items beneath it.
+        """
+        with self.__lock:
+            for key in list(self.__listings.keys()):
+                if key[0] == uri or key[0].startswith(uri + '/'):
+                    self.__listings.pop(key)
+
+
+    def listCollection(self, obj, level):
+        """Returns the children of the given XNAT object at the given level,
+        or ``None`` if they are not available.
+
+        :arg obj:   A project, subject or experiment.
+        :arg level: Level of the children, e.g. ``'subject'``.
+        :returns:   A list of ``(child, level, name)`` tuples, or ``None``.
+        """
+        with self.__lock:
+            return self.__listings.get((obj.uri, level), None)
+
+
+    def load(self, project):
+        """Retrieves the skeleton of the given project. Any errors which
+        occur while retrieving the subjects and experiments are propagated;
+        errors which occur while retrieving scans are logged, and scans are
+        then listed one experiment at a time.
+
+        :arg project: A ``xnat`` project object.
+        """
+
+        session  = project.xnat_session
+        listings = {}
+        subjects = {}
+        sessions = collections.defaultdict(list)
+
+        rows = self.__get(session,
+                          project.uri + '/subjects',
+                          'ID,label')
+        listings[project.uri, 'subject'] = []
+
+        for row in rows:
+            uri  = '{}/subjects/{}'.format(project.uri, row['ID'])
+            sobj = session.create_object(uri,
+                                         type_='xnat:subjectData',
+                                         id_=row['ID'],
+                                         label=row['label'])
+            subjects[row['ID']]         = sobj
+            listings[uri, 'experiment'] = []
+            listings[project.uri, 'subject'].append(
+                (sobj, 'subject', row['label']))
+
+        rows = self.__get(session,
+                          project.uri + '/experiments',
+                          'ID,label,subject_ID,xsiType')
+
+        for row in rows:
+            sobj = subjects.get(row['subject_ID'], None)
+
+            # Experiments which are shared
+            # into the project from elsewhere
+            if sobj is None:
+                continue
+
+            uri  = '{}/experiments/{}'.format(sobj.uri, row['ID'])
+            eobj = session.create_object(uri,
+                                         type_=row['xsiType'],
+                                         id_=row['ID'],
+                                         label=row['label'])
+            listings[sobj.uri, 'experiment'].append(
+                (eobj, 'experiment', row['label']))
+
+            if row['xsiType'] in SKELETON_SCAN_TYPES:
+                sessions[row['xsiType']].append(eobj)
+
+        for expType, experiments in sessions.items():
+            try:
+                scans = self.__scans(session,
+                                     project,
+                                     expType,
+                                     SKELETON_SCAN_TYPES[expType],
+                                     experiments)
+            except Exception as e:
+                log.debug('Scan search not available for %s (%s) - falling '
+                          'back to per-experiment listing', project.id, e)
+                continue
+
+            listings.update(scans)
+
+        log.debug('Retrieved skeleton of project %s (%i listings)',
+                  project.id, len(listings))
+
+        with self.__lock:
+            self.__listings.update(listings)
+
+
+    def __get(self, session, uri, columns):
+        """Retrieves a listing from the XNAT server, returning the rows. """
+        rows = session.get_json(uri, query={'columns' : columns})
+        return rows['ResultSet']['Result']
+
+
+    def __scans(self, session, project, expType, scanType, experiments):
+        """Retrieves the scans of the given experiments with a query to the
+        XNAT search service.
+
+        :returns: A dictionary of ``{ (uri, 'scan') : [(scan, 'scan', id)] }``
+                  mappings, containing a listing for every experiment.
+        """
+
+        fields   = [(scanType, 'ID'),
+                    (scanType, 'TYPE'),
+                    (scanType, 'IMAGE_SESSION_ID')]
+        document = searchDocument(scanType,
+                                  fields,
+                                  [(expType + '/PROJECT', '=', project.id)])
+        response = session.post('/data/search',
+                                format='json',
+                                data=document)
+        rows     = response.json()['ResultSet']['Result']
+        byId     = {e.id : e for e in experiments}
+        listings = {(e.uri, 'scan') : [] for e in experiments}
+
+        # Columns may or may not be prefixed with
+        # the data type, depending on the XNAT
+        # version, e.g. "xnat_mrscandata_type"
+        prefix = scanType.replace(':', '_').lower() + '_'
+
+        def column(row, field):
+            field = field.lower()
+            for key in row.keys():
+                if key.lower() in (field, prefix + field):
+                    return row[key]
+            raise KeyError(field)
+
+        for row in rows:
+            eobj = byId.get(column(row, 'image_session_id'), None)
+            if eobj is None:
+                continue
+
+            scanId = column(row, 'id')
+            uri    = '{}/scans/{}'.format(eobj.uri, scanId)
+            scan   = session.create_object(uri,
+                                           type_=scanType,
+                                           id_=scanId,
+                                           type=column(row, 'type'))
+            listings[eobj.uri, 'scan'].append((scan, 'scan', scanId))
+
+        return listings
+
+
+def listProjects(session):
+    """Retrieves the IDs and names of all projects that are accessible on
+    the XNAT server, with a single request. Only the ``ID`` and ``name``
+    columns are requested, so the listing is small even for servers with
+    many projects.
+
+    :arg session: A ``xnat`` session.
+    :returns:     A tuple containing a sorted list of project IDs, and a
+                  dictionary of ``{id : name}`` mappings for all projects
+                  which have a name.
+    """
+
+    rows  = session.get_json('/data/projects',
+                             query={'columns' : 'ID,name'})
+    rows  = rows['ResultSet']['Result']
+    ids   = sorted(row['ID'] for row in rows)
+    names = {row['ID'] : row['name'] for row in rows if row.get('name')}
+
+    return ids, names
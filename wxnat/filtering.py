@@ -0,0 +1,250 @@
+#!/usr/bin/env python
+#
+# filtering.py - Filtering of items in the XNAT hierarchy by name.
+#
+# Author: Paul McCarthy <pauldmccarthy@gmail.com>
+#
+"""This module contains the :class:`Filters` class, which is used by the
+:class:`.XNATBrowserPanel` to filter items in the XNAT hierarchy by name.
+
+.. autosummary::
+   :nosignatures:
+
+   InvalidFilter
+   compilePattern
+   serverPattern
+   Filters
+"""
+
+
+import                    re
+import                    fnmatch
+import                    collections
+
+
+class InvalidFilter(ValueError):
+    """Exception raised by :func:`compilePattern` and :class:`Filters` when
+    a filter pattern is invalid.
+    """
+
+    def __init__(self, level, pattern, error):
+        """Create an ``InvalidFilter`` exception.
+
+        :arg level:   XNAT hierarchy level of the filter.
+        :arg pattern: The invalid pattern.
+        :arg error:   The underlying ``re.error``.
+        """
+        ValueError.__init__(self, 'Invalid {} filter {}: {}'.format(
+            level, pattern, error))
+        self.level   = level
+        self.pattern = pattern
+        self.error   = error
+
+
+def compilePattern(pattern, filterType, level=None):
+    """Compiles the given filter pattern into a function which accepts a
+    name, and returns a true value if the name matches the pattern.
+
+    Names are matched case-insensitively. Regular expressions match anywhere
+    in a name. Glob patterns must match the whole name - multiple glob
+    patterns may be separated with the pipe character, and are merged into a
+    single regular expression which matches any of them.
+
+    :arg pattern:    The pattern.
+    :arg filterType: Either ``'regexp'`` or ``'glob'``.
+    :arg level:      XNAT hierarchy level of the filter, used in error
+                     messages.
+    :returns:        A matching function, or ``None`` if the pattern is
+                     empty.
+    :raises:         :exc:`InvalidFilter` if the pattern is invalid.
+    """
+
+    if pattern.strip() == '':
+        return None
+
+    if filterType == 'glob':
+        regex = '|'.join('(?:{})'.format(fnmatch.translate(p))
+                         for p in pattern.split('|'))
+    else:
+        regex = pattern
+
+    try:
+        regex = re.compile(regex, flags=re.IGNORECASE)
+    except re.error as e:
+        raise InvalidFilter(level, pattern, e)
+
+    # fnmatch.translate produces
+    # patterns which are anchored
+    # at the end, but not the start
+    if filterType == 'glob': return regex.match
+    else:                    return regex.search
+
+
+SIMPLE_GLOB = re.compile(r'^[A-Za-z0-9_\-.*]+$')
+"""Glob patterns which match this expression may be evaluated by the XNAT
+server - see :func:`serverPattern`.
+"""
+
+
+SIMPLE_REGEXP = re.compile(r'^(?P<start>\^?)'
+                           r'(?P<literal>[A-Za-z0-9_\-]+)'
+                           r'(?P<end>\$?)$')
+"""Regular expressions which match this expression may be evaluated by the
+XNAT server - see :func:`serverPattern`.
+"""
+
+
+def serverPattern(pattern, filterType):
+    """Translates the given filter pattern into a constraint which can be
+    passed to the XNAT server when requesting a listing. XNAT constraints
+    are literal values which may contain ``*`` wildcards, so only simple
+    patterns can be translated:
+
+     - Glob patterns which only contain alpha-numeric characters, ``_``,
+       ``-``, ``.`` and ``*``.
+     - Regular expressions which only contain alpha-numeric characters,
+       ``_`` and ``-``, optionally anchored with ``^`` and/or ``$``, e.g.
+       ``'^sub-01'`` is translated to ``'sub-01*'``.
+
+    :arg pattern:    The pattern.
+    :arg filterType: Either ``'regexp'`` or ``'glob'``.
+    :returns:        A XNAT constraint, or ``None`` if the pattern is empty,
+                     or cannot be translated.
+    """
+
+    pattern = pattern.strip()
+
+    if pattern == '':
+        return None
+
+    if filterType == 'glob':
+        if SIMPLE_GLOB.match(pattern) is None:
+            return None
+        return pattern
+
+    match = SIMPLE_REGEXP.match(pattern)
+
+    if match is None:
+        return None
+
+    start, literal, end = match.group('start', 'literal', 'end')
+
+    if start == '': literal = '*' + literal
+    if end   == '': literal = literal + '*'
+
+    return literal
+
+
+class Filters(object):
+    """The ``Filters`` class contains a filter pattern for each level of the
+    XNAT hierarchy (e.g. ``'subject'``, ``'file'``). Patterns are compiled
+    once, when they are set, so testing names against them is cheap.
+
+    Patterns are accessed with ``dict``-like syntax::
+
+        filters = Filters('glob', [('subject', ''), ('file', '')])
+        filters['subject'] = 'sub-01*'
+
+        filters.filterItem('subject', 'sub-02')  # True
+        filters.apply(children)                 # unfiltered children
+    """
+
+
+    def __init__(self, filterType, patterns=None):
+        """Create a ``Filters`` object.
+
+        :arg filterType: How the filter patterns should be applied - either
+                         ``'regexp'`` or ``'glob'``.
+        :arg patterns:   Sequence of ``(level, pattern)`` tuples containing
+                         initial filter patterns.
+        :raises:         :exc:`InvalidFilter` if any of the initial patterns
+                         are invalid.
+        """
+
+        if patterns is None:
+            patterns = []
+
+        self.__filterType = filterType
+        self.__patterns   = collections.OrderedDict()
+        self.__matchers   = {}
+        self.__server     = {}
+
+        for level, pattern in patterns:
+            self[level] = pattern
+
+
+    @property
+    def filterType(self):
+        """Returns the filter type, either ``'regexp'`` or ``'glob'``. """
+        return self.__filterType
+
+
+    def keys(self):
+        """Returns a list containing all levels which have a filter. """
+        return list(self.__patterns.keys())
+
+
+    def __getitem__(self, level):
+        """Returns the filter pattern for the given level, or an empty string
+        if there is no pattern.
+        """
+        return self.__patterns.get(level, '')
+
+
+    def __setitem__(self, level, pattern):
+        """Sets the filter pattern for the given level. If the pattern is
+        invalid, the existing pattern is left unchanged.
+
+        :raises: :exc:`InvalidFilter` if the pattern is invalid.
+        """
+        matcher = compilePattern(pattern, self.__filterType, level)
+        self.__patterns[level] = pattern
+        self.__matchers[level] = matcher
+        self.__server[  level] = serverPattern(pattern, self.__filterType)
+
+
+    def serverPattern(self, level):
+        """Returns the filter pattern for the given level, translated into
+        a constraint which can be evaluated by the XNAT server (see
+        :func:`serverPattern`), or ``None`` if there is no pattern, or it
+        cannot be translated.
+        """
+        return self.__server.get(level, None)
+
+
+    def active(self, level):
+        """Returns ``True`` if a non-empty pattern has been set for the given
+        level, ``False`` otherwise.
+        """
+        return self.__matchers.get(level, None) is not None
+
+
+    def filterItem(self, level, name):
+        """Returns ``True`` if the given ``name`` should be filtered, i.e.
+        the level has a filter pattern, and the name does not match it.
+        """
+        matcher = self.__matchers.get(level, None)
+        return matcher is not None and matcher(name) is None
+
+
+    def apply(self, children):
+        """Filters a batch of children, e.g. as returned by
+        :meth:`.XNATBrowserPanel.__listChildren`.
+
+        :arg children: Sequence of tuples, where the second and third elements
+                       of each tuple are the child level and name, e.g.
+                       ``(obj, level, name)``.
+        :returns:      A list containing the children which should not be
+                       filtered, in their original order.
+        """
+
+        levels = set(c[1] for c in children)
+
+        # Fast path - none of
+        # the levels are filtered
+        if not any(self.active(l) for l in levels):
+            return list(children)
+
+        matchers = {l : self.__matchers.get(l, None) for l in levels}
+        return [c for c in children
+                if matchers[c[1]] is None or matchers[c[1]](c[2]) is not None]
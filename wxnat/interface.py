@@ -0,0 +1,187 @@
+#!/usr/bin/env python
+#
+# interface.py - Per-thread HTTP connections for xnat sessions.
+#
+# Author: Paul McCarthy <pauldmccarthy@gmail.com>
+#
+"""This module contains the :class:`ThreadLocalInterface` class, which is
+used by the :class:`.XNATBrowserPanel` so that ``xnat`` sessions may be
+safely used from many threads at once. Nothing in this module interacts
+with ``wx``, so it may be used from any thread.
+
+All requests made by an ``xnat`` session go through a single
+``requests.Session`` object - its ``interface``. A ``requests.Session`` is
+not designed to be used by many threads at once, so the
+:class:`ThreadLocalInterface` replaces the interface with one which gives
+each thread its own ``requests.Session``, and its own pool of HTTP
+connections. All threads share the authentication cookies (e.g. the XNAT
+``JSESSIONID``) of the original interface, and the ``xnat`` session itself,
+along with its cache of XNAT objects, is shared as usual.
+
+.. autosummary::
+   :nosignatures:
+
+   ThreadLocalInterface
+   install
+"""
+
+
+import logging
+import weakref
+import threading
+
+import requests
+import requests.adapters   as adapters
+import requests.structures as structures
+
+
+log = logging.getLogger(__name__)
+
+
+DEFAULT_POOL_SIZE = 4
+"""Default maximum number of HTTP connections, per host, that each thread
+may keep open.
+"""
+
+
+SHARED_ATTRIBUTES = ['auth',
+                     'verify',
+                     'cert',
+                     'proxies',
+                     'trust_env',
+                     'max_redirects']
+"""Attributes of the original ``requests.Session`` which are copied to each
+per-thread session.
+"""
+
+
+class ThreadLocalInterface(object):
+    """The ``ThreadLocalInterface`` is a stand-in for a ``requests.Session``.
+    All attribute accesses are passed through to a ``requests.Session``
+    which is created for, and only used by, the calling thread.
+
+    Each per-thread session is given a copy of the headers, credentials and
+    other settings of the original session, and shares its cookie jar
+    (which is thread-safe), so that authentication cookies set on one
+    thread are used by all threads.
+    """
+
+
+    def __init__(self, base, poolSize=None, keepAlive=True):
+        """Create a ``ThreadLocalInterface``.
+
+        :arg base:      The original ``requests.Session``.
+        :arg poolSize:  Maximum number of connections, per host, that each
+                        thread may keep open. Defaults to
+                        :data:`DEFAULT_POOL_SIZE`.
+        :arg keepAlive: If ``False``, connections are closed after every
+                        request, instead of being kept open for re-use.
+        """
+
+        if poolSize is None:
+            poolSize = DEFAULT_POOL_SIZE
+
+        self.__base      = base
+        self.__poolSize  = poolSize
+        self.__keepAlive = keepAlive
+        self.__local     = threading.local()
+        self.__lock      = threading.Lock()
+        self.__sessions  = weakref.WeakSet()
+
+
+    @property
+    def base(self):
+        """Returns the original ``requests.Session``. """
+        return self.__base
+
+
+    @property
+    def cookies(self):
+        """Returns the cookie jar which is shared by all threads. """
+        return self.__base.cookies
+
+
+    def session(self):
+        """Returns the ``requests.Session`` for the calling thread, creating
+        it if necessary.
+        """
+
+        sess = getattr(self.__local, 'session', None)
+
+        if sess is None:
+            sess                 = self.__create()
+            self.__local.session = sess
+            with self.__lock:
+                self.__sessions.add(sess)
+
+        return sess
+
+
+    def close(self):
+        """Closes the sessions of all threads, and the original session. """
+
+        with self.__lock:
+            sessions = list(self.__sessions)
+            self.__sessions.clear()
+
+        for sess in sessions + [self.__base]:
+            try:
+                sess.close()
+            except Exception as e:
+                log.debug('Error closing HTTP session: %s', e)
+
+
+    def __getattr__(self, name):
+        """Returns the given attribute of the ``requests.Session`` for the
+        calling thread.
+        """
+        return getattr(self.session(), name)
+
+
+    def __create(self):
+        """Creates a ``requests.Session`` for the calling thread. """
+
+        base = self.__base
+        sess = requests.Session()
+
+        for att in SHARED_ATTRIBUTES:
+            setattr(sess, att, getattr(base, att))
+
+        sess.headers = structures.CaseInsensitiveDict(base.headers)
+        sess.cookies = base.cookies
+
+        if not self.__keepAlive:
+            sess.headers['Connection'] = 'close'
+
+        adapter = adapters.HTTPAdapter(pool_connections=self.__poolSize,
+                                       pool_maxsize=self.__poolSize)
+        sess.mount('https://', adapter)
+        sess.mount('http://',  adapter)
+
+        log.debug('Created HTTP session for thread %s',
+                  threading.current_thread().name)
+
+        return sess
+
+
+def install(session, poolSize=None, keepAlive=True):
+    """Replaces the interface of the given ``xnat`` session with a
+    :class:`ThreadLocalInterface`. Does nothing if one has already been
+    installed, or if the session does not have a replaceable interface
+    (older versions of ``xnatpy``).
+
+    :arg session:   A ``xnat`` session.
+    :arg poolSize:  Passed to :class:`ThreadLocalInterface`.
+    :arg keepAlive: Passed to :class:`ThreadLocalInterface`.
+    """
+
+    base = getattr(session, '_interface', None)
+
+    if base is None:
+        log.debug('Cannot install per-thread HTTP sessions on %s', session)
+        return
+
+    if isinstance(base, ThreadLocalInterface):
+        return
+
+    session._interface = ThreadLocalInterface(base, poolSize, keepAlive)
@@ -0,0 +1,311 @@
+#!/usr/bin/env python
+#
+# projects.py - A searchable drop down list of XNAT projects.
+#
+# Author: Paul McCarthy <pauldmccarthy@gmail.com>
+#
+"""This module contains the :class:`ProjectPicker` class, a searchable drop
+down list which is used by the :class:`.XNATBrowserPanel` to select a XNAT
+project.
+
+.. autosummary::
+   :nosignatures:
+
+   ProjectPicker
+   filterProjects
+"""
+
+
+import wx
+
+
+def filterProjects(ids, names, text):
+    """Returns the indices of all projects which match the given text.
+
+    :arg ids:   List of project IDs.
+    :arg names: Dictionary of ``{id : name}`` mappings for all projects
+                with a known name.
+    :arg text:  Text to match against project IDs and names. Matching is
+                case-insensitive, and finds ``text`` anywhere in the ID
+                or name.
+    """
+
+    text = text.strip().lower()
+
+    if text == '':
+        return list(range(len(ids)))
+
+    return [i for i, id_ in enumerate(ids)
+            if text in id_.lower() or text in names.get(id_, '').lower()]
+
+
+class ProjectPicker(wx.ComboCtrl):
+    """The ``ProjectPicker`` is a drop down list of XNAT projects. Text
+    entered into the picker filters the list to matching projects, by ID
+    or name, and pressing enter selects the first match. The list is
+    virtual, so only visible projects are drawn.
+
+    The ``ProjectPicker`` has the same interface as a ``wx.Choice``, for
+    the methods used by the :class:`.XNATBrowserPanel`, and emits a
+    ``wx.EVT_CHOICE`` event when a project is selected by the user.
+    """
+
+
+    def __init__(self, parent):
+        """Create a ``ProjectPicker``.
+
+        :arg parent: ``wx`` parent object.
+        """
+
+        wx.ComboCtrl.__init__(self, parent, style=wx.TE_PROCESS_ENTER)
+
+        self.__ids       = []
+        self.__names     = {}
+        self.__selection = wx.NOT_FOUND
+        self.__popup     = ProjectPopup(self)
+
+        self.SetPopupControl(self.__popup)
+        self.Bind(wx.EVT_TEXT,       self.__onText)
+        self.Bind(wx.EVT_TEXT_ENTER, self.__onEnter)
+
+
+    def SetItems(self, ids):
+        """Sets the list of project IDs. """
+        self.__ids       = list(ids)
+        self.__selection = wx.NOT_FOUND
+        self.SetText('')
+
+
+    def Clear(self):
+        """Clears the list of projects. """
+        self.__names = {}
+        self.SetItems([])
+
+
+    def SetNames(self, names):
+        """Sets the names of some projects.
+
+        :arg names: Dictionary of ``{id : name}`` mappings.
+        """
+        self.__names.update(names)
+        self.__popup.Refresh()
+
+
+    def GetName(self, idx):
+        """Returns the name of the project at the given index, or ``None``
+        if it is not known.
+        """
+        return self.__names.get(self.__ids[idx], None)
+
+
+    def GetCount(self):
+        """Returns the number of projects. """
+        return len(self.__ids)
+
+
+    def GetString(self, idx):
+        """Returns the ID of the project at the given index. """
+        return self.__ids[idx]
+
+
+    def GetLabel(self, idx):
+        """Returns the label to display for the project at the given index.
+        """
+        id_  = self.__ids[idx]
+        name = self.__names.get(id_, None)
+
+        if name is None or name == id_: return id_
+        else:                           return '{} - {}'.format(id_, name)
+
+
+    def GetSelection(self):
+        """Returns the index of the selected project, or ``wx.NOT_FOUND``.
+        """
+        return self.__selection
+
+
+    def SetSelection(self, idx):
+        """Selects the project at the given index. """
+        if idx < 0 or idx >= len(self.__ids):
+            return
+        self.__selection = idx
+        self.SetText(self.__ids[idx])
+
+
+    def Filter(self, text):
+        """Returns the indices of all projects matching the given text - see
+        :func:`filterProjects`. If ``text`` is the ID of the selected
+        project, all projects are returned.
+        """
+        if self.__selection != wx.NOT_FOUND and \
+           text == self.__ids[self.__selection]:
+            text = ''
+        return filterProjects(self.__ids, self.__names, text)
+
+
+    def Choose(self, idx):
+        """Selects the project at the given index, and emits a
+        ``wx.EVT_CHOICE`` event.
+        """
+
+        self.SetSelection(idx)
+
+        ev = wx.CommandEvent(wx.EVT_CHOICE.typeId, self.GetId())
+        ev.SetEventObject(self)
+        ev.SetInt(idx)
+        ev.SetString(self.__ids[idx])
+        wx.PostEvent(self.GetEventHandler(), ev)
+
+
+    def __onText(self, ev):
+        """Called when the text is changed. If the list is open, it is
+        narrowed down to the projects which match the text.
+        """
+        ev.Skip()
+        if self.IsPopupShown():
+            self.__popup.SetStringValue(self.GetValue())
+
+
+    def __onEnter(self, ev):
+        """Called when enter is pressed in the text field. Selects the first
+        project which matches the text.
+        """
+
+        matches = self.Filter(self.GetValue())
+
+        if self.IsPopupShown():
+            self.Dismiss()
+
+        if len(matches) > 0:
+            self.Choose(matches[0])
+
+
+class ProjectPopup(wx.ComboPopup):
+    """The ``ProjectPopup`` is used by the :class:`ProjectPicker`. It
+    displays the projects which match the picker text in a ``wx.VListBox``.
+    """
+
+
+    def __init__(self, picker):
+        """Create a ``ProjectPopup``.
+
+        :arg picker: The :class:`ProjectPicker`.
+        """
+        wx.ComboPopup.__init__(self)
+        self.__picker  = picker
+        self.__list    = None
+        self.__matches = []
+
+
+    def Create(self, parent):
+        """Creates the list box. """
+        self.__list = ProjectListBox(parent, self)
+        self.__list.Bind(wx.EVT_LEFT_UP, self.__onClick)
+        return True
+
+
+    def GetControl(self):
+        """Returns the list box. """
+        return self.__list
+
+
+    def Refresh(self):
+        """Redraws the list, if it has been created. """
+        if self.__list is not None:
+            self.__list.Refresh()
+
+
+    def SetStringValue(self, value):
+        """Called when the popup is shown, and when the picker text is
+        changed while it is shown. Filters the list of projects according
+        to the picker text.
+        """
+
+        picker         = self.__picker
+        self.__matches = picker.Filter(value)
+
+        self.__list.SetItemCount(len(self.__matches))
+
+        selection = picker.GetSelection()
+        if selection in self.__matches:
+            row = self.__matches.index(selection)
+            self.__list.SetSelection(row)
+            self.__list.ScrollToRow(row)
+        else:
+            self.__list.SetSelection(wx.NOT_FOUND)
+
+        self.__list.Refresh()
+
+
+    def GetStringValue(self):
+        """Returns the ID of the selected project. """
+        selection = self.__picker.GetSelection()
+        if selection == wx.NOT_FOUND: return self.__picker.GetValue()
+        else:                         return self.__picker.GetString(selection)
+
+
+    def GetAdjustedSize(self, minWidth, prefHeight, maxHeight):
+        """Returns the size of the popup. """
+        rows   = min(max(len(self.__matches), 1), 15)
+        height = rows * self.__list.OnMeasureItem(0) + 4
+        return wx.Size(minWidth, min(height, maxHeight))
+
+
+    def GetProject(self, row):
+        """Returns the index of the project displayed in the given row of
+        the list.
+        """
+        return self.__matches[row]
+
+
+    def GetProjects(self):
+        """Returns the indices of all projects displayed in the list. """
+        return list(self.__matches)
+
+
+    def __onClick(self, ev):
+        """Called when the list is clicked. Selects the clicked project. """
+
+        row = self.__list.GetSelection()
+
+        self.Dismiss()
+
+        if row != wx.NOT_FOUND:
+            self.__picker.Choose(self.__matches[row])
+
+
+class ProjectListBox(wx.VListBox):
+    """The ``ProjectListBox`` is used by the :class:`ProjectPopup` to display
+    projects. Only the rows which are visible are drawn.
+    """
+
+
+    def __init__(self, parent, popup):
+        """Create a ``ProjectListBox``.
+
+        :arg parent: ``wx`` parent object.
+        :arg popup:  The :class:`ProjectPopup`.
+        """
+        wx.VListBox.__init__(self, parent, style=wx.BORDER_NONE)
+        self.__popup = popup
+
+
+    def OnMeasureItem(self, row):
+        """Returns the height of each row. """
+        return self.GetCharHeight() + 6
+
+
+    def OnDrawItem(self, dc, rect, row):
+        """Draws the given row. """
+
+        picker = self.__popup.GetComboCtrl()
+        idx    = self.__popup.GetProject(row)
+
+        if self.IsSelected(row):
+            colour = wx.SystemSettings.GetColour(wx.SYS_COLOUR_HIGHLIGHTTEXT)
+        else:
+            colour = self.GetForegroundColour()
+
+        dc.SetFont(self.GetFont())
+        dc.SetTextForeground(colour)
+        dc.DrawText(picker.GetLabel(idx), rect.x + 3, rect.y + 3)
@@ -0,0 +1,203 @@
+#!/usr/bin/env python
+#
+# search.py - Searching the XNAT hierarchy by name.
+#
+# Author: Paul McCarthy <pauldmccarthy@gmail.com>
+#
+"""This module contains the :class:`SearchIndex` class, which is used by the
+:class:`.XNATBrowserPanel` to search all of the items that have been
+retrieved from a XNAT server by name or id. Nothing in this module interacts
+with ``wx``, so it may be used from any thread.
+
+.. autosummary::
+   :nosignatures:
+
+   SearchIndex
+"""
+
+
+import threading
+import collections
+
+
+NGRAM = 3
+"""Length of the n-grams stored in a :class:`SearchIndex`. Queries which
+are shorter than this are evaluated by scanning every item in the index.
+"""
+
+
+Entry = collections.namedtuple('Entry', ('parent', 'level', 'name', 'id'))
+"""Each item in a :class:`SearchIndex` is represented by an ``Entry``,
+containing the URI of its parent, its level in the XNAT hierarchy, its name,
+and its XNAT id.
+"""
+
+
+def ngrams(text):
+    """Returns a set containing all of the :data:`NGRAM`-length substrings of
+    ``text``.
+    """
+    return set(text[i:i + NGRAM] for i in range(len(text) - NGRAM + 1))
+
+
+class SearchIndex(object):
+    """The ``SearchIndex`` is an n-gram inverted index over the names and ids
+    of items in the XNAT hierarchy. Items are identified by their URI, and
+    are added to the index one listing at a time, via the :meth:`add`
+    method. Matching is case-insensitive, and finds the query anywhere in an
+    item name or id.
+
+    A ``SearchIndex`` may be used from multiple threads.
+    """
+
+
+    def __init__(self):
+        """Create a ``SearchIndex``. """
+        self.__lock     = threading.Lock()
+        self.__entries  = {}
+        self.__children = {}
+        self.__grams    = collections.defaultdict(set)
+
+
+    def __len__(self):
+        """Returns the number of items in the index. """
+        return len(self.__entries)
+
+
+    def __contains__(self, uri):
+        """Returns ``True`` if an item with the given URI is in the index. """
+        return uri in self.__entries
+
+
+    def get(self, uri):
+        """Returns the :data:`Entry` for the given URI, or ``None``. """
+        return self.__entries.get(uri, None)
+
+
+    def clear(self):
+        """Removes all items from the index. """
+        with self.__lock:
+            self.__entries  = {}
+            self.__children = {}
+            self.__grams    = collections.defaultdict(set)
+
+
+    def add(self, parent, children):
+        """Adds a listing to the index. Any items from a previous listing of
+        the same parent which are not in this listing are removed.
+
+        :arg parent:   URI of the parent item, or ``None`` for the root of
+                       the hierarchy.
+        :arg children: Sequence of ``(uri, level, name, id)`` tuples, one
+                       for each child.
+        """
+
+        with self.__lock:
+
+            old = self.__children.pop(parent, [])
+            new = [c[0] for c in children]
+
+            for uri in set(old).difference(new):
+                self.__remove(uri)
+
+            for uri, level, name, id_ in children:
+
+                name = str(name)
+                id_  = str(id_)
+
+                if uri in self.__entries:
+                    self.__remove(uri)
+
+                self.__entries[uri] = Entry(parent, level, name, id_)
+
+                for gram in self.__keys(name, id_):
+                    self.__grams[gram].add(uri)
+
+            self.__children[parent] = new
+
+
+    def path(self, uri):
+        """Returns a list containing the URIs of all items from the root of
+        the hierarchy to the given item (inclusive), or ``None`` if any of
+        its ancestors are not in the index.
+        """
+
+        path = []
+
+        while uri is not None:
+            entry = self.__entries.get(uri, None)
+            if entry is None:
+                return None
+            path.insert(0, uri)
+            uri = entry.parent
+
+        return path
+
+
+    def search(self, text, limit=None):
+        """Searches the index.
+
+        :arg text:  Text to search for.
+        :arg limit: Maximum number of results to return.
+        :returns:   A list of URIs of matching items. Items whose name or id
+                    matches exactly are returned first, then those that
+                    start with ``text``, and then all others.
+        """
+
+        text = text.strip().lower()
+
+        if text == '':
+            return []
+
+        with self.__lock:
+
+            # Use the n-gram index to find
+            # candidates for longer queries
+            if len(text) >= NGRAM:
+                postings   = [self.__grams.get(g, set())
+                              for g in ngrams(text)]
+                candidates = set.intersection(*postings)
+            else:
+                candidates = self.__entries.keys()
+
+            results = []
+
+            for uri in candidates:
+                entry = self.__entries[uri]
+                keys  = [k.lower() for k in (entry.name, entry.id)]
+
+                if   any(k == text          for k in keys): rank = 0
+                elif any(k.startswith(text) for k in keys): rank = 1
+                elif any(text in k          for k in keys): rank = 2
+                else:                                       continue
+
+                results.append((rank, len(entry.name), entry.name, uri))
+
+        results = [r[-1] for r in sorted(results)]
+
+        if limit is not None:
+            results = results[:limit]
+
+        return results
+
+
+    def __keys(self, name, id_):
+        """Returns the n-grams which are used to index an item with the given
+        name and id.
+        """
+        return ngrams(name.lower()) | ngrams(id_.lower())
+
+
+    def __remove(self, uri):
+        """Removes an item from the index. Must be called with the lock
+        held.
+        """
+
+        entry = self.__entries.pop(uri)
+
+        for gram in self.__keys(entry.name, entry.id):
+            postings = self.__grams.get(gram, None)
+            if postings is not None:
+                postings.discard(uri)
+                if len(postings) == 0:
+                    self.__grams.pop(gram)
@@ -0,0 +1,231 @@
+#!/usr/bin/env python
+#
+# sessions.py - Sharing XNAT sessions between browser panels.
+#
+# Author: Paul McCarthy <pauldmccarthy@gmail.com>
+#
+"""This module contains the :class:`SessionRegistry` class, which is used by
+the :class:`.XNATBrowserPanel` to share connections to XNAT servers. When
+more than one ``XNATBrowserPanel`` connects to the same host with the same
+user, they share one ``xnat`` session, and therefore share its HTTP
+connection pool and its :class:`.ListingCache`. The ``ListingCache`` belongs
+to the session, rather than to the panel which created it, and is closed
+when the session is disconnected. Nothing in this module interacts with
+``wx``, so it may be used from any thread.
+
+.. autosummary::
+   :nosignatures:
+
+   SessionRegistry
+   SharedSession
+   acquire
+   release
+"""
+
+
+import hashlib
+import logging
+import threading
+
+import wxnat.connection as connection
+
+
+log = logging.getLogger(__name__)
+
+
+def sessionKey(host, username):
+    """Returns a key which identifies sessions for the given ``host`` (as
+    entered by the user), and ``username``.
+    """
+    return host.strip().rstrip('/').lower(), username
+
+
+def passwordDigest(password):
+    """Returns a digest of the given password, used to check that a shared
+    session is only re-used with the password that it was created with.
+    """
+    if password is None:
+        password = ''
+    return hashlib.sha256(password.encode('utf-8')).hexdigest()
+
+
+class SharedSession(object):
+    """A ``SharedSession`` represents a ``xnat`` session which is managed by
+    a :class:`SessionRegistry`, and which may be in use by more than one
+    :class:`.XNATBrowserPanel`. It has the following attributes:
+
+    ================ ===================================================
+    ``host``         The URL of the host that the session is connected to.
+    ``session``      The ``xnat`` session.
+    ``listingCache`` The :class:`.ListingCache` installed on the session,
+                     or ``None``. This is set by the first user of the
+                     session, and is closed by :meth:`close`.
+    ``refs``         The number of users of the session.
+    ``keepToken``    If ``True``, the session is not ended on the XNAT
+                     server when it is disconnected (see
+                     :func:`.connection.disconnect`).
+    ================ ===================================================
+    """
+
+
+    def __init__(self, key, digest, host, session, shared):
+        """Create a ``SharedSession``. """
+        self.key          = key
+        self.digest       = digest
+        self.host         = host
+        self.session      = session
+        self.shared       = shared
+        self.listingCache = None
+        self.refs         = 1
+        self.keepToken    = False
+
+
+    def close(self):
+        """Called by :meth:`SessionRegistry.release` when the session has
+        been disconnected. Shuts down the executor used by the
+        ``listingCache`` to re-validate responses, and closes its disk cache.
+        """
+
+        lcache            = self.listingCache
+        self.listingCache = None
+
+        if lcache is None:
+            return
+
+        if lcache.executor is not None:
+            lcache.executor.shutdown(wait=False)
+        if lcache.disk is not None:
+            lcache.disk.close()
+
+
+class SessionRegistry(object):
+    """The ``SessionRegistry`` keeps track of all shared ``xnat`` sessions,
+    keyed by host and username, and counts the users of each session.
+    Sessions are obtained with :meth:`acquire`, and must be returned with
+    :meth:`release` - a session is disconnected when its last user releases
+    it.
+
+    A ``SessionRegistry`` may be used from multiple threads.
+    """
+
+
+    def __init__(self):
+        """Create a ``SessionRegistry``. """
+        self.__lock     = threading.Lock()
+        self.__sessions = {}
+
+
+    def __len__(self):
+        """Returns the number of shared sessions. """
+        return len(self.__sessions)
+
+
+    def acquire(self, host, username, password, connect, share=True):
+        """Returns a :class:`SharedSession` for the given host and user.
+
+        If a session for the host and user already exists, and was created
+        with the same password, it is returned. Otherwise ``connect`` is
+        called to create a new session. Two users which connect at the same
+        time will both call ``connect`` - the first connection to be
+        established is shared, and the other is disconnected.
+
+        :arg host:     Host, as entered by the user.
+        :arg username: Username
+        :arg password: Password
+        :arg connect:  Function which connects to the host, returning a
+                       tuple containing the host URL and ``xnat`` session,
+                       or ``None`` if the connection was cancelled (see
+                       :func:`.connection.connect`).
+        :arg share:    If ``False``, a new session is always created, and is
+                       not shared with any other users.
+        :returns:      A :class:`SharedSession`, or ``None`` if ``connect``
+                       returned ``None``.
+        """
+
+        key    = sessionKey(host, username)
+        digest = passwordDigest(password)
+
+        if share:
+            with self.__lock:
+                entry = self.__sessions.get(key, None)
+                if entry is not None and entry.digest == digest:
+                    entry.refs += 1
+                    log.debug('Re-using session for %s (%i users)',
+                              entry.host, entry.refs)
+                    return entry
+
+        result = connect()
+
+        if result is None:
+            return None
+
+        url, session = result
+        unused       = None
+
+        with self.__lock:
+            entry = self.__sessions.get(key, None)
+
+            # Another user connected while we were
+            # connecting - use their connection
+            if share and entry is not None and entry.digest == digest:
+                entry.refs += 1
+                unused      = session
+
+            # A session with a different password
+            # is not shared, and does not displace
+            # the existing one
+            else:
+                share = share and entry is None
+                entry = SharedSession(key, digest, url, session, share)
+                if share:
+                    self.__sessions[key] = entry
+
+        if unused is not None:
+            connection.disconnect(unused)
+
+        return entry
+
+
+    def release(self, entry):
+        """Releases a :class:`SharedSession` which was obtained from
+        :meth:`acquire`. If there are no other users of the session, it is
+        disconnected, and its listing cache is closed.
+
+        :returns: ``True`` if the session was disconnected, ``False``
+                  otherwise.
+        """
+
+        with self.__lock:
+            entry.refs -= 1
+            last        = entry.refs <= 0
+
+            if last and self.__sessions.get(entry.key, None) is entry:
+                self.__sessions.pop(entry.key)
+
+        if last:
+            log.debug('Disconnecting from %s', entry.host)
+            connection.disconnect(entry.session, entry.keepToken)
+            entry.close()
+        else:
+            log.debug('Session for %s still in use (%i users)',
+                      entry.host, entry.refs)
+
+        return last
+
+
+registry = SessionRegistry()
+"""The process-wide :class:`SessionRegistry`. """
+
+
+def acquire(host, username, password, connect, share=True):
+    """Calls :meth:`SessionRegistry.acquire` on the process-wide
+    :data:`registry`.
+    """
+    return registry.acquire(host, username, password, connect, share)
+
+
+def release(entry):
+    """Calls :meth:`SessionRegistry.release` on the process-wide
+    :data:`registry`.
+    """
+    return registry.release(entry)
@@ -0,0 +1,357 @@
+#!/usr/bin/env python
+#
+# store.py - Columnar storage of the XNAT hierarchy.
+#
+# Author: Paul McCarthy <pauldmccarthy@gmail.com>
+#
+"""This module contains the :class:`HierarchyStore` class, which is used by
+the :class:`.XNATBrowserPanel` to store a compact copy of all of the items
+that have been retrieved from a XNAT server, so that aggregate queries (e.g.
+the total size of all files within a subject) can be answered without
+walking the tree browser. Nothing in this module interacts with ``wx``, so
+it may be used from any thread.
+
+If `numpy <https://numpy.org>`_ is available, queries are vectorised.
+Otherwise they are evaluated in pure Python.
+
+.. autosummary::
+   :nosignatures:
+
+   HierarchyStore
+   cachedFields
+   knownFields
+"""
+
+
+import math
+import array
+import threading
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+LEVELS = ['project',
+          'subject',
+          'experiment',
+          'assessor',
+          'scan',
+          'resource',
+          'file']
+"""Levels of the XNAT hierarchy. Levels are stored in a
+:class:`HierarchyStore` as indices into this list.
+"""
+
+
+def cachedFields(obj):
+    """Returns a dictionary containing the fields of the given ``xnat``
+    object which are already known, without making a request to the XNAT
+    server. Accessing a field directly (e.g. ``obj.size``) may result in a
+    request, so this function should be used when a missing field can be
+    tolerated.
+
+    The fields are read from private ``xnatpy`` attributes - those given in
+    the listing that the object came from are stored in ``obj._cache['data']``,
+    and locally modified fields in ``obj._overwrites``. If these attributes
+    are missing, or do not have the expected form (e.g. with a different
+    version of ``xnatpy``), an empty dictionary is returned, and callers
+    should behave as if no fields are known.
+    """
+
+    fields = {}
+
+    for getter in (lambda : obj._cache['data'],
+                   lambda : obj._overwrites):
+        try:
+            fields.update(getter() or {})
+        except (AttributeError, LookupError, TypeError, ValueError):
+            pass
+
+    return fields
+
+
+def knownFields(obj):
+    """Returns the size and type of the given ``xnat`` object, if they are
+    known without making a request to the XNAT server (e.g. if they were
+    included in the listing that the object came from).
+
+    :returns: A tuple containing the size in bytes (or ``None``), and the
+              type (or ``None``).
+    """
+
+    fields = cachedFields(obj)
+    size  = fields.get('Size', fields.get('file_size', None))
+    type_ = fields.get('type', None)
+
+    try:
+        size = float(size)
+    except (TypeError, ValueError):
+        size = None
+
+    return size, type_
+
+
+class HierarchyStore(object):
+    """The ``HierarchyStore`` stores items from the XNAT hierarchy in a set
+    of columns - the parent, level, id, label, size and type of every item
+    are each stored in a separate array, with one row per item. Items are
+    identified by their URI, and are added one listing at a time, via the
+    :meth:`add` method.
+
+    Aggregate queries are available via the :meth:`mask`, :meth:`count` and
+    :meth:`totalSize` methods, e.g.::
+
+        # Number of T1 scans in a subject
+        store.count('scan', under=subject.uri, type='T1w')
+
+        # Total size of all files in an experiment
+        store.totalSize(under=experiment.uri)
+
+    Only items which have been added to the store are taken into account.
+    A ``HierarchyStore`` may be used from multiple threads.
+    """
+
+
+    def __init__(self):
+        """Create a ``HierarchyStore``. """
+        self.__lock = threading.Lock()
+        self.clear()
+
+
+    def clear(self):
+        """Removes all items from the store. """
+        with self.__lock:
+            self.__rows     = {}
+            self.__children = {}
+            self.__uris     = []
+            self.__parent   = array.array('q')
+            self.__level    = array.array('b')
+            self.__size     = array.array('d')
+            self.__live     = array.array('b')
+            self.__ids      = []
+            self.__labels   = []
+            self.__types    = []
+
+
+    def __len__(self):
+        """Returns the number of items in the store. """
+        return sum(self.__live)
+
+
+    def __contains__(self, uri):
+        """Returns ``True`` if an item with the given URI is in the store. """
+        row = self.__rows.get(uri, None)
+        return row is not None and self.__live[row] == 1
+
+
+    def get(self, uri):
+        """Returns a dictionary containing the ``level``, ``id``, ``label``,
+        ``size`` and ``type`` of the item with the given URI, or ``None`` if
+        there is no such item. Unknown sizes and types are ``None``.
+        """
+
+        with self.__lock:
+            row = self.__rows.get(uri, None)
+
+            if row is None or not self.__live[row]:
+                return None
+
+            size = self.__size[row]
+
+            return {'level' : LEVELS[self.__level[row]],
+                    'id'    : self.__ids[   row],
+                    'label' : self.__labels[row],
+                    'size'  : None if math.isnan(size) else size,
+                    'type'  : self.__types[ row]}
+
+
+    def add(self, parent, children):
+        """Adds a listing to the store. Any items from a previous listing of
+        the same parent which are not in this listing are removed, along
+        with all of their descendants.
+
+        :arg parent:   URI of the parent item, or ``None`` for the root of
+                       the hierarchy. The parent does not need to be in
+                       the store - its children are linked to it if it is
+                       added later on.
+        :arg children: Sequence of ``(uri, level, id, label, size, type)``
+                       tuples, one for each child. The size and type may be
+                       ``None`` if they are not known.
+        """
+
+        with self.__lock:
+
+            # Listings are keyed by the parent
+            # URI, rather than its row, as the
+            # parent may not be in the store
+            prow = self.__rows.get(parent, -1)
+            old  = self.__children.pop(parent, [])
+            new  = []
+
+            for uri, level, id_, label, size, type_ in children:
+
+                if size is None:
+                    size = float('nan')
+
+                row = self.__rows.get(uri, None)
+
+                if row is None:
+                    row              = len(self.__ids)
+                    self.__rows[uri] = row
+                    self.__parent.append(prow)
+                    self.__level .append(LEVELS.index(level))
+                    self.__size  .append(size)
+                    self.__live  .append(1)
+                    self.__ids   .append(id_)
+                    self.__labels.append(label)
+                    self.__types .append(type_)
+                    self.__uris  .append(uri)
+
+                    # Link the children of this item,
+                    # if they were added before it
+                    for crow in self.__children.get(uri, []):
+                        self.__parent[crow] = row
+
+                else:
+                    self.__parent[row] = prow
+                    self.__level[ row] = LEVELS.index(level)
+                    self.__size[  row] = size
+                    self.__live[  row] = 1
+                    self.__ids[   row] = id_
+                    self.__labels[row] = label
+                    self.__types[ row] = type_
+
+                new.append(row)
+
+            for row in set(old).difference(new):
+                self.__remove(row)
+
+            self.__children[parent] = new
+
+
+    def mask(self, level=None, under=None, type=None):
+        """Returns a boolean column which is true for all items that match
+        the given criteria. This is a ``numpy`` array if ``numpy`` is
+        available, or a list otherwise.
+
+        :arg level: Only include items at this level of the hierarchy.
+        :arg under: Only include items beneath (but not including) the item
+                    with this URI.
+        :arg type:  Only include items with this type (e.g. scan type).
+        """
+
+        with self.__lock:
+            if np is not None: return self.__npmask(level, under, type)
+            else:              return self.__pymask(level, under, type)
+
+
+    def count(self, level=None, under=None, type=None):
+        """Returns the number of items which match the given criteria - see
+        :meth:`mask`.
+        """
+        return int(sum(self.mask(level, under, type)))
+
+
+    def totalSize(self, level='file', under=None, type=None):
+        """Returns the total size, in bytes, of all items which match the
+        given criteria - see :meth:`mask`. Items with an unknown size are
+        ignored.
+        """
+
+        mask = self.mask(level, under, type)
+
+        with self.__lock:
+            nrows = len(mask)
+            if np is not None:
+                size = np.frombuffer(self.__size, dtype=np.float64)[:nrows]
+                return float(np.nansum(size[mask]))
+            else:
+                return sum(s for s, m in zip(self.__size, mask)
+                           if m and not math.isnan(s))
+
+
+    def __remove(self, row):
+        """Marks the given row, and all of its descendants, as removed. Must
+        be called with the lock held.
+        """
+        self.__live[row] = 0
+        for child in self.__children.pop(self.__uris[row], []):
+            self.__remove(child)
+
+
+    def __npmask(self, level, under, type_):
+        """Used by :meth:`mask` when ``numpy`` is available. """
+
+        nrows = len(self.__ids)
+
+        if nrows == 0:
+            return np.zeros(0, dtype=bool)
+
+        live  = np.frombuffer(self.__live, dtype=np.int8)[:nrows]
+        mask  = live == 1
+
+        if level is not None:
+            levels = np.frombuffer(self.__level, dtype=np.int8)[:nrows]
+            mask  &= levels == LEVELS.index(level)
+
+        if type_ is not None:
+            types  = np.array(self.__types, dtype=object)
+            mask  &= types == type_
+
+        if under is not None:
+            root   = self.__rows.get(under, None)
+            if root is None:
+                return np.zeros(nrows, dtype=bool)
+
+            # Walk up the hierarchy one level at
+            # a time, for all items at once
+            parents = np.frombuffer(self.__parent, dtype=np.int64)[:nrows]
+            ances   = parents.copy()
+            inside  = np.zeros(nrows, dtype=bool)
+
+            for _ in range(len(LEVELS)):
+                inside |= ances == root
+                valid   = ances >= 0
+                ances   = np.where(valid, parents[np.where(valid, ances, 0)],
+                                   -1)
+
+            mask &= inside
+
+        return mask
+
+
+    def __pymask(self, level, under, type_):
+        """Used by :meth:`mask` when ``numpy`` is not available. """
+
+        nrows = len(self.__ids)
+        mask  = [l == 1 for l in self.__live]
+
+        if level is not None:
+            level = LEVELS.index(level)
+            mask  = [m and l == level for m, l in zip(mask, self.__level)]
+
+        if type_ is not None:
+            mask = [m and t == type_ for m, t in zip(mask, self.__types)]
+
+        if under is not None:
+            root = self.__rows.get(under, None)
+            if root is None:
+                return [False] * nrows
+
+            # Memoise whether each row
+            # is beneath the root
+            inside = {}
+
+            def isInside(row):
+                parent = self.__parent[row]
+                if parent < 0:     return False
+                if parent == root: return True
+                if parent not in inside:
+                    inside[parent] = isInside(parent)
+                return inside[parent]
+
+            mask = [m and isInside(r) for r, m in enumerate(mask)]
+
+        return mask
@@ -6,6 +6,7 @@
 #
 
 import time
+import threading
 
 import wx
 
@@ -59,3 +60,168 @@ def yield_until(condition):
     while not condition():
         time.sleep(0.1)
         wx.Yield()
+
+
+NAME_ATTS = {
+    'project'    : 'name',
+    'subject'    : 'label',
+    'experiment' : 'label',
+    'assessor'   : 'label',
+    'scan'       : 'id',
+    'resource'   : 'label',
+    'file'       : 'id',
+}
+
+
+class MockCollection(object):
+    """Stand-in for a ``xnatpy`` collection. Listings are recorded by the
+    session, and take ``session.delay`` seconds.
+    """
+
+    def __init__(self, session, uri, children):
+        self.session  = session
+        self.uri      = uri
+        self.children = children
+
+    def filter(self, constraints):
+        return self
+
+    @property
+    def listing(self):
+        self.session.list(self.uri)
+        return list(self.children)
+
+
+class MockXNATObject(object):
+    """Stand-in for a ``xnatpy`` object. ``children`` is a dictionary of
+    ``{ collection : [MockXNATObject] }`` mappings, e.g.
+    ``{ 'subjects' : [...] }``.
+    """
+
+    def __init__(self, session, uri, level, id_, name, children=None):
+        self.xnat_session = session
+        self.uri          = uri
+        self.level        = level
+        self.id           = id_
+        self.collections  = children or {}
+        setattr(self, NAME_ATTS[level], name)
+
+    def __getattr__(self, att):
+        collections = self.__dict__.get('collections', {})
+        if att not in collections:
+            raise AttributeError(att)
+        return MockCollection(self.xnat_session,
+                              '{}/{}'.format(self.uri, att),
+                              collections[att])
+
+    def clearcache(self):
+        pass
+
+    def __repr__(self):
+        return self.uri
+
+
+class MockXNATSession(object):
+    """Stand-in for a ``xnat`` session. Every listing is recorded in
+    ``requests``, and the maximum number of concurrent listings in
+    ``maxActive``. Listings take ``delay`` seconds, or may be given a
+    per-URI delay in ``delays``. Listings of URIs in ``fail`` raise an
+    error.
+    """
+
+    def __init__(self):
+        self.lock      = threading.Lock()
+        self.requests  = []
+        self.delay     = 0
+        self.delays    = {}
+        self.fail      = set()
+        self.active    = 0
+        self.maxActive = 0
+        self.project   = None
+
+    def list(self, uri):
+        with self.lock:
+            self.requests.append(uri)
+            self.active   += 1
+            self.maxActive = max(self.active, self.maxActive)
+        try:
+            time.sleep(self.delays.get(uri, self.delay))
+            if uri in self.fail:
+                raise IOError('Could not list {}'.format(uri))
+        finally:
+            with self.lock:
+                self.active -= 1
+
+    def create_object(self, uri, type_=None, id_=None, **kwargs):
+        return self.project
+
+    def clearcache(self):
+        pass
+
+
+def mock_project(session, nsubjects=3, nscans=2):
+    """Creates a mock project containing ``nsubjects`` subjects, each with
+    one experiment containing ``nscans`` scans, each with one resource
+    containing one file.
+    """
+
+    def obj(parent, collection, level, id_, name, children=None):
+        uri = '{}/{}/{}'.format(parent, collection, id_)
+        return MockXNATObject(session, uri, level, id_, name, children)
+
+    puri     = '/data/projects/P'
+    subjects = []
+
+    for s in range(1, nsubjects + 1):
+        suri  = '{}/subjects/S{}'.format(puri, s)
+        euri  = '{}/experiments/E{}'.format(suri, s)
+        scans = []
+        for c in range(1, nscans + 1):
+            curi  = '{}/scans/{}'.format(euri, c)
+            ruri  = '{}/resources/R{}'.format(curi, c)
+            files = [obj(ruri, 'files', 'file', 'f{}.dcm'.format(c),
+                         'f{}.dcm'.format(c))]
+            res   = obj(curi, 'resources', 'resource', 'R{}'.format(c),
+                        'DICOM', {'files' : files})
+            scans.append(obj(euri, 'scans', 'scan', str(c), str(c),
+                             {'resources' : [res]}))
+        exp = obj(suri, 'experiments', 'experiment', 'E{}'.format(s),
+                  'ses-{:02d}'.format(s),
+                  {'assessors' : [], 'scans' : scans, 'resources' : []})
+        subjects.append(obj(puri, 'subjects', 'subject', 'S{}'.format(s),
+                            'sub-{:02d}'.format(s),
+                            {'experiments' : [exp], 'resources' : []}))
+
+    project         = MockXNATObject(session, puri, 'project', 'P', 'P',
+                                     {'subjects'  : subjects,
+                                      'resources' : []})
+    session.project = project
+    return project
+
+
+def mock_connect(panel, session):
+    """Gives the panel a mock session, and selects its project. """
+    panel._XNATBrowserPanel__session = session
+    picker = panel._XNATBrowserPanel__project
+    picker.SetItems([session.project.id])
+    picker.SetSelection(0)
+    panel._XNATBrowserPanel__onProject()
+
+
+def tree_children(tree, item):
+    """Returns a list of the child items of the given tree item. """
+    children = []
+    if tree.GetChildrenCount(item, False) == 0:
+        return children
+    child, cookie = tree.GetFirstChild(item)
+    while child.IsOk():
+        children.append(child)
+        child, cookie = tree.GetNextChild(item, cookie)
+    return children
+
+
+def tree_labels(tree, item):
+    """Returns a list of the labels of the child items of the given tree
+    item.
+    """
+    return [tree.GetItemText(c) for c in tree_children(tree, item)]
@@ -0,0 +1,349 @@
+#!/usr/bin/env python
+#
+# test_browser.py - Tests for the XNATBrowserPanel tree browser
+#
+# Author: Paul McCarthy <pauldmccarthy@gmail.com>
+#
+
+import time
+
+from unittest import mock
+
+import wx
+
+import fsleyes_widgets.utils.status as status
+
+from . import (run_with_wx,
+               yield_until,
+               MockXNATObject,
+               MockXNATSession,
+               mock_project,
+               mock_connect,
+               tree_children,
+               tree_labels)
+
+from wxnat import XNATBrowserPanel
+
+
+def create_panel(**kwargs):
+    """Creates a XNATBrowserPanel connected to a mock session. """
+    parent  = wx.GetTopLevelWindows()[0]
+    panel   = XNATBrowserPanel(parent, bulkListing=False, **kwargs)
+    session = MockXNATSession()
+    tree    = panel._XNATBrowserPanel__browser
+    mock_project(session)
+    mock_connect(panel, session)
+    return panel, session, tree
+
+
+def expand_item(panel, tree, item):
+    """Expands the given item in the background, and waits until its
+    children have been added.
+    """
+    panel._XNATBrowserPanel__onTreeSelect(item=item)
+    yield_until(lambda : len(tree_children(tree, item)) > 0 and
+                'loading' not in [tree.GetItemData(c)[1]
+                                  for c in tree_children(tree, item)])
+
+
+def mock_subject(session, id_, name):
+    """Creates a mock subject of the mock project. """
+    uri = '/data/projects/P/subjects/{}'.format(id_)
+    return MockXNATObject(session, uri, 'subject', id_, name,
+                          {'experiments' : [], 'resources' : []})
+
+
+def test_expand_background():
+    run_with_wx(_test_expand_background)
+def _test_expand_background():
+
+    panel, session, tree = create_panel()
+    root                 = tree.GetRootItem()
+
+    # Children are listed on another thread,
+    # so the user can carry on browsing, and
+    # a placeholder is shown in the meantime
+    session.delay = 0.5
+    start         = time.time()
+    panel._XNATBrowserPanel__onTreeSelect(item=root)
+    elapsed       = time.time() - start
+
+    assert elapsed < session.delay
+    assert tree_labels(tree, root) == ['Loading ...']
+    assert tree.GetItemData(tree_children(tree, root)[0])[1] == 'loading'
+
+    yield_until(lambda : 'Subject sub-01' in tree_labels(tree, root))
+
+    assert tree_labels(tree, root) == ['Subject sub-01',
+                                       'Subject sub-02',
+                                       'Subject sub-03']
+
+
+def test_expand_concurrent():
+    run_with_wx(_test_expand_concurrent)
+def _test_expand_concurrent():
+
+    panel, session, tree = create_panel()
+    root                 = tree.GetRootItem()
+
+    expand_item(panel, tree, root)
+    subject = tree_children(tree, root)[0]
+    expand_item(panel, tree, subject)
+
+    # Give the experiment an assessor and a
+    # resource, and make its collections
+    # finish listing in reverse order
+    exp, _  = tree.GetItemData(tree_children(tree, subject)[0])
+    assr    = MockXNATObject(session, exp.uri + '/assessors/A1', 'assessor',
+                             'A1', 'fs-01', {'scans' : [], 'resources' : []})
+    res     = MockXNATObject(session, exp.uri + '/resources/R9', 'resource',
+                             'R9', 'NIFTI', {'files' : []})
+    exp.collections['assessors'] = [assr]
+    exp.collections['resources'] = [res]
+
+    session.delays = {exp.uri + '/assessors' : 0.6,
+                      exp.uri + '/scans'     : 0.3,
+                      exp.uri + '/resources' : 0}
+
+    session.requests  = []
+    session.maxActive = 0
+    expitem           = tree_children(tree, subject)[0]
+    expand_item(panel, tree, expitem)
+
+    # Sibling collections are listed at the
+    # same time, but the children are added
+    # in hierarchy order
+    levels = [tree.GetItemData(c)[1] for c in tree_children(tree, expitem)]
+    assert sorted(session.requests) == [exp.uri + '/assessors',
+                                        exp.uri + '/resources',
+                                        exp.uri + '/scans']
+    assert session.maxActive == 3
+    assert levels == ['assessor', 'scan', 'scan', 'resource']
+
+
+def test_refresh():
+    run_with_wx(_test_refresh)
+def _test_refresh():
+
+    panel, session, tree = create_panel()
+    root                 = tree.GetRootItem()
+
+    expand_item(panel, tree, root)
+    subjects = tree_children(tree, root)
+    expand_item(panel, tree, subjects[0])
+
+    assert tree_labels(tree, root) == ['Subject sub-01',
+                                       'Subject sub-02',
+                                       'Subject sub-03']
+
+    # Subject 2 is removed, and subject 4
+    # is added, on the server
+    project  = session.project
+    existing = project.collections['subjects']
+    project.collections['subjects'] = [existing[0],
+                                       existing[2],
+                                       mock_subject(session, 'S4', 'sub-04')]
+
+    # The refresh happens in the background,
+    # so the tree is not changed straight away
+    session.delay    = 0.5
+    session.requests = []
+    panel._XNATBrowserPanel__onRefresh(None)
+    assert tree_labels(tree, root) == ['Subject sub-01',
+                                       'Subject sub-02',
+                                       'Subject sub-03']
+
+    yield_until(lambda : 'Subject sub-04' in tree_labels(tree, root))
+
+    # All loaded items are re-listed, and
+    # items which still exist are retained,
+    # along with their children
+    assert sorted(session.requests) == [
+        '/data/projects/P/resources',
+        '/data/projects/P/subjects',
+        '/data/projects/P/subjects/S1/experiments',
+        '/data/projects/P/subjects/S1/resources']
+    assert tree_labels(tree, root) == ['Subject sub-01',
+                                       'Subject sub-03',
+                                       'Subject sub-04']
+    assert tree_children(tree, root)[0] == subjects[0]
+    assert tree_labels(tree, subjects[0]) == ['Experiment ses-01']
+
+
+def test_refresh_error():
+    run_with_wx(_test_refresh_error)
+def _test_refresh_error():
+
+    panel, session, tree = create_panel()
+    root                 = tree.GetRootItem()
+
+    expand_item(panel, tree, root)
+
+    session.project.collections['subjects'] = []
+    session.fail.add('/data/projects/P/subjects')
+
+    # Failures are reported, and
+    # the tree is left unchanged
+    with mock.patch.object(status, 'reportError') as reportError:
+        panel._XNATBrowserPanel__onRefresh(None)
+        yield_until(lambda : reportError.call_count > 0)
+
+    assert tree_labels(tree, root) == ['Subject sub-01',
+                                       'Subject sub-02',
+                                       'Subject sub-03']
+
+
+def test_refresh_placeholder():
+    run_with_wx(_test_refresh_placeholder)
+def _test_refresh_placeholder():
+
+    panel, session, tree = create_panel()
+    root                 = tree.GetRootItem()
+
+    expand_item(panel, tree, root)
+
+    session.project.collections['subjects'].append(
+        mock_subject(session, 'S4', 'sub-04'))
+
+    # A placeholder which is added while a
+    # refresh is in progress (e.g. by a
+    # background expansion) is left alone
+    session.delay = 0.5
+    with mock.patch.object(status, 'reportError') as reportError:
+        panel._XNATBrowserPanel__onRefresh(None)
+        placeholder = tree.AppendItem(root, 'Loading ...',
+                                      data=[None, 'loading'])
+        yield_until(lambda : 'Subject sub-04' in tree_labels(tree, root))
+
+    assert reportError.call_count == 0
+    assert placeholder in tree_children(tree, root)
+    assert tree_labels(tree, root) == ['Subject sub-01',
+                                       'Subject sub-02',
+                                       'Subject sub-03',
+                                       'Subject sub-04',
+                                       'Loading ...']
+
+
+def test_refresh_discarded():
+    run_with_wx(_test_refresh_discarded)
+def _test_refresh_discarded():
+
+    panel, session, tree = create_panel()
+    root                 = tree.GetRootItem()
+
+    expand_item(panel, tree, root)
+
+    # A refresh which is superseded by
+    # another refresh is discarded
+    session.delays['/data/projects/P/subjects'] = 1
+    session.project.collections['subjects'] = []
+    panel._XNATBrowserPanel__onRefresh(None)
+
+    session.delays = {}
+    session.project.collections['subjects'] = [
+        mock_subject(session, 'S5', 'sub-05')]
+    panel._XNATBrowserPanel__onRefresh(None)
+
+    yield_until(lambda : tree_labels(tree, root) == ['Subject sub-05'])
+    yield_until(lambda : session.active == 0)
+    wx.Yield()
+
+    assert tree_labels(tree, root) == ['Subject sub-05']
+
+
+def set_filter(panel, level, pattern):
+    """Sets the filter for the given level, as if it had been entered by
+    the user.
+    """
+    levels = list(panel._XNATBrowserPanel__filters.keys())
+    panel._XNATBrowserPanel__filter.SetSelection(levels.index(level))
+    panel._XNATBrowserPanel__filterText.SetValue(pattern)
+    panel._XNATBrowserPanel__onFilterText(None)
+
+
+def test_filter_restore():
+    run_with_wx(_test_filter_restore)
+def _test_filter_restore():
+
+    panel, session, tree = create_panel()
+    root                 = tree.GetRootItem()
+
+    expand_item(panel, tree, root)
+    subject = tree_children(tree, root)[0]
+    expand_item(panel, tree, subject)
+
+    assert tree_labels(tree, subject) == ['Experiment ses-01']
+
+    # Filters are applied to the retained
+    # listings - nothing is re-listed
+    session.requests = []
+    set_filter(panel, 'experiment', 'nomatch')
+    assert tree_labels(tree, subject) == []
+
+    # The subject has still been loaded, even
+    # though all of its children are hidden,
+    # so they are restored when the filter
+    # is relaxed
+    set_filter(panel, 'experiment', '')
+    assert tree_labels(tree, subject) == ['Experiment ses-01']
+    assert session.requests == []
+
+
+def test_search_loaded():
+    run_with_wx(_test_search_loaded)
+def _test_search_loaded():
+
+    panel, session, tree = create_panel()
+    root                 = tree.GetRootItem()
+    search               = panel._XNATBrowserPanel__search
+
+    expand_item(panel, tree, root)
+    expand_item(panel, tree, tree_children(tree, root)[0])
+
+    # Hide and re-show the subject, so its
+    # children are listed, but are not in
+    # the tree
+    set_filter(panel, 'subject', 'sub-02')
+    set_filter(panel, 'subject', '')
+    subject = tree_children(tree, root)[0]
+    assert tree.GetChildrenCount(subject) == 0
+
+    # Search results are added from the
+    # retained listings, without making
+    # any requests
+    session.requests = []
+    search.SetValue('ses-01')
+    panel._XNATBrowserPanel__onSearch()
+
+    selected = tree.GetSelections()
+    assert len(selected) == 1
+    assert tree.GetItemText(selected[0])   == 'Experiment ses-01'
+    assert tree.GetItemParent(selected[0]) == subject
+    assert session.requests                == []
+
+    # Items which have not been listed
+    # cannot be found, and are not listed
+    search.SetValue('f1.dcm')
+    panel._XNATBrowserPanel__onSearch()
+    assert session.requests == []
+
+
+def test_known_hosts():
+    run_with_wx(_test_known_hosts)
+def _test_known_hosts():
+
+    # Hosts, accounts and tokens are
+    # all keyed by the host without
+    # its http[s]:// prefix
+    parent = wx.GetTopLevelWindows()[0]
+    panel  = XNATBrowserPanel(
+        parent,
+        knownHosts=['https://shop.org'],
+        knownAccounts={'http://xnat.ps/' : ('user', 'pass')},
+        knownTokens={'https://xnat.ps' : ('user', 'https://xnat.ps', 'abc')},
+        persistTokens=True)
+
+    assert panel.GetHosts()    == ['shop.org', 'xnat.ps']
+    assert panel.GetAccounts() == {'xnat.ps' : ('user', 'pass')}
+    assert panel.GetTokens()   == {
+        'xnat.ps' : ('user', 'https://xnat.ps', 'abc')}
@@ -0,0 +1,276 @@
+#!/usr/bin/env python
+#
+# test_cache.py - Tests for the wxnat.cache module
+#
+# Author: Paul McCarthy <pauldmccarthy@gmail.com>
+#
+
+import os.path as op
+import            time
+import            sqlite3
+import            tempfile
+import concurrent.futures as futures
+
+import wxnat.cache as cache
+
+
+class MockSession(object):
+    def __init__(self):
+        self.requests = []
+        self.value    = 0
+
+    def get_json(self, uri, query=None, accepted_status=None):
+        self.requests.append(cache.ListingCache.key(uri, query))
+        return {'uri' : uri, 'value' : self.value}
+
+
+def test_DiskCache():
+
+    with tempfile.TemporaryDirectory() as td:
+
+        fname = op.join(td, 'sub', 'cache.db')
+        disk  = cache.DiskCache(fname)
+
+        def get(uri, host='host', user='user'):
+            return disk.get(host, user, uri)
+
+        assert get('/data/projects') is None
+
+        disk.put('host',  'user',  '/data/projects',   {'a' : [1, 2, 3]})
+        disk.put('host',  'user',  '/data/projects/P', {'b' : 'c'})
+        disk.put('other', 'user',  '/data/projects',   {'d' : 'e'})
+        disk.put('host',  'user2', '/data/projects',   {'j' : 'k'})
+
+        assert get('/data/projects')                 == {'a' : [1, 2, 3]}
+        assert get('/data/projects/P')               == {'b' : 'c'}
+        assert get('/data/projects', host='other')   == {'d' : 'e'}
+        assert get('/data/projects', user='user2')   == {'j' : 'k'}
+        assert get('/data/projects/P', user='user2') is None
+
+        disk.close()
+
+        # responses are persisted
+        disk = cache.DiskCache(fname)
+        assert get('/data/projects') == {'a' : [1, 2, 3]}
+
+        disk.put('host', 'user', '/data/projects/P2',         {'f' : 'g'})
+        disk.put('host', 'user', '/data/projects/P/subjects', {'h' : 'i'})
+        disk.invalidate('host', 'user', '/data/projects/P')
+        assert get('/data/projects')            == {'a' : [1, 2, 3]}
+        assert get('/data/projects/P2')         == {'f' : 'g'}
+        assert get('/data/projects/P')          is None
+        assert get('/data/projects/P/subjects') is None
+
+        disk.invalidate('host', 'user')
+        assert get('/data/projects')               is None
+        assert get('/data/projects', host='other') == {'d' : 'e'}
+        assert get('/data/projects', user='user2') == {'j' : 'k'}
+        disk.close()
+
+
+def test_DiskCache_old_schema():
+
+    with tempfile.TemporaryDirectory() as td:
+
+        # caches which are not keyed
+        # by user are discarded
+        fname = op.join(td, 'cache.db')
+        conn  = sqlite3.connect(fname)
+        with conn:
+            conn.execute('CREATE TABLE responses ('
+                         'host  TEXT NOT NULL, '
+                         'uri   TEXT NOT NULL, '
+                         'stamp REAL NOT NULL, '
+                         'value TEXT NOT NULL, '
+                         'PRIMARY KEY (host, uri))')
+            conn.execute('INSERT INTO responses VALUES (?, ?, ?, ?)',
+                         ('host', '/data/projects', time.time(), '[1]'))
+        conn.close()
+
+        disk = cache.DiskCache(fname)
+        assert disk.get('host', '', '/data/projects') is None
+        disk.put('host', '', '/data/projects', [2])
+        assert disk.get('host', '', '/data/projects') == [2]
+        disk.close()
+
+
+def test_MemoryCache():
+
+    mem = cache.MemoryCache(maxSize=22)
+
+    assert mem.get('host', 'user', '/a') is None
+
+    mem.put('host', 'user', '/a',   [1])
+    mem.put('host', 'user', '/a/b', [2])
+    mem.put('host', 'user', '/c',   [3])
+    assert mem.get('host', 'user', '/a') == [1]
+
+    # /a/b is least recently used
+    mem.put('host', 'user', '/d', [4, 5, 6, 7, 8])
+    assert mem.get('host', 'user', '/a/b') is None
+    assert mem.get('host', 'user', '/a')   == [1]
+
+    # cached values are copies
+    mem.get('host', 'user', '/a').append(2)
+    assert mem.get('host', 'user', '/a') == [1]
+
+    # too large to be cached
+    mem.put('host', 'user', '/e', list(range(100)))
+    assert mem.get('host', 'user', '/e') is None
+
+    stats = mem.stats()
+    assert stats['hits']      == 4
+    assert stats['misses']    == 3
+    assert stats['evictions'] == 1
+    assert stats['entries']   == 3
+    assert stats['size']      == 21
+
+    mem.put('host', 'user', '/a/b', [2])
+    mem.invalidate('host', 'user', '/a')
+    assert mem.get('host', 'user', '/a')   is None
+    assert mem.get('host', 'user', '/a/b') is None
+    assert mem.get('host', 'user', '/d')   == [4, 5, 6, 7, 8]
+    mem.invalidate('host', 'user')
+    assert mem.stats()['entries'] == 0
+    assert mem.stats()['size']    == 0
+
+
+def test_DiskCache_ttl():
+
+    with tempfile.TemporaryDirectory() as td:
+        disk = cache.DiskCache(op.join(td, 'cache.db'), ttl=0.1)
+        disk.put('host', 'user', '/data/projects', [1])
+        assert disk.get('host', 'user', '/data/projects') == [1]
+        time.sleep(0.2)
+        assert disk.get('host', 'user', '/data/projects') is None
+        disk.close()
+
+
+def test_ListingCache():
+
+    with tempfile.TemporaryDirectory() as td:
+
+        fname   = op.join(td, 'cache.db')
+        session = MockSession()
+        disk    = cache.DiskCache(fname)
+        lcache  = cache.ListingCache('host', disk=disk)
+
+        lcache.install(session)
+
+        query = {'columns' : 'ID,URI'}
+        assert session.get_json('/data/projects', query) == \
+            {'uri' : '/data/projects', 'value' : 0}
+        assert session.get_json('/data/projects', query) == \
+            {'uri' : '/data/projects', 'value' : 0}
+        assert session.requests == ['/data/projects?columns=ID%2CURI']
+
+        lcache.invalidate()
+        session.get_json('/data/projects', query)
+        assert len(session.requests) == 2
+
+        # targeted invalidation
+        session.get_json('/data/projects/P1/subjects')
+        session.get_json('/data/projects/P2/subjects')
+        lcache.invalidate('/data/projects/P1')
+        session.get_json('/data/projects', query)
+        session.get_json('/data/projects/P1/subjects')
+        session.get_json('/data/projects/P2/subjects')
+        assert session.requests[2:] == ['/data/projects/P1/subjects',
+                                        '/data/projects/P2/subjects',
+                                        '/data/projects/P1/subjects']
+        disk.close()
+
+
+def test_ListingCache_memory():
+
+    session = MockSession()
+    lcache  = cache.ListingCache('host', cache.MemoryCache())
+    lcache.install(session)
+
+    session.get_json('/data/projects')
+    session.get_json('/data/projects')
+    assert session.requests == ['/data/projects']
+    assert lcache.memory.stats()['hits']   == 1
+    assert lcache.memory.stats()['misses'] == 1
+
+
+def test_ListingCache_revalidate():
+
+    with tempfile.TemporaryDirectory() as td:
+
+        fname    = op.join(td, 'cache.db')
+        session  = MockSession()
+        disk     = cache.DiskCache(fname)
+        executor = futures.ThreadPoolExecutor(max_workers=1)
+        lcache   = cache.ListingCache('host', disk=disk, executor=executor,
+                                      user='user')
+
+        disk.put('host', 'user', '/data/projects', {'value' : 'stale'})
+        session.value = 'fresh'
+        lcache.install(session)
+
+        # stale value returned immediately,
+        # and re-validated in the background
+        assert session.get_json('/data/projects') == {'value' : 'stale'}
+        executor.shutdown(wait=True)
+        assert session.requests == ['/data/projects']
+        assert disk.get('host', 'user', '/data/projects') == \
+            {'uri' : '/data/projects', 'value' : 'fresh'}
+
+        # each response is only re-validated once
+        session.get_json('/data/projects')
+        assert session.requests == ['/data/projects']
+        disk.close()
+
+
+def test_isListing():
+    assert cache.isListing('/data/projects')
+    assert cache.isListing('/data/projects/P/subjects')
+    assert cache.isListing('/data/projects/P/subjects?columns=ID')
+    assert cache.isListing('/data/experiments/E/scans/1/resources/R/files')
+    assert cache.isListing('/data/archive/projects/P/subjects')
+    assert cache.isListing('/REST/projects/P/subjects/')
+    assert not cache.isListing('/data/projects/P')
+    assert not cache.isListing('/data/projects/P/subjects/files')
+    assert not cache.isListing('/data/experiments/E/scans/1')
+    assert not cache.isListing('/data/auth')
+    assert not cache.isListing('/data/search/elements')
+
+
+def test_ListingCache_listings_only():
+
+    session = MockSession()
+    lcache  = cache.ListingCache('host')
+    lcache.install(session)
+
+    # details of individual objects are
+    # always retrieved from the server
+    session.get_json('/data/projects/P')
+    session.get_json('/data/projects/P')
+    session.get_json('/data/projects/P/subjects')
+    session.get_json('/data/projects/P/subjects')
+    assert session.requests == ['/data/projects/P',
+                                '/data/projects/P',
+                                '/data/projects/P/subjects']
+
+
+def test_ListingCache_user():
+
+    with tempfile.TemporaryDirectory() as td:
+
+        disk    = cache.DiskCache(op.join(td, 'cache.db'))
+        session = MockSession()
+        lcache1 = cache.ListingCache('host', disk=disk, user='user1')
+        lcache2 = cache.ListingCache('host', disk=disk, user='user2')
+
+        lcache1.install(session)
+        session.get_json('/data/projects')
+
+        # listings retrieved by one user
+        # are not returned to another
+        session = MockSession()
+        lcache2.install(session)
+        session.get_json('/data/projects')
+        assert session.requests == ['/data/projects']
+        assert disk.get('host', 'user1', '/data/projects')['value'] == 0
+        disk.close()
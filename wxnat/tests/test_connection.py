@@ -0,0 +1,201 @@
+#!/usr/bin/env python
+#
+# test_connection.py - Tests for the wxnat.connection module
+#
+# Author: Paul McCarthy <pauldmccarthy@gmail.com>
+#
+
+import time
+import threading
+
+import pytest
+
+import wxnat.connection as connection
+
+
+class MockSession(object):
+    def __init__(self, host):
+        self.host         = host
+        self.disconnected = False
+    def disconnect(self):
+        self.disconnected = True
+
+
+@pytest.fixture
+def servers(monkeypatch):
+    """Patches xnat.connect - each host is mapped to a (delay, success)
+    tuple.
+    """
+
+    servers  = {}
+    sessions = []
+
+    def connect(host, user=None, password=None, **kwargs):
+        delay, ok = servers[host]
+        time.sleep(delay)
+        if not ok:
+            raise IOError('Could not connect to {}'.format(host))
+        sess = MockSession(host)
+        sessions.append(sess)
+        return sess
+
+    monkeypatch.setattr(connection.xnat, 'connect', connect)
+    servers['sessions'] = sessions
+    return servers
+
+
+def test_connect_prefer_first(servers):
+
+    # https slower than http, but within grace period
+    servers['https://a'] = (0.3, True)
+    servers['http://a']  = (0,   True)
+
+    host, sess = connection.connect(['https://a', 'http://a'], grace=2)
+    assert host == 'https://a'
+    assert sess.host == host
+
+    http = [s for s in servers['sessions'] if s.host == 'http://a'][0]
+    assert http.disconnected
+    assert not sess.disconnected
+
+
+def test_connect_grace(servers):
+
+    # https hangs - http is used after the
+    # grace period, and the https session
+    # is closed when it is eventually made
+    servers['https://a'] = (1, True)
+    servers['http://a']  = (0, True)
+
+    start      = time.time()
+    host, sess = connection.connect(['https://a', 'http://a'], grace=0.2)
+    assert host == 'http://a'
+    assert time.time() - start < 0.9
+
+    time.sleep(1.2)
+    https = [s for s in servers['sessions'] if s.host == 'https://a'][0]
+    assert https.disconnected
+    assert not sess.disconnected
+
+
+def test_connect_failure(servers):
+
+    servers['https://a'] = (0,   False)
+    servers['http://a']  = (0.1, True)
+    assert connection.connect(['https://a', 'http://a'])[0] == 'http://a'
+
+    servers['http://a']  = (0, False)
+    with pytest.raises(IOError, match='https://a'):
+        connection.connect(['https://a', 'http://a'])
+
+
+def test_connect_cancel(servers):
+
+    servers['https://a'] = (0.5, True)
+    cancel               = threading.Event()
+
+    threading.Timer(0.1, cancel.set).start()
+    assert connection.connect(['https://a'], cancel=cancel) is None
+
+    time.sleep(0.6)
+    assert all(s.disconnected for s in servers['sessions'])
+
+
+def test_connectArgs(monkeypatch):
+
+    def connect(server, user=None, pilot_timeout=12, default_timeout=300):
+        pass
+    def oldconnect(server, user=None):
+        pass
+
+    monkeypatch.setattr(connection.xnat, 'connect', connect)
+    assert connection.connectArgs(None) == {}
+    assert connection.connectArgs(5)    == {'pilot_timeout'   : 5,
+                                            'default_timeout' : 5}
+
+    monkeypatch.setattr(connection.xnat, 'connect', oldconnect)
+    assert connection.connectArgs(5) == {}
+
+
+@pytest.fixture
+def tokens(monkeypatch):
+    """Patches xnat.connect - valid tokens are mapped to usernames. """
+
+    tokens = {}
+    calls  = []
+
+    def connect(host, user=None, password=None, jsession=None, **kwargs):
+        calls.append(host)
+        if jsession not in tokens:
+            raise Exception('Login attempt failed')
+        sess                = MockSession(host)
+        sess.jsession       = jsession
+        sess.logged_in_user = tokens[jsession]
+        tokens['sessions'].append(sess)
+        return sess
+
+    monkeypatch.setattr(connection.xnat, 'connect', connect)
+    tokens['calls']    = calls
+    tokens['sessions'] = []
+    return tokens
+
+
+def test_resume(tokens):
+
+    tokens['abc'] = 'user'
+
+    sess = connection.resume('https://a', 'user', 'abc')
+    assert sess.host                     == 'https://a'
+    assert connection.sessionToken(sess) == 'abc'
+    assert tokens['calls'] == ['https://a']
+
+    assert connection.resume('https://a', 'user',  'def') is None
+    assert connection.resume('https://a', 'other', 'abc') is None
+    assert connection.resume('https://a', None,    'abc') is not None
+
+    tokens['ghi'] = 'guest'
+    assert connection.resume('https://a', None, 'ghi') is None
+
+    # sessions for the wrong user
+    # are disconnected
+    disconnected = [s.disconnected for s in tokens['sessions']]
+    assert disconnected == [False, True, False, True]
+
+
+def test_hostKey():
+    assert connection.hostKey('https://xnat.test')    == 'xnat.test'
+    assert connection.hostKey('http://xnat.test/')    == 'xnat.test'
+    assert connection.hostKey(' HTTPS://xnat.test ')  == 'xnat.test'
+    assert connection.hostKey('xnat.test')            == 'xnat.test'
+    assert connection.hostKey('https://ps.test/xnat') == 'ps.test/xnat'
+    assert connection.hostKey('sh.test')              == 'sh.test'
+    assert connection.hostKey('https://shop.org')     == 'shop.org'
+    assert connection.hostKey('http://xnat.ps')       == 'xnat.ps'
+
+
+def test_resume_unsupported(servers):
+    assert connection.resume('https://a', 'user', 'abc') is None
+
+
+def test_disconnect_keepToken(monkeypatch):
+
+    class Base(MockSession):
+        def disconnect(self):
+            self.closed = True
+
+    class Session(Base):
+        def disconnect(self):
+            self.ended = True
+            super(Session, self).disconnect()
+
+    monkeypatch.setattr(connection.xnat.session, 'BaseXNATSession', Base)
+
+    sess = Session('https://a')
+    connection.disconnect(sess, keepToken=True)
+    assert     sess.closed
+    assert not hasattr(sess, 'ended')
+
+    sess = Session('https://a')
+    connection.disconnect(sess)
+    assert sess.closed
+    assert sess.ended
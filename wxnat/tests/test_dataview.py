@@ -0,0 +1,141 @@
+#!/usr/bin/env python
+#
+# test_dataview.py - Tests for the XNATDataViewTree
+#
+# Author: Paul McCarthy <pauldmccarthy@gmail.com>
+#
+
+import wx
+
+from . import (run_with_wx,
+               yield_until,
+               MockXNATSession,
+               mock_project,
+               mock_connect,
+               tree_children,
+               tree_labels)
+
+from wxnat          import XNATBrowserPanel
+from wxnat.dataview import XNATDataViewTree
+
+
+def test_tree_model():
+    run_with_wx(_test_tree_model)
+def _test_tree_model():
+
+    parent = wx.GetTopLevelWindows()[0]
+    tree   = XNATDataViewTree(parent)
+    model  = tree.model
+
+    root = tree.AddRoot('root', data=['r', 'project'])
+    b    = tree.AppendItem( root, 'b', data=['b', 'subject'])
+    a    = tree.PrependItem(root, 'a', data=['a', 'subject'])
+    c    = tree.InsertItem( root, b, 'c', data=['c', 'subject'])
+
+    assert tree.GetRootItem()           == root
+    assert tree_labels(tree, root)      == ['a', 'b', 'c']
+    assert tree.GetItemData(c)          == ['c', 'subject']
+    assert tree.GetItemParent(c)        == root
+    assert tree.GetPrevSibling(c)       == b
+    assert not tree.GetPrevSibling(a).IsOk()
+    assert model.IsContainer(root)
+    assert not model.IsContainer(a)
+
+    tree.AppendItem(a, 'a1')
+    tree.AppendItem(a, 'a2')
+
+    assert model.IsContainer(a)
+    assert tree.GetChildrenCount(root, False) == 3
+    assert tree.GetChildrenCount(root)        == 5
+
+    tree.SetItemText(b, 'bb')
+    assert tree.GetItemText(b) == 'bb'
+
+    tree.Delete(b)
+    assert tree_labels(tree, root) == ['a', 'c']
+
+    tree.DeleteChildren(a)
+    assert tree.GetChildrenCount(a) == 0
+    assert tree.GetChildrenCount(root) == 2
+
+    tree.DeleteAllItems()
+    assert not tree.GetRootItem().IsOk()
+
+
+def test_tree_freeze():
+    run_with_wx(_test_tree_freeze)
+def _test_tree_freeze():
+
+    parent = wx.GetTopLevelWindows()[0]
+    tree   = XNATDataViewTree(parent)
+
+    root = tree.AddRoot('root')
+
+    # Items added while frozen are
+    # in the model straight away, and
+    # are passed to wx when thawed
+    tree.Freeze()
+    items = [tree.AppendItem(root, str(i)) for i in range(5)]
+    assert tree_labels(tree, root) == [str(i) for i in range(5)]
+
+    # Deleting while frozen must not
+    # lose the other pending items
+    tree.Delete(items[2])
+    tree.Thaw()
+
+    assert tree_labels(tree, root) == ['0', '1', '3', '4']
+
+    tree.Expand(root)
+    tree.SelectItem(items[3])
+    assert tree.IsSelected(items[3])
+    tree.SelectItem(items[3], False)
+    assert not tree.IsSelected(items[3])
+
+
+def test_lazy_loading():
+    run_with_wx(_test_lazy_loading)
+def _test_lazy_loading():
+
+    parent  = wx.GetTopLevelWindows()[0]
+    panel   = XNATBrowserPanel(parent, virtualTree=True, bulkListing=False)
+    session = MockXNATSession()
+    tree    = panel._XNATBrowserPanel__browser
+
+    mock_project(session, nsubjects=3)
+    mock_connect(panel, session)
+
+    root = tree.GetRootItem()
+
+    # Nothing is listed until an
+    # item is opened by the user
+    assert isinstance(tree, XNATDataViewTree)
+    assert tree.GetItemData(root)[1] == 'project'
+    assert tree.GetChildrenCount(root) == 0
+    assert session.requests == []
+
+    panel._XNATBrowserPanel__onTreeSelect(item=root)
+    yield_until(lambda : any(tree.GetItemData(c)[1] == 'subject'
+                             for c in tree_children(tree, root)))
+
+    subjects = tree_children(tree, root)
+
+    assert [tree.GetItemData(s)[1] for s in subjects] == ['subject'] * 3
+    assert sorted(session.requests) == ['/data/projects/P/resources',
+                                        '/data/projects/P/subjects']
+
+    # Only the children of the opened
+    # item are listed - subjects are
+    # not loaded until they are opened
+    for s in subjects:
+        assert tree.GetChildrenCount(s) == 0
+
+    session.requests = []
+    panel._XNATBrowserPanel__onTreeSelect(item=subjects[1])
+    yield_until(lambda : any(tree.GetItemData(c)[1] == 'experiment'
+                             for c in tree_children(tree, subjects[1])))
+
+    assert sorted(session.requests) == [
+        '/data/projects/P/subjects/S2/experiments',
+        '/data/projects/P/subjects/S2/resources']
+    assert tree.GetChildrenCount(subjects[0]) == 0
+    assert tree.GetChildrenCount(subjects[2]) == 0
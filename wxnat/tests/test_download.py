@@ -0,0 +1,456 @@
+#!/usr/bin/env python
+#
+# test_download.py - Tests for the wxnat.download module
+#
+# Author: Paul McCarthy <pauldmccarthy@gmail.com>
+#
+
+import os.path   as op
+import             io
+import             zipfile
+import             hashlib
+import             threading
+
+import pytest
+
+import wxnat.download as download
+
+
+class MockResponse(object):
+    """Fake ``requests.Response`` which returns its data in fixed size
+    chunks.
+    """
+
+    def __init__(self, fobj, data, status=200, headers=None):
+        self.fobj        = fobj
+        self.data        = data
+        self.status_code = status
+        self.headers     = headers or {}
+        self.headers['Content-Length'] = str(len(data))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        pass
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise IOError('HTTP {}'.format(self.status_code))
+
+    def iter_content(self, chunk_size):
+        fobj = self.fobj
+        for off in range(0, len(self.data), 4):
+            if fobj.gate is not None:
+                fobj.gate.wait()
+            if fobj.error is not None and off > 0:
+                raise fobj.error
+            yield self.data[off:off + 4]
+
+
+class MockSession(object):
+    """Fake ``xnat`` session, which serves files to ``MockFile`` objects.
+    """
+
+    def __init__(self, fobj):
+        self.fobj      = fobj
+        self.interface = self
+        self.ranges    = []
+        self.timeouts  = []
+
+    def _format_uri(self, uri, format=None):
+        return uri
+
+    def head(self, uri, allow_redirects=False, timeout=None):
+        self.timeouts.append(timeout)
+        return MockResponse(self.fobj, self.fobj.data)
+
+    def get(self, uri, stream=False, headers=None, timeout=None):
+        fobj  = self.fobj
+        data  = fobj.data
+        self.timeouts.append(timeout)
+
+        # simulate corruption in transit
+        if fobj.corrupt > 0:
+            fobj.corrupt -= 1
+            data          = b'x' + data[1:]
+        range = (headers or {}).get('Range', None)
+        self.ranges.append(range)
+
+        if range is None or not fobj.ranges:
+            return MockResponse(fobj, data)
+
+        start, end = range[6:].split('-')
+        start      = int(start)
+        end        = int(end) if end else len(data) - 1
+        if start >= len(data):
+            return MockResponse(fobj, b'', 416)
+
+        crange = 'bytes {}-{}/{}'.format(start, end, len(data))
+        return MockResponse(fobj, data[start:end + 1], 206,
+                            {'Content-Range' : crange})
+
+
+class MockFile(object):
+    """Fake ``xnat.FileData`` object. """
+
+    def __init__(self, name, data, listedSize=True, error=None, gate=None,
+                 ranges=True):
+        self.id           = name
+        self.uri          = '/data/files/{}'.format(name)
+        self.data         = data
+        self.error        = error
+        self.gate         = gate
+        self.ranges       = ranges
+        self.corrupt      = 0
+        self.xnat_session = MockSession(self)
+        self._cache       = {'data' : {}}
+        self._cache['data']['digest'] = hashlib.md5(data).hexdigest()
+        if listedSize:
+            self._cache['data']['Size'] = str(len(data))
+
+
+def test_parseContentRange():
+    assert download.parseContentRange('bytes 10-99/100')  == (10, 100)
+    assert download.parseContentRange('bytes 10-99/*')    == (10, None)
+    assert download.parseContentRange('')                 == (None, None)
+    assert download.parseContentRange('bytes */100')      == (None, None)
+
+
+def test_downloadFile(tmpdir):
+
+    dest = op.join(tmpdir, 'a.txt')
+    assert download.downloadFile(MockFile('a.txt', b'0123456789'), dest) \
+        == dest
+    with open(dest, 'rb') as f:
+        assert f.read() == b'0123456789'
+    assert not op.exists(dest + download.PART_SUFFIX)
+
+    # failed downloads are left in
+    # the part file, and resumed
+    dest = op.join(tmpdir, 'b.txt')
+    fobj = MockFile('b.txt', b'0123456789', error=IOError('oops'))
+    with pytest.raises(IOError):
+        download.downloadFile(fobj, dest)
+    assert not op.exists(dest)
+    with open(dest + download.PART_SUFFIX, 'rb') as f:
+        assert f.read() == b'0123'
+
+    progress   = []
+    fobj.error = None
+    download.downloadFile(fobj, dest,
+                          lambda *a: progress.append(a))
+    assert fobj.xnat_session.ranges == [None, 'bytes=4-']
+    assert progress[0]  == (4,  10, False)
+    assert progress[-1] == (10, 10, True)
+    with open(dest, 'rb') as f:
+        assert f.read() == b'0123456789'
+    assert not op.exists(dest + download.PART_SUFFIX)
+
+
+def test_downloadFile_no_ranges(tmpdir):
+
+    # the server ignores the range
+    # request - the part file is
+    # overwritten
+    dest = op.join(tmpdir, 'a.txt')
+    fobj = MockFile('a.txt', b'0123456789', ranges=False)
+    with open(dest + download.PART_SUFFIX, 'wb') as f:
+        f.write(b'xxxxxx')
+
+    download.downloadFile(fobj, dest)
+    with open(dest, 'rb') as f:
+        assert f.read() == b'0123456789'
+
+    # the part file is larger than the
+    # file on the server - re-download
+    fobj = MockFile('a.txt', b'0123', ranges=True)
+    with open(dest + download.PART_SUFFIX, 'wb') as f:
+        f.write(b'xxxxxx')
+    download.downloadFile(fobj, dest)
+    assert fobj.xnat_session.ranges == ['bytes=6-', None]
+    with open(dest, 'rb') as f:
+        assert f.read() == b'0123'
+
+    # resume can be disabled
+    fobj = MockFile('a.txt', b'0123456789')
+    with open(dest + download.PART_SUFFIX, 'wb') as f:
+        f.write(b'01')
+    download.downloadFile(fobj, dest, resume=False)
+    assert fobj.xnat_session.ranges == [None]
+
+
+def test_downloadFile_verify(tmpdir):
+
+    data = b'0123456789'
+    dest = op.join(tmpdir, 'a.txt')
+    fobj = MockFile('a.txt', data)
+
+    # corrupt downloads are retried
+    fobj.corrupt = 2
+    download.downloadFile(fobj, dest, verify=True, retries=2)
+    assert len(fobj.xnat_session.ranges) == 3
+    with open(dest, 'rb') as f:
+        assert f.read() == data
+
+    fobj.corrupt = 2
+    with pytest.raises(download.ChecksumError):
+        download.downloadFile(fobj, dest + '2', verify=True, retries=1)
+    assert not op.exists(dest + '2')
+    assert not op.exists(dest + '2' + download.PART_SUFFIX)
+
+    # corruption is not detected
+    # unless verify is True
+    fobj.corrupt = 1
+    download.downloadFile(fobj, dest)
+    with open(dest, 'rb') as f:
+        assert f.read() == b'x' + data[1:]
+
+    # resumed downloads are verified,
+    # including the existing part
+    with open(dest + download.PART_SUFFIX, 'wb') as f:
+        f.write(b'0123')
+    download.downloadFile(fobj, dest, verify=True)
+    assert fobj.xnat_session.ranges[-1] == 'bytes=4-'
+
+    with open(dest + download.PART_SUFFIX, 'wb') as f:
+        f.write(b'x123')
+    download.downloadFile(fobj, dest, verify=True)
+    assert fobj.xnat_session.ranges[-2:] == ['bytes=4-', None]
+    with open(dest, 'rb') as f:
+        assert f.read() == data
+
+
+def test_downloadSegmented_verify(tmpdir):
+    data = bytes(range(256)) * 4
+    dest = op.join(tmpdir, 'a.dat')
+    fobj = MockFile('a.dat', data)
+
+    # only the first segment is corrupted
+    fobj.corrupt = 1
+    download.downloadSegmented(fobj, dest, segments=1, segmentSize=300,
+                               verify=True)
+    with open(dest, 'rb') as f:
+        assert f.read() == data
+    assert len(fobj.xnat_session.ranges) == 8
+
+    # segments which are downloaded
+    # concurrently are verified in order
+    nsegs        = len(range(0, len(data), 100))
+    fobj.corrupt = nsegs
+    dest         = op.join(tmpdir, 'b.dat')
+    download.downloadSegmented(fobj, dest, segments=3, segmentSize=100,
+                               verify=True, retries=1)
+    with open(dest, 'rb') as f:
+        assert f.read() == data
+
+    fobj.corrupt = nsegs * 2
+    dest         = op.join(tmpdir, 'c.dat')
+    with pytest.raises(download.ChecksumError):
+        download.downloadSegmented(fobj, dest, segments=3, segmentSize=100,
+                                   verify=True, retries=1)
+    assert not op.exists(dest)
+    assert not op.exists(dest + download.PART_SUFFIX)
+
+
+@pytest.mark.parametrize('ranges', [True, False])
+def test_downloadSegmented(tmpdir, ranges):
+
+    data     = bytes(range(256)) * 4
+    dest     = op.join(tmpdir, 'a.dat')
+    fobj     = MockFile('a.dat', data, ranges=ranges)
+    progress = []
+
+    download.downloadSegmented(fobj, dest, lambda *a: progress.append(a),
+                               segments=3, segmentSize=100)
+
+    with open(dest, 'rb') as f:
+        assert f.read() == data
+    assert not op.exists(dest + download.PART_SUFFIX)
+    assert progress[-1] == (len(data), len(data), True)
+
+    if ranges:
+        assert sorted(fobj.xnat_session.ranges) == \
+            sorted('bytes={}-{}'.format(o, min(o + 99, len(data) - 1))
+                   for o in range(0, len(data), 100))
+    else:
+        assert fobj.xnat_session.ranges[-1] is None
+
+
+def test_downloadSegmented_error(tmpdir):
+
+    dest = op.join(tmpdir, 'a.dat')
+    fobj = MockFile('a.dat', bytes(1000), error=IOError('oops'))
+    with pytest.raises(IOError):
+        download.downloadSegmented(fobj, dest, segmentSize=100)
+    assert not op.exists(dest)
+    assert not op.exists(dest + download.PART_SUFFIX)
+
+    # small files are downloaded normally
+    fobj = MockFile('a.dat', bytes(50))
+    download.downloadSegmented(fobj, dest, segmentSize=100)
+    assert fobj.xnat_session.ranges == [None]
+
+
+def test_DownloadManager(tmpdir):
+
+    files = [MockFile('{}.dcm'.format(i), bytes(range(i + 1)),
+                      listedSize=(i != 3))
+             for i in range(10)]
+    files[5].error = IOError('oops')
+    dests = [op.join(tmpdir, f.id) for f in files]
+
+    manager = download.DownloadManager(zip(files, dests), workers=3)
+
+    # size of file 3 is not known in advance
+    assert manager.progress().total is None
+
+    manager.start()
+    assert manager.wait(10)
+
+    prog    = manager.progress()
+    results = manager.results
+
+    assert prog.files  == 10
+    assert prog.done   == 10
+    assert prog.failed == 1
+    assert prog.total  == sum(range(1, 11))
+
+    assert results[5] is None
+    assert [e[:2] for e in manager.errors] == [(files[5], dests[5])]
+
+    for i, (f, d) in enumerate(zip(files, dests)):
+        if i == 5:
+            assert not op.exists(d)
+        else:
+            assert results[i] == d
+            with open(d, 'rb') as inf:
+                assert inf.read() == f.data
+
+
+def test_DownloadManager_cancel(tmpdir):
+
+    gate  = threading.Event()
+    files = [MockFile('{}.dcm'.format(i), b'0123456789', gate=gate)
+             for i in range(4)]
+    dests = [op.join(tmpdir, f.id) for f in files]
+
+    manager = download.DownloadManager(zip(files, dests), workers=2)
+    manager.start()
+    manager.cancel()
+    gate.set()
+
+    assert manager.wait(10)
+    assert manager.cancelled
+    assert manager.results == [None] * 4
+    assert manager.errors  == []
+    assert not any(op.exists(d) for d in dests)
+
+
+class Unseekable(object):
+    """File-like which can only be written to, causing ``zipfile`` to write
+    sizes in data descriptors, as XNAT does.
+    """
+    def __init__(self):
+        self.data = io.BytesIO()
+    def write(self, data):
+        return self.data.write(data)
+    def flush(self):
+        pass
+    def tell(self):
+        return self.data.tell()
+
+
+def makeArchive(files, compression, seekable=True):
+    if seekable: out = io.BytesIO()
+    else:        out = Unseekable()
+    with zipfile.ZipFile(out, 'w', compression=compression) as zf:
+        for name, data in files.items():
+            zf.writestr(name, data)
+    if seekable: return out.getvalue()
+    else:        return out.data.getvalue()
+
+
+def test_archivePath():
+    prefix = 'MR1/scans/3-T1w/resources/DICOM/files/'
+    assert download.archivePath(prefix + 'a.dcm', 'resource')   == 'a.dcm'
+    assert download.archivePath(prefix + 'a.dcm', 'scan')       == \
+        op.join('DICOM', 'a.dcm')
+    assert download.archivePath(prefix + 'a.dcm', 'experiment') == \
+        op.join('3', 'DICOM', 'a.dcm')
+    assert download.archivePath(prefix + 'sub/a.dcm', 'resource') == \
+        op.join('sub', 'a.dcm')
+    assert download.archivePath('../x/./a.dcm', 'scan') == \
+        op.join('x', 'a.dcm')
+    assert download.archivePath('MR1/scans/', 'scan') is None
+
+
+@pytest.mark.parametrize('compression,seekable', [
+    (zipfile.ZIP_STORED,   True),
+    (zipfile.ZIP_DEFLATED, True),
+    (zipfile.ZIP_DEFLATED, False)])
+def test_extractArchive(tmpdir, compression, seekable):
+
+    prefix = 'MR1/scans/{}/resources/DICOM/files/{}'
+    files  = {prefix.format('1-T1w', 'a.dcm') : b'a' * 1000,
+              prefix.format('1-T1w', 'b.dcm') : bytes(range(256)) * 50,
+              prefix.format('2-T2w', 'a.dcm') : b'',
+              'MR1/scans/2-T2w/'              : b''}
+    data   = makeArchive(files, compression, seekable)
+
+    # feed the archive in awkwardly sized chunks
+    chunks = [data[i:i + 7] for i in range(0, len(data), 7)]
+    paths  = download.extractArchive(
+        chunks, tmpdir, lambda n: download.archivePath(n, 'experiment'))
+
+    expected = {op.join(tmpdir, '1', 'DICOM', 'a.dcm') : b'a' * 1000,
+                op.join(tmpdir, '1', 'DICOM', 'b.dcm') :
+                bytes(range(256)) * 50,
+                op.join(tmpdir, '2', 'DICOM', 'a.dcm') : b''}
+
+    assert sorted(paths) == sorted(expected)
+    for path, contents in expected.items():
+        with open(path, 'rb') as f:
+            assert f.read() == contents
+
+
+def test_extractArchive_corrupt(tmpdir):
+    data = bytearray(makeArchive({'a.txt' : b'abcdefgh'}, zipfile.ZIP_STORED))
+    data[data.index(b'abcdefgh')] = ord('x')
+    with pytest.raises(ValueError):
+        download.extractArchive([bytes(data)], tmpdir)
+    assert not op.exists(op.join(tmpdir, 'a.txt'))
+
+
+def test_formatURI():
+
+    # xnatpy sessions without _format_uri
+    class Session(object):
+        server = 'https://xnat.org/'
+
+    class XNATSession(Session):
+        def _format_uri(self, uri, format=None):
+            return 'formatted', uri, format
+
+    uri = '/data/experiments/E/files'
+    assert download.formatURI(XNATSession(), uri, 'zip') == \
+        ('formatted', uri, 'zip')
+    assert download.formatURI(Session(), uri) == \
+        'https://xnat.org/data/experiments/E/files'
+    assert download.formatURI(Session(), uri, format='zip') == \
+        'https://xnat.org/data/experiments/E/files?format=zip'
+
+
+def test_download_timeout(tmpdir):
+
+    fobj = MockFile('file', b'abcdefghijklmnop')
+    dest = op.join(tmpdir, 'file')
+    download.downloadFile(fobj, dest)
+    download.downloadSegmented(fobj, dest, segments=2, segmentSize=4)
+
+    timeouts = fobj.xnat_session.timeouts
+    assert len(timeouts) > 1
+    assert all(t == download.TIMEOUT for t in timeouts)
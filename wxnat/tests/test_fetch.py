@@ -0,0 +1,339 @@
+#!/usr/bin/env python
+#
+# test_fetch.py - Tests for the wxnat.fetch module
+#
+# Author: Paul McCarthy <pauldmccarthy@gmail.com>
+#
+
+import pytest
+
+import wxnat.fetch as fetch
+
+
+# A fake hierarchy of { (name, level) : [(name, level)] }
+HIERARCHY = {
+    ('exp', 'experiment') : [('1', 'scan'), ('2', 'scan'), ('r', 'resource')],
+    ('1',   'scan')       : [('1dcm', 'resource')],
+    ('2',   'scan')       : [('2dcm', 'resource')],
+    ('r',   'resource')   : [('a.txt', 'file')],
+    ('1dcm', 'resource')  : [('1.dcm', 'file'), ('2.dcm', 'file')],
+    ('2dcm', 'resource')  : [('3.dcm', 'file')],
+}
+
+
+def listChildren(obj, level):
+    return [(n, l, n) for n, l in HIERARCHY.get((obj, level), [])]
+
+
+def test_SubtreeExpander_breadth_first():
+
+    expander = fetch.SubtreeExpander(listChildren, maxWorkers=2)
+    batches  = list(expander.expand('exp', 'experiment'))
+
+    assert len(batches) == 3
+
+    # depth 1 - the children of the root
+    assert len(batches[0]) == 1
+    parent, children = batches[0][0]
+    assert parent is None
+    assert [c[0] for c in children] == ['1', '2', 'r']
+
+    # depth 2 - the children of each
+    # depth 1 item, in order
+    assert [p[0] for p, _ in batches[1]] == ['1', '2', 'r']
+    assert [[c[0] for c in cs] for _, cs in batches[1]] == \
+        [['1dcm'], ['2dcm'], ['a.txt']]
+
+    # depth 3 - files are not expanded
+    assert [p[0] for p, _ in batches[2]] == ['1dcm', '2dcm']
+    assert [[c[0] for c in cs] for _, cs in batches[2]] == \
+        [['1.dcm', '2.dcm'], ['3.dcm']]
+
+
+def test_SubtreeExpander_include():
+
+    def include(child):
+        return child[0] != '2'
+
+    expander = fetch.SubtreeExpander(listChildren, include=include)
+    batches  = list(expander.expand('exp', 'experiment'))
+
+    assert [c[0] for c in batches[0][0][1]] == ['1', 'r']
+    assert [p[0] for p, _ in batches[1]]    == ['1', 'r']
+
+
+def test_SubtreeExpander_cancel():
+
+    calls = []
+
+    def progress(depth, done, total):
+        calls.append((depth, done, total))
+        return depth < 2
+
+    expander = fetch.SubtreeExpander(listChildren, progress=progress)
+    batches  = []
+
+    with pytest.raises(fetch.ExpansionCancelled):
+        for batch in expander.expand('exp', 'experiment'):
+            batches.append(batch)
+
+    assert expander.cancelled
+    assert len(batches) == 1
+    assert calls[0] == (1, 1, 1)
+    assert calls[1] == (2, 1, 3)
+
+
+class MockObject(object):
+    def __init__(self, uri, session, id_=None, **kwargs):
+        self.uri          = uri
+        self.xnat_session = session
+        self.id           = id_
+        self.__dict__.update(kwargs)
+
+
+class MockSession(object):
+    def __init__(self, rows=None):
+        self.rows     = rows
+        self.requests = []
+
+    def get_json(self, uri):
+        self.requests.append(uri)
+        if self.rows is None:
+            raise ValueError('Not supported')
+        return {'ResultSet' : {'Result' : self.rows}}
+
+    def create_object(self, uri, type_, id_, datafields, **kwargs):
+        return MockObject(uri, self, id_, datafields=datafields, **kwargs)
+
+
+def test_BulkListing():
+
+    exp  = '/data/experiments/E1'
+    rows = [
+        {'URI' : exp + '/scans/1/resources/11/files/a.dcm',
+         'Name' : 'a.dcm', 'Size' : '10', 'collection' : 'DICOM',
+         'cat_ID' : '11'},
+        {'URI' : exp + '/scans/1/resources/11/files/sub/b.dcm',
+         'Name' : 'b.dcm', 'Size' : '20', 'collection' : 'DICOM',
+         'cat_ID' : '11'},
+        {'URI' : exp + '/scans/2/resources/12/files/c.nii',
+         'Name' : 'c.nii', 'Size' : '5', 'collection' : 'NIFTI',
+         'cat_ID' : '12'},
+        {'URI' : exp + '/resources/13/files/notes.txt',
+         'Name' : 'notes.txt', 'Size' : '1', 'collection' : 'MISC',
+         'cat_ID' : '13'},
+    ]
+
+    session = MockSession(rows)
+    bulk    = fetch.BulkListing()
+    scan1   = MockObject(exp + '/scans/1', session)
+    scan2   = MockObject(exp + '/scans/2', session)
+    scan3   = MockObject(exp + '/scans/3', session)
+
+    res1 = bulk.listChildren(scan1, 'scan')
+    res2 = bulk.listChildren(scan2, 'scan')
+
+    # no files - fall back to per-level listing
+    assert bulk.listChildren(scan3, 'scan') is None
+    assert session.requests == [exp + '/files']
+
+    assert [(r.id, l, n) for r, l, n in res1] == [('11', 'resource', 'DICOM')]
+    assert [(r.id, l, n) for r, l, n in res2] == [('12', 'resource', 'NIFTI')]
+    assert res1[0][0].datafields['file_size'] == '30'
+
+    files = bulk.listChildren(res1[0][0], 'resource')
+    assert [(f.id, l, n) for f, l, n in files] == \
+        [('a.dcm', 'file', 'a.dcm'), ('sub/b.dcm', 'file', 'sub/b.dcm')]
+    assert files[0][0].uri == exp + '/scans/1/resources/11/files/a.dcm'
+
+    bulk.clear()
+    bulk.listChildren(scan1, 'scan')
+    assert len(session.requests) == 2
+
+    bulk.invalidate('/data/experiments/E2')
+    bulk.listChildren(scan1, 'scan')
+    assert len(session.requests) == 2
+    bulk.invalidate(exp + '/scans/2')
+    assert bulk.listChildren(res1[0][0], 'resource') is None
+    bulk.listChildren(scan1, 'scan')
+    assert len(session.requests) == 3
+
+
+def test_BulkListing_assessor_scan():
+
+    session = MockSession([])
+    bulk    = fetch.BulkListing()
+    scan    = MockObject('/data/experiments/E1/assessors/A1/scans/1', session)
+
+    assert bulk.listChildren(scan, 'scan') is None
+    assert session.requests == []
+
+
+def test_BulkListing_unsupported():
+
+    session = MockSession()
+    bulk    = fetch.BulkListing()
+    scan    = MockObject('/data/experiments/E1/scans/1', session)
+
+    assert bulk.listChildren(scan, 'scan') is None
+    assert bulk.listChildren(scan, 'scan') is None
+    assert len(session.requests) == 1
+
+
+class MockResponse(object):
+    def __init__(self, data):
+        self.data = data
+
+    def json(self):
+        return self.data
+
+
+class MockSkeletonSession(object):
+    def __init__(self, listings, scans=None):
+        self.listings = listings
+        self.scans     = scans
+        self.requests  = []
+        self.documents = []
+
+    def get_json(self, uri, query=None):
+        self.requests.append(uri)
+        return {'ResultSet' : {'Result' : self.listings[uri]}}
+
+    def post(self, uri, format=None, data=None):
+        self.requests.append(uri)
+        self.documents.append(data.decode())
+        if self.scans is None:
+            raise ValueError('Not supported')
+        return MockResponse({'ResultSet' : {'Result' : self.scans}})
+
+    def create_object(self, uri, type_, id_, **kwargs):
+        return MockObject(uri, self, id_, xsiType=type_, **kwargs)
+
+
+def test_searchDocument():
+    doc = fetch.searchDocument('xnat:mrScanData',
+                               [('xnat:mrScanData', 'ID')],
+                               [('xnat:mrSessionData/PROJECT', '=', 'P')])
+    doc = doc.decode()
+    assert 'xnat:mrScanData</'             in doc
+    assert 'xnat:mrSessionData/PROJECT</'  in doc
+    assert '>P</'                          in doc
+
+
+def test_ProjectSkeleton():
+
+    proj     = '/data/projects/P'
+    listings = {
+        proj + '/subjects'    : [{'ID' : 'S1', 'label' : 'sub-01'},
+                                 {'ID' : 'S2', 'label' : 'sub-02'}],
+        proj + '/experiments' : [{'ID' : 'E1', 'label' : 'ses-01',
+                                  'subject_ID' : 'S1',
+                                  'xsiType' : 'xnat:mrSessionData'},
+                                 {'ID' : 'E2', 'label' : 'pet',
+                                  'subject_ID' : 'S1',
+                                  'xsiType' : 'xnat:petSessionData'},
+                                 {'ID' : 'E3', 'label' : 'shared',
+                                  'subject_ID' : 'S9',
+                                  'xsiType' : 'xnat:mrSessionData'}]}
+    scans    = [{'xnat_imagescandata_id' : '1', 'TYPE' : 'T1w',
+                 'image_session_id' : 'E1'},
+                {'xnat_imagescandata_id' : '2', 'TYPE' : 'T2w',
+                 'image_session_id' : 'E1'}]
+
+    session  = MockSkeletonSession(listings, scans)
+    project  = MockObject(proj, session, 'P')
+    skeleton = fetch.ProjectSkeleton()
+
+    assert skeleton.listCollection(project, 'subject') is None
+
+    skeleton.load(project)
+    assert len(session.requests) == 3
+
+    subjs = skeleton.listCollection(project, 'subject')
+    assert [(s.id, l, n) for s, l, n in subjs] == \
+        [('S1', 'subject', 'sub-01'), ('S2', 'subject', 'sub-02')]
+    assert subjs[0][0].uri == proj + '/subjects/S1'
+
+    exps = skeleton.listCollection(subjs[0][0], 'experiment')
+    assert [(e.id, n) for e, _, n in exps] == [('E1', 'ses-01'),
+                                               ('E2', 'pet')]
+    assert skeleton.listCollection(subjs[1][0], 'experiment') == []
+
+    scans = skeleton.listCollection(exps[0][0], 'scan')
+    assert [(s.id, s.type) for s, _, _ in scans] == [('1', 'T1w'),
+                                                     ('2', 'T2w')]
+    assert scans[0][0].uri == proj + '/subjects/S1/experiments/E1/scans/1'
+
+    # non-MR experiments fall back
+    assert skeleton.listCollection(exps[1][0], 'scan')     is None
+    assert skeleton.listCollection(exps[0][0], 'resource') is None
+
+    skeleton.invalidate(subjs[0][0].uri)
+    assert skeleton.listCollection(exps[0][0],  'scan')       is None
+    assert skeleton.listCollection(subjs[0][0], 'experiment') is None
+    assert skeleton.listCollection(project,     'subject')    is not None
+
+    # scan search not supported
+    session  = MockSkeletonSession(listings)
+    project  = MockObject(proj, session, 'P')
+    skeleton = fetch.ProjectSkeleton()
+    skeleton.load(project)
+    assert skeleton.listCollection(project, 'subject') is not None
+    assert skeleton.listCollection(exps[0][0], 'scan') is None
+
+
+def test_ProjectSkeleton_other_scans():
+
+    # Scans of other types within an MR session
+    # (e.g. secondary captures) are retrieved
+    proj     = '/data/projects/P'
+    listings = {
+        proj + '/subjects'    : [{'ID' : 'S1', 'label' : 'sub-01'}],
+        proj + '/experiments' : [{'ID' : 'E1', 'label' : 'ses-01',
+                                  'subject_ID' : 'S1',
+                                  'xsiType' : 'xnat:mrSessionData'}]}
+    scans    = [{'ID' : '1', 'TYPE' : 'T1w',      'IMAGE_SESSION_ID' : 'E1'},
+                {'ID' : '2', 'TYPE' : 'SC',       'IMAGE_SESSION_ID' : 'E1'},
+                {'ID' : '3', 'TYPE' : 'PhoenixZ', 'IMAGE_SESSION_ID' : 'E1'}]
+
+    session  = MockSkeletonSession(listings, scans)
+    project  = MockObject(proj, session, 'P')
+    skeleton = fetch.ProjectSkeleton()
+    skeleton.load(project)
+
+    assert len(session.documents) == 1
+    assert 'xnat:imageScanData</' in session.documents[0]
+
+    subj  = skeleton.listCollection(project, 'subject')[0][0]
+    exp   = skeleton.listCollection(subj, 'experiment')[0][0]
+    scans = skeleton.listCollection(exp, 'scan')
+
+    assert [(s.id, s.type) for s, _, _ in scans] == [('1', 'T1w'),
+                                                     ('2', 'SC'),
+                                                     ('3', 'PhoenixZ')]
+
+
+class MockProjectSession(object):
+    def __init__(self, rows):
+        self.rows     = rows
+        self.requests = []
+
+    def get_json(self, uri, query=None):
+        self.requests.append((uri, query))
+        return {'ResultSet' : {'Result' : self.rows}}
+
+
+def test_listProjects():
+
+    rows    = [{'ID' : 'P2', 'name' : 'Project two'},
+               {'ID' : 'P1', 'name' : 'Project one'},
+               {'ID' : 'P3', 'name' : ''}]
+    session = MockProjectSession(rows)
+
+    ids, names = fetch.listProjects(session)
+    assert ids   == ['P1', 'P2', 'P3']
+    assert names == {'P1' : 'Project one', 'P2' : 'Project two'}
+
+    # names are retrieved in the same request
+    assert session.requests == [('/data/projects',
+                                 {'columns' : 'ID,name'})]
@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+#
+# test_filtering.py - Tests for the wxnat.filtering module
+#
+# Author: Paul McCarthy <pauldmccarthy@gmail.com>
+#
+
+import pytest
+
+import wxnat.filtering as filtering
+
+
+def test_compilePattern_regexp():
+
+    assert filtering.compilePattern('',    'regexp') is None
+    assert filtering.compilePattern('   ', 'regexp') is None
+
+    match = filtering.compilePattern('^sub-0[12]', 'regexp')
+    assert     match('sub-01')
+    assert     match('SUB-02_extra')
+    assert not match('sub-03')
+    assert not match('xsub-01')
+
+    # upper case escapes are preserved
+    match = filtering.compilePattern(r'\D+', 'regexp')
+    assert not match('123')
+
+    with pytest.raises(filtering.InvalidFilter):
+        filtering.compilePattern('sub-(', 'regexp', 'subject')
+
+
+def test_compilePattern_glob():
+
+    match = filtering.compilePattern('sub-01*|*.nii.gz', 'glob')
+    assert     match('sub-01')
+    assert     match('SUB-011')
+    assert     match('t1.nii.gz')
+    assert not match('xsub-01')
+    assert not match('t1.nii.gz.bak')
+    assert not match('sub-02')
+
+
+def test_Filters():
+
+    filters = filtering.Filters('glob', [('subject', 'sub-01*'),
+                                         ('file',    '')])
+
+    assert filters.keys()         == ['subject', 'file']
+    assert filters['subject']     == 'sub-01*'
+    assert filters['experiment']  == ''
+    assert     filters.active('subject')
+    assert not filters.active('file')
+    assert not filters.active('experiment')
+
+    assert not filters.filterItem('subject',    'sub-01')
+    assert     filters.filterItem('subject',    'sub-02')
+    assert not filters.filterItem('experiment', 'anything')
+
+    children = [(1, 'subject', 'sub-01'),
+                (2, 'subject', 'sub-02'),
+                (3, 'experiment', 'exp')]
+    assert filters.apply(children) == [children[0], children[2]]
+
+    filters['subject'] = ''
+    assert filters.apply(children) == children
+
+    # invalid patterns are rejected, and
+    # the previous pattern is retained
+    filters = filtering.Filters('regexp', [('file', 'dcm$')])
+    with pytest.raises(filtering.InvalidFilter):
+        filters['file'] = '*dcm'
+    assert filters['file'] == 'dcm$'
+    assert filters.filterItem('file', 'a.nii')
+
+
+def test_serverPattern():
+
+    assert filtering.serverPattern('',           'glob')   is None
+    assert filtering.serverPattern('sub-01*',    'glob')   == 'sub-01*'
+    assert filtering.serverPattern('*.nii.gz',   'glob')   == '*.nii.gz'
+    assert filtering.serverPattern('sub-0[12]',  'glob')   is None
+    assert filtering.serverPattern('sub-01|s02', 'glob')   is None
+    assert filtering.serverPattern('sub-0?',     'glob')   is None
+
+    assert filtering.serverPattern('^sub-01',    'regexp') == 'sub-01*'
+    assert filtering.serverPattern('sub-01$',    'regexp') == '*sub-01'
+    assert filtering.serverPattern('^sub-01$',   'regexp') == 'sub-01'
+    assert filtering.serverPattern('sub',        'regexp') == '*sub*'
+    assert filtering.serverPattern('^sub.01',    'regexp') is None
+    assert filtering.serverPattern('sub|ses',    'regexp') is None
+
+    filters = filtering.Filters('regexp', [('subject', '^sub-01'),
+                                           ('file',    '.*\\.dcm')])
+    assert filters.serverPattern('subject')    == 'sub-01*'
+    assert filters.serverPattern('file')       is None
+    assert filters.serverPattern('experiment') is None
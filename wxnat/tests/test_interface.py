@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+#
+# test_interface.py - Tests for the wxnat.interface module
+#
+# Author: Paul McCarthy <pauldmccarthy@gmail.com>
+#
+
+import threading
+
+import requests
+
+import wxnat.interface as interface
+
+
+class MockSession(object):
+    def __init__(self):
+        self._interface = requests.Session()
+        self._interface.auth = ('user', 'pass')
+        self._interface.headers['X-Test'] = 'yes'
+
+    @property
+    def interface(self):
+        return self._interface
+
+
+def onThread(func):
+    result = []
+    thread = threading.Thread(target=lambda: result.append(func()))
+    thread.start()
+    thread.join()
+    return result[0]
+
+
+def test_ThreadLocalInterface():
+
+    session = MockSession()
+    base    = session.interface
+
+    interface.install(session, poolSize=2)
+    iface = session.interface
+
+    assert isinstance(iface, interface.ThreadLocalInterface)
+    assert iface.base is base
+
+    # installing again has no effect
+    interface.install(session)
+    assert session.interface is iface
+
+    main  = iface.session()
+    other = onThread(iface.session)
+
+    assert main is iface.session()
+    assert main is not other
+    assert main is not base
+
+    for sess in (main, other):
+        assert sess.auth              == ('user', 'pass')
+        assert sess.headers['X-Test'] == 'yes'
+        assert sess.cookies           is base.cookies
+        assert sess.get_adapter('https://xnat.org')._pool_maxsize == 2
+
+    # cookies set on one thread are
+    # visible on all threads
+    onThread(lambda: iface.cookies.set('JSESSIONID', 'abc'))
+    assert main.cookies.get('JSESSIONID') == 'abc'
+    assert iface.get.__self__ is main
+
+    iface.close()
+
+
+def test_ThreadLocalInterface_keepAlive():
+
+    session = MockSession()
+    interface.install(session, keepAlive=False)
+    assert session.interface.headers['Connection'] == 'close'
+    assert session.interface.base.headers['Connection'] != 'close'
+
+
+def test_install_unsupported():
+    class Old(object):
+        pass
+    session = Old()
+    interface.install(session)
+    assert not hasattr(session, '_interface')
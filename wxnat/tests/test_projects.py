@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+#
+# test_projects.py - Tests for the ProjectPicker
+#
+# Author: Paul McCarthy <pauldmccarthy@gmail.com>
+#
+
+import wx
+
+from . import run_with_wx, yield_until
+
+import wxnat.projects as projects
+
+
+def test_filterProjects():
+
+    ids   = ['ABC', 'DEF', 'GHI']
+    names = {'ABC' : 'Alpha', 'DEF' : 'Beta'}
+
+    assert projects.filterProjects(ids, names, '')      == [0, 1, 2]
+    assert projects.filterProjects(ids, names, '  ')    == [0, 1, 2]
+    assert projects.filterProjects(ids, names, 'def')   == [1]
+    assert projects.filterProjects(ids, names, 'ALPHA') == [0]
+    assert projects.filterProjects(ids, names, 'h')     == [0, 2]
+    assert projects.filterProjects(ids, names, 'x')     == []
+
+
+def test_ProjectPicker():
+    run_with_wx(_test_ProjectPicker)
+def _test_ProjectPicker():
+
+    parent = wx.GetTopLevelWindows()[0]
+    picker = projects.ProjectPicker(parent)
+
+    picker.SetItems(['P1', 'P2', 'P3'])
+    picker.SetNames({'P1' : 'Alpha', 'P2' : 'P2'})
+
+    assert picker.GetCount()     == 3
+    assert picker.GetSelection() == wx.NOT_FOUND
+    assert picker.GetString(1)   == 'P2'
+    assert picker.GetName(0)     == 'Alpha'
+    assert picker.GetName(2)     is None
+    assert picker.GetLabel(0)    == 'P1 - Alpha'
+    assert picker.GetLabel(1)    == 'P2'
+    assert picker.GetLabel(2)    == 'P3'
+
+    picker.SetSelection(2)
+    assert picker.GetSelection() == 2
+    assert picker.GetValue()     == 'P3'
+
+    # the text of the selected project
+    # does not filter the list
+    assert picker.Filter('P3')    == [0, 1, 2]
+    assert picker.Filter('alpha') == [0]
+
+    picker.Clear()
+    assert picker.GetCount()     == 0
+    assert picker.GetSelection() == wx.NOT_FOUND
+
+
+def test_ProjectPicker_enter():
+    run_with_wx(_test_ProjectPicker_enter)
+def _test_ProjectPicker_enter():
+
+    parent = wx.GetTopLevelWindows()[0]
+    picker = projects.ProjectPicker(parent)
+    chosen = []
+
+    picker.Bind(wx.EVT_CHOICE, lambda ev : chosen.append(ev.GetString()))
+    picker.SetItems(['P1', 'P2', 'P3'])
+    picker.SetNames({'P3' : 'Gamma'})
+
+    # enter selects the first match
+    picker.SetValue('gam')
+    ev = wx.CommandEvent(wx.EVT_TEXT_ENTER.typeId, picker.GetId())
+    ev.SetEventObject(picker)
+    picker.GetEventHandler().ProcessEvent(ev)
+
+    yield_until(lambda : len(chosen) > 0)
+
+    assert chosen                == ['P3']
+    assert picker.GetSelection() == 2
+    assert picker.GetValue()     == 'P3'
+
+
+def test_ProjectPicker_narrow():
+    run_with_wx(_test_ProjectPicker_narrow)
+def _test_ProjectPicker_narrow():
+
+    parent = wx.GetTopLevelWindows()[0]
+    picker = projects.ProjectPicker(parent)
+    popup  = picker.GetPopupControl()
+
+    picker.SetItems(['P1', 'P2', 'P3', 'Q4'])
+    picker.SetNames({'Q4' : 'Quartet'})
+
+    picker.Popup()
+    yield_until(picker.IsPopupShown)
+
+    assert popup.GetProjects() == [0, 1, 2, 3]
+
+    # typing narrows down the open list
+    picker.SetValue('q')
+    assert popup.GetProjects() == [3]
+    picker.SetValue('p')
+    assert popup.GetProjects() == [0, 1, 2]
+    picker.SetValue('p2')
+    assert popup.GetProjects() == [1]
+
+    picker.Dismiss()
@@ -0,0 +1,45 @@
+#!/usr/bin/env python
+#
+# test_search.py - Tests for the wxnat.search module
+#
+# Author: Paul McCarthy <pauldmccarthy@gmail.com>
+#
+
+import wxnat.search as search
+
+
+def test_SearchIndex():
+
+    index = search.SearchIndex()
+
+    index.add(None,   [('/p', 'project', 'Proj', 'P')])
+    index.add('/p',   [('/p/s1', 'subject', 'sub-01',  'XNAT_S01'),
+                       ('/p/s2', 'subject', 'sub-02',  'XNAT_S02'),
+                       ('/p/s3', 'subject', 'sub-012', 'XNAT_S03')])
+    index.add('/p/s1', [('/p/s1/e1', 'experiment', 'sub-01_MR', 'XNAT_E01')])
+
+    assert len(index) == 5
+    assert index.get('/p/s2').name == 'sub-02'
+
+    # exact, then prefix, then substring matches
+    assert index.search('sub-01') == ['/p/s1', '/p/s3', '/p/s1/e1']
+    assert index.search('SUB-02') == ['/p/s2']
+    assert index.search('_mr')    == ['/p/s1/e1']
+    assert index.search('xnat_e') == ['/p/s1/e1']
+    assert index.search('s')[:1]  == ['/p/s1']
+    assert index.search('nope')   == []
+    assert index.search('  ')     == []
+    assert len(index.search('sub', limit=2)) == 2
+
+    assert index.path('/p/s1/e1') == ['/p', '/p/s1', '/p/s1/e1']
+
+    # re-listing a parent removes stale items
+    index.add('/p', [('/p/s1', 'subject', 'sub-01', 'XNAT_S01'),
+                     ('/p/s4', 'subject', 'sub-04', 'XNAT_S04')])
+    assert index.search('sub-02') == []
+    assert index.search('sub-04') == ['/p/s4']
+    assert '/p/s2' not in index
+
+    index.clear()
+    assert len(index) == 0
+    assert index.search('sub') == []
@@ -0,0 +1,144 @@
+#!/usr/bin/env python
+#
+# test_sessions.py - Tests for the wxnat.sessions module
+#
+# Author: Paul McCarthy <pauldmccarthy@gmail.com>
+#
+
+import os.path            as op
+import                       sqlite3
+import                       tempfile
+import concurrent.futures as futures
+
+import pytest
+
+import wxnat.cache    as cache
+import wxnat.sessions as sessions
+
+
+class MockSession(object):
+    def __init__(self, host):
+        self.host         = host
+        self.disconnected = False
+    def disconnect(self):
+        self.disconnected = True
+
+
+class Connector(object):
+    def __init__(self, host):
+        self.host     = host
+        self.sessions = []
+    def __call__(self):
+        sess = MockSession(self.host)
+        self.sessions.append(sess)
+        return self.host, sess
+
+
+def test_SessionRegistry_share():
+
+    registry = sessions.SessionRegistry()
+    connect  = Connector('https://xnat.org')
+
+    e1 = registry.acquire('xnat.org',  'user', 'pass', connect)
+    e2 = registry.acquire('XNAT.org/', 'user', 'pass', connect)
+
+    assert e1 is e2
+    assert e1.host == 'https://xnat.org'
+    assert e1.refs == 2
+    assert len(connect.sessions) == 1
+    assert len(registry)         == 1
+
+    assert not registry.release(e1)
+    assert not connect.sessions[0].disconnected
+    assert     registry.release(e2)
+    assert     connect.sessions[0].disconnected
+    assert len(registry) == 0
+
+    # a new session is created
+    # after the last release
+    e3 = registry.acquire('xnat.org', 'user', 'pass', connect)
+    assert e3 is not e1
+    assert len(connect.sessions) == 2
+
+
+def test_SessionRegistry_not_shared():
+
+    registry = sessions.SessionRegistry()
+    connect  = Connector('https://xnat.org')
+
+    e1 = registry.acquire('xnat.org', 'user',  'pass',  connect)
+    e2 = registry.acquire('xnat.org', 'other', 'pass',  connect)
+    e3 = registry.acquire('xnat.org', 'user',  'wrong', connect)
+    e4 = registry.acquire('xnat.org', 'user',  'pass',  connect, share=False)
+
+    assert len({id(e) for e in (e1, e2, e3, e4)}) == 4
+    assert len(connect.sessions) == 4
+    assert len(registry)         == 2
+
+    # the session with the wrong password
+    # does not displace the shared one
+    assert registry.acquire('xnat.org', 'user', 'pass', connect) is e1
+
+    assert registry.release(e3)
+    assert registry.release(e4)
+    assert connect.sessions[2].disconnected
+    assert connect.sessions[3].disconnected
+    assert not connect.sessions[0].disconnected
+
+
+def test_SessionRegistry_cancelled():
+
+    registry = sessions.SessionRegistry()
+    assert registry.acquire('xnat.org', 'user', 'pass', lambda: None) is None
+    assert len(registry) == 0
+
+
+def test_SessionRegistry_concurrent():
+
+    registry = sessions.SessionRegistry()
+    connect  = Connector('https://xnat.org')
+    entries  = []
+
+    # another user connects while
+    # this user is connecting
+    def connectSlow():
+        entries.append(registry.acquire('xnat.org', 'user', 'pass', connect))
+        return connect()
+
+    e1 = registry.acquire('xnat.org', 'user', 'pass', connectSlow)
+
+    assert e1 is entries[0]
+    assert e1.refs == 2
+    assert not connect.sessions[0].disconnected
+    assert     connect.sessions[1].disconnected
+
+
+def test_SessionRegistry_listingCache():
+
+    registry = sessions.SessionRegistry()
+    connect  = Connector('https://xnat.org')
+
+    with tempfile.TemporaryDirectory() as td:
+
+        e1       = registry.acquire('xnat.org', 'user', 'pass', connect)
+        e2       = registry.acquire('xnat.org', 'user', 'pass', connect)
+        disk     = cache.DiskCache(op.join(td, 'cache.db'))
+        executor = futures.ThreadPoolExecutor(max_workers=1)
+        lcache   = cache.ListingCache(e1.host, disk=disk, executor=executor)
+
+        e1.listingCache = lcache
+
+        # the cache is still usable after the
+        # user which created it releases it
+        registry.release(e1)
+        assert e2.listingCache is lcache
+        executor.submit(lambda : None).result()
+        disk.put('host', 'user', '/data/projects', [1])
+
+        # and is closed along with the session
+        registry.release(e2)
+        assert e2.listingCache is None
+        with pytest.raises(RuntimeError):
+            executor.submit(lambda : None)
+        with pytest.raises(sqlite3.ProgrammingError):
+            disk.get('host', 'user', '/data/projects')
@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+#
+# test_store.py - Tests for the wxnat.store module
+#
+# Author: Paul McCarthy <pauldmccarthy@gmail.com>
+#
+
+import pytest
+
+import wxnat.store as store
+
+
+@pytest.fixture(params=['numpy', 'python'])
+def hstore(request, monkeypatch):
+    if request.param == 'python':
+        monkeypatch.setattr(store, 'np', None)
+    elif store.np is None:
+        pytest.skip('numpy is not available')
+
+    hstore = store.HierarchyStore()
+    hstore.add(None,  [('/p', 'project', 'P', 'Proj', None, None)])
+    hstore.add('/p',  [('/p/s1', 'subject', 'S1', 'sub-01', None, None),
+                       ('/p/s2', 'subject', 'S2', 'sub-02', None, None)])
+    hstore.add('/p/s1', [('/p/s1/e1', 'experiment', 'E1', 'mr', None, None)])
+    hstore.add('/p/s2', [('/p/s2/e2', 'experiment', 'E2', 'mr', None, None)])
+    hstore.add('/p/s1/e1', [('/p/s1/e1/1', 'scan', '1', '1', None, 'T1w'),
+                            ('/p/s1/e1/2', 'scan', '2', '2', None, 'T2w')])
+    hstore.add('/p/s2/e2', [('/p/s2/e2/1', 'scan', '1', '1', None, 'T1w')])
+    hstore.add('/p/s1/e1/1', [('/p/s1/e1/1/r', 'resource', 'R', 'DICOM',
+                               30, None)])
+    hstore.add('/p/s1/e1/1/r', [('/p/s1/e1/1/r/a', 'file', 'a', 'a', 10, None),
+                                ('/p/s1/e1/1/r/b', 'file', 'b', 'b', 20, None),
+                                ('/p/s1/e1/1/r/c', 'file', 'c', 'c', None,
+                                 None)])
+    return hstore
+
+
+def test_HierarchyStore(hstore):
+
+    assert len(hstore) == 12
+    assert '/p/s1/e1' in hstore
+    assert hstore.get('/p/s1/e1/2') == {'level' : 'scan', 'id' : '2',
+                                        'label' : '2', 'size' : None,
+                                        'type' : 'T2w'}
+    assert hstore.get('/nope') is None
+
+    assert hstore.count('subject')                     == 2
+    assert hstore.count('scan', type='T1w')            == 2
+    assert hstore.count('scan', under='/p/s1', type='T1w') == 1
+    assert hstore.count('scan', under='/p/s2')         == 1
+    assert hstore.count(under='/p/s1/e1')              == 6
+    assert hstore.count('file', under='/nope')         == 0
+    assert hstore.totalSize()                          == 30
+    assert hstore.totalSize(under='/p/s2')             == 0
+    assert hstore.totalSize('resource', under='/p')    == 30
+
+
+def test_HierarchyStore_relist(hstore):
+
+    # re-listing a parent removes stale
+    # items, and all of their descendants
+    hstore.add('/p/s1/e1', [('/p/s1/e1/2', 'scan', '2', '2', None, 'T2w')])
+
+    assert '/p/s1/e1/1'   not in hstore
+    assert '/p/s1/e1/1/r' not in hstore
+    assert len(hstore)                     == 7
+    assert hstore.count('scan', type='T1w') == 1
+    assert hstore.totalSize()               == 0
+
+    hstore.add('/p/s1/e1', [('/p/s1/e1/1', 'scan', '1', '1', None, 'T1w')])
+    assert hstore.count('scan', under='/p/s1') == 1
+    assert '/p/s1/e1/2' not in hstore
+
+    hstore.clear()
+    assert len(hstore) == 0
+    assert hstore.count() == 0
+
+
+def test_HierarchyStore_orphans(hstore):
+
+    # listings of items which are not in
+    # the store are kept separately, and
+    # do not replace each other, or the
+    # root listing
+    hstore.add('/q/s1', [('/q/s1/e1', 'experiment', 'E1', 'mr', None, None)])
+    hstore.add('/q/s2', [('/q/s2/e2', 'experiment', 'E2', 'mr', None, None)])
+
+    assert '/p'       in hstore
+    assert '/q/s1/e1' in hstore
+    assert '/q/s2/e2' in hstore
+    assert len(hstore) == 14
+
+    # they are linked to their
+    # parent when it is added
+    hstore.add(None, [('/q',    'project', 'Q',  'Proj',   None, None)])
+    hstore.add('/q', [('/q/s1', 'subject', 'S1', 'sub-01', None, None)])
+
+    assert '/p'        not in hstore
+    assert '/q/s2/e2'  in hstore
+    assert hstore.count('experiment', under='/q')    == 1
+    assert hstore.count('experiment', under='/q/s1') == 1
+
+    hstore.add('/q', [])
+    assert '/q/s1/e1' not in hstore
+    assert '/q/s2/e2' in     hstore
+
+
+class MockObject(object):
+    pass
+
+
+def test_cachedFields():
+
+    obj = MockObject()
+    assert store.cachedFields(obj) == {}
+
+    obj._cache      = {'data' : {'Size' : '123', 'digest' : 'abc'}}
+    obj._overwrites = {'Size' : '456'}
+    assert store.cachedFields(obj) == {'Size' : '456', 'digest' : 'abc'}
+
+    # Unexpected forms are ignored
+    obj._cache      = {}
+    obj._overwrites = None
+    assert store.cachedFields(obj) == {}
+    obj._cache      = ['data']
+    obj._overwrites = 'abc'
+    assert store.cachedFields(obj) == {}
+
+
+def test_knownFields():
+
+    obj = MockObject()
+    assert store.knownFields(obj) == (None, None)
+
+    obj._cache      = {'data' : {'Size' : '123'}}
+    obj._overwrites = {'type' : 'T1w'}
+    assert store.knownFields(obj) == (123, 'T1w')
+
+    obj._cache      = {'data' : {'file_size' : 'abc'}}
+    assert store.knownFields(obj) == (None, 'T1w')